@@ -0,0 +1,67 @@
+"""
+Compares how long the event loop is blocked while a coroutine saves JPEGs one
+after another with save() and with asave(), by measuring the longest gap
+between the ticks of a task that wakes up every millisecond.
+
+Run from the repository root with: python -m benchmarks.bench_async
+"""
+
+import asyncio
+import io
+import sys
+import time
+
+from PIL import Image as PILImage
+
+from willow.plugins.pillow import PillowImage
+
+JOBS = 8
+
+
+async def heartbeat(gaps):
+    last = time.perf_counter()
+    while True:
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+
+async def measure(save):
+    gaps = []
+    ticker = asyncio.ensure_future(heartbeat(gaps))
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    for _ in range(JOBS):
+        await save()
+    elapsed = time.perf_counter() - start
+
+    # Let the heartbeat record the last gap
+    await asyncio.sleep(0.01)
+    ticker.cancel()
+    return elapsed * 1000, max(gaps) * 1000
+
+
+def main():
+    # 3000x2000 pixels
+    image = PillowImage(
+        PILImage.radial_gradient("L").resize((3000, 2000)).convert("RGB")
+    )
+
+    async def save():
+        image.save("jpeg", io.BytesIO())
+
+    async def asave():
+        await image.asave("jpeg", io.BytesIO())
+
+    for label, func in [("save():", save), ("asave():", asave)]:
+        elapsed, longest_gap = asyncio.run(measure(func))
+        sys.stdout.write(
+            f"{label:9} {JOBS} saves in {elapsed:7.1f} ms, "
+            f"event loop blocked for up to {longest_gap:7.1f} ms\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares sending decoded 24 megapixel images to a process pool and getting
+them back by pickling against process_batch(), which sends them in shared
+memory.
+
+Run from the repository root with: python -m benchmarks.bench_batch
+"""
+
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image as PILImage
+
+from willow.batch import process_batch
+from willow.image import RGBImageBuffer
+from willow.registry import registry
+
+COUNT = 8
+WORKERS = 2
+OPERATIONS = [("set_background_color_rgb", ((255, 255, 255),))]
+
+
+def run_pickled(image_buffer):
+    return image_buffer.run_operations(OPERATIONS)[-1].to_buffer_rgb()
+
+
+def pickled(image_buffers):
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for _ in executor.map(run_pickled, image_buffers):
+            pass
+
+
+def shared(image_buffers):
+    tasks = ((image_buffer, OPERATIONS) for image_buffer in image_buffers)
+    for _ in process_batch(tasks, max_workers=WORKERS):
+        pass
+
+
+def bench(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    # 6000x4000 pixels
+    image = PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    image_buffers = [RGBImageBuffer(image.size, image.tobytes())] * COUNT
+
+    # Check the plugins once, so neither needs to in the worker processes
+    registry.compile_routes()
+
+    sys.stdout.write(f"{COUNT} images, {WORKERS} workers:\n")
+    sys.stdout.write(f"  pickled:        {bench(pickled, image_buffers):7.1f} ms\n")
+    sys.stdout.write(f"  shared memory:  {bench(shared, image_buffers):7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares cropping and then resizing a 24 megapixel JPEG against doing both in
+one step with crop_and_resize.
+
+Run from the repository root with: python -m benchmarks.bench_crop_and_resize
+"""
+
+import io
+import sys
+import timeit
+
+from PIL import Image as PILImage
+
+from willow.image import Image
+
+RECT = (1000, 500, 5000, 3500)
+SIZE = (800, 600)
+
+
+def make_jpeg():
+    # 6000x4000 pixels
+    image = PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    f = io.BytesIO()
+    image.save(f, "JPEG", quality=90)
+    return f.getvalue()
+
+
+def bench(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    data = make_jpeg()
+    image = Image.open(io.BytesIO(data)).auto_orient()
+
+    separate = bench(lambda: image.crop(RECT).resize(SIZE))
+    fused = bench(lambda: image.crop_and_resize(RECT, SIZE))
+    sys.stdout.write("Decoded image:\n")
+    sys.stdout.write(f"  crop + resize:    {separate:7.1f} ms\n")
+    sys.stdout.write(f"  crop_and_resize:  {fused:7.1f} ms\n")
+
+    separate = bench(
+        lambda: (
+            Image.open(io.BytesIO(data))
+            .crop(RECT)
+            .resize(SIZE)
+            .save_as_jpeg(io.BytesIO())
+        )
+    )
+    fused = bench(
+        lambda: (
+            Image.open(io.BytesIO(data))
+            .crop_and_resize(RECT, SIZE)
+            .save_as_jpeg(io.BytesIO())
+        )
+    )
+    sys.stdout.write("JPEG file to JPEG file:\n")
+    sys.stdout.write(f"  crop + resize:    {separate:7.1f} ms\n")
+    sys.stdout.write(f"  crop_and_resize:  {fused:7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
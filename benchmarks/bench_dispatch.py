@@ -0,0 +1,61 @@
+"""
+Compares calling an operation that isn't defined on the image's class through
+an installed dispatcher against the per-call closure Image.__getattr__ used to
+build.
+
+Run from the repository root with: python -m benchmarks.bench_dispatch
+"""
+
+import sys
+import timeit
+
+from willow.image import RGBImageBuffer
+from willow.registry import registry
+
+
+def get_width(image):
+    return image.size[0]
+
+
+def closure_getattr(image, attr):
+    # What Image.__getattr__ used to do on every operation lookup
+    try:
+        operation, _, conversion_path, _ = registry.find_operation(type(image), attr)
+    except LookupError:
+        raise AttributeError(attr)
+
+    def wrapper(*args, **kwargs):
+        converted = image
+
+        for converter, _ in conversion_path:
+            converted = converter(converted)
+
+        return operation(converted, *args, **kwargs)
+
+    return wrapper
+
+
+def bench(func, number=200_000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    # Registered as a plugin-style operation, so it isn't a method on the class
+    # and has to be dispatched through the registry
+    registry.register_operation(RGBImageBuffer, "get_width", get_width)
+    image = RGBImageBuffer((640, 480), b"")
+
+    # Warm up the route cache and install the dispatcher
+    assert closure_getattr(image, "get_width")() == image.get_width() == 640
+
+    closure = bench(lambda: closure_getattr(image, "get_width")())
+    dispatcher = bench(lambda: image.get_width())
+    method = bench(lambda: image.get_size())
+
+    sys.stdout.write(f"closure via __getattr__:  {closure:7.1f} ns per call\n")
+    sys.stdout.write(f"installed dispatcher:     {dispatcher:7.1f} ns per call\n")
+    sys.stdout.write(f"regular method (baseline): {method:6.1f} ns per call\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures how long importing Willow takes, using ``python -X importtime``, and
+how long it takes to import Willow and read the size of a JPEG.
+
+Image classes are only checked (which imports their image library) the first
+time routing needs them, so importing Willow no longer imports Pillow, Wand or
+OpenCV, and reading the size of a JPEG only imports Pillow.
+
+Run from the repository root with: python -m benchmarks.bench_import
+"""
+
+import re
+import subprocess
+import sys
+
+RUNS = 5
+
+
+def import_time(code):
+    """Returns the cumulative import time of willow in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| willow$", line)
+        if match:
+            return int(match.group(1))
+
+    raise RuntimeError("willow wasn't imported")
+
+
+def wall_time(code):
+    timed = f"import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)"
+    result = subprocess.run(
+        [sys.executable, "-c", timed], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip()) * 1000
+
+
+def main():
+    get_size = (
+        "import willow; from willow.image import Image; "
+        "Image.open(open('tests/images/people.jpg', 'rb')).get_size()"
+    )
+
+    imported = min(import_time("import willow") for _ in range(RUNS))
+    first_operation = min(wall_time(get_size) for _ in range(RUNS))
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            get_size + "; import sys; "
+            "print(' '.join(sorted({'PIL', 'wand', 'cv2'} & set(sys.modules))))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+    sys.stdout.write(f"import willow:                   {imported / 1000:8.1f} ms\n")
+    sys.stdout.write(f"import willow + JPEG get_size(): {first_operation:8.1f} ms\n")
+    sys.stdout.write(f"image libraries imported:        {modules or '(none)'}\n")
+
+
+if __name__ == "__main__":
+    main()
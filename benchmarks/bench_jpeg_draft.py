@@ -0,0 +1,56 @@
+"""
+Compares making a thumbnail of a 24 megapixel JPEG with and without a size
+hint, which lets libjpeg decode the image at a reduced scale.
+
+Run from the repository root with: python -m benchmarks.bench_jpeg_draft
+"""
+
+import io
+import sys
+import timeit
+
+from PIL import Image as PILImage
+
+from willow.image import Image
+
+SIZE = (400, 300)
+
+
+def make_jpeg():
+    # 6000x4000 pixels
+    image = PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    f = io.BytesIO()
+    image.save(f, "JPEG", quality=90)
+    return f.getvalue()
+
+
+def bench(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    data = make_jpeg()
+
+    full = bench(
+        lambda: Image.open(io.BytesIO(data)).resize(SIZE).save_as_jpeg(io.BytesIO())
+    )
+    hinted = bench(
+        lambda: (
+            Image.open(io.BytesIO(data), size_hint=SIZE)
+            .resize(SIZE)
+            .save_as_jpeg(io.BytesIO())
+        )
+    )
+    lazy = bench(
+        lambda: (
+            Image.open(io.BytesIO(data)).lazy().resize(SIZE).save_as_jpeg(io.BytesIO())
+        )
+    )
+
+    sys.stdout.write(f"full decode:       {full:7.1f} ms\n")
+    sys.stdout.write(f"size_hint:         {hinted:7.1f} ms\n")
+    sys.stdout.write(f"lazy (automatic):  {lazy:7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
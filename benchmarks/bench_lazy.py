@@ -0,0 +1,58 @@
+"""
+Compares running a typical rendition pipeline one operation at a time against
+recording it with Image.lazy() and running the optimized operations together.
+
+Run from the repository root with: python -m benchmarks.bench_lazy
+"""
+
+import io
+import sys
+import timeit
+
+from PIL import Image as PILImage
+
+from willow.image import Image
+
+
+def make_png():
+    image = PILImage.linear_gradient("L").resize((3000, 2000)).convert("RGBA")
+    f = io.BytesIO()
+    image.save(f, "PNG")
+    return f.getvalue()
+
+
+def eager(data):
+    return (
+        Image.open(io.BytesIO(data))
+        .crop((100, 100, 2900, 1900))
+        .set_background_color_rgb((255, 255, 255))
+        .crop((200, 200, 2200, 1400))
+        .resize((800, 480))
+        .resize((400, 240))
+        .save_as_jpeg(io.BytesIO())
+    )
+
+
+def lazy(data):
+    return (
+        Image.open(io.BytesIO(data))
+        .lazy()
+        .crop((100, 100, 2900, 1900))
+        .set_background_color_rgb((255, 255, 255))
+        .crop((200, 200, 2200, 1400))
+        .resize((800, 480))
+        .resize((400, 240))
+        .save_as_jpeg(io.BytesIO())
+    )
+
+
+def main():
+    data = make_png()
+
+    for name, func in [("eager", eager), ("lazy", lazy)]:
+        elapsed = min(timeit.repeat(lambda: func(data), number=1, repeat=5))
+        sys.stdout.write(f"{name:5}: {elapsed * 1000:7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
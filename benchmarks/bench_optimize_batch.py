@@ -0,0 +1,78 @@
+"""
+Compares optimizing 16 images one after another with optimize() against
+optimize_batch() with a pool of 4 threads, and shows a time budget stopping an
+optimizer that hangs. The optimizers are stand-ins (``sleep``), so this
+measures how the optimizer subprocesses are scheduled rather than how long
+real ones take.
+
+Run from the repository root with: python -m benchmarks.bench_optimize_batch
+"""
+
+import io
+import logging
+import sys
+import time
+from unittest import mock
+
+from willow.batch import optimize_batch
+from willow.image import Image
+from willow.optimizers.base import OptimizerBase
+
+IMAGES = 16
+
+
+class SleepOptimizer(OptimizerBase):
+    library_name = "sleep"
+
+    @classmethod
+    def get_command_arguments(cls, file_path):
+        return ["0.1"]
+
+
+class HangingOptimizer(OptimizerBase):
+    library_name = "sleep"
+
+    @classmethod
+    def get_command_arguments(cls, file_path):
+        return ["60"]
+
+
+def measure(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    # Don't log a warning for each image the hanging optimizer is stopped on
+    logging.getLogger("willow").setLevel(logging.ERROR)
+
+    files = [io.BytesIO(b"image") for _ in range(IMAGES)]
+
+    with mock.patch(
+        "willow.image.registry.get_optimizers_for_format", return_value=[SleepOptimizer]
+    ):
+        one_by_one = measure(lambda: [Image().optimize(f, "png") for f in files])
+        pooled = measure(
+            lambda: list(optimize_batch(((f, "png") for f in files), max_workers=4))
+        )
+
+    with mock.patch(
+        "willow.image.registry.get_optimizers_for_format",
+        return_value=[SleepOptimizer, HangingOptimizer],
+    ):
+        hanging = measure(
+            lambda: list(
+                optimize_batch(((f, "png") for f in files), max_workers=4, timeout=0.5)
+            )
+        )
+
+    sys.stdout.write(
+        f"one by one:                               {one_by_one:7.1f} ms\n"
+    )
+    sys.stdout.write(f"4 workers:                                {pooled:7.1f} ms\n")
+    sys.stdout.write(f"4 workers, a tool that hangs, 0.5 s each: {hanging:7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares optimizing a PNG with a cold optimizer cache against a warm one,
+where the result is read from the cache instead of running the optimizer. The
+optimizer is a stand-in for a slow one, such as optipng, which takes 100 ms
+to remove the last byte of the file.
+
+Run from the repository root with: python -m benchmarks.bench_optimizer_cache
+"""
+
+import io
+import sys
+import tempfile
+import timeit
+from unittest import mock
+
+from PIL import Image as PILImage
+
+from willow.image import Image
+from willow.optimizers.base import OptimizerBase
+from willow.optimizers.cache import OptimizerCache
+from willow.registry import registry
+
+
+class SlowOptimizer(OptimizerBase):
+    library_name = "sh"
+
+    @classmethod
+    def get_command_arguments(cls, file_path):
+        return ["-c", 'sleep 0.1; truncate -s -1 "$1"', "sh", file_path]
+
+
+def make_png():
+    image = PILImage.radial_gradient("L").resize((1000, 1000)).convert("RGB")
+    f = io.BytesIO()
+    image.save(f, "PNG")
+    return f.getvalue()
+
+
+def bench(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    data = make_png()
+
+    def optimize():
+        Image().optimize(io.BytesIO(data), "png")
+
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        mock.patch(
+            "willow.image.registry.get_optimizers_for_format",
+            return_value=[SlowOptimizer],
+        ),
+    ):
+        cache = OptimizerCache(directory)
+        registry.set_optimizer_cache(cache)
+
+        def optimize_cold():
+            cache.clear()
+            optimize()
+
+        cold = bench(optimize_cold)
+        warm = bench(optimize)
+
+        registry.set_optimizer_cache(None)
+
+    sys.stdout.write(f"{len(data) // 1024} KiB PNG, cold cache: {cold:7.1f} ms\n")
+    sys.stdout.write(f"{len(data) // 1024} KiB PNG, warm cache: {warm:7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares optimizing a batch of small icons and large photos at a fixed effort
+level against choosing one for each image with effort="auto". The optimizer
+is a stand-in for one like optipng, which takes longer per MiB at higher
+efforts (20, 60 and 200 ms) and saves more (4%, 8% and 10% of the file).
+
+Run from the repository root with: python -m benchmarks.bench_optimizer_effort
+"""
+
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from willow.image import Image
+from willow.optimizers.base import OptimizerBase, effort_measurements
+
+ICONS = 20
+ICON_SIZE = 8 * 1024
+PHOTOS = 3
+PHOTO_SIZE = 6 * 1024 * 1024
+
+
+class EffortOptimizer(OptimizerBase):
+    library_name = "sh"
+    effort_arguments = {
+        # Seconds per MiB and percentage of the file saved
+        "fast": ["0.02", "4"],
+        "balanced": ["0.06", "8"],
+        "max": ["0.2", "10"],
+    }
+    default_effort = "max"
+
+    @classmethod
+    def get_command_arguments(cls, file_path, effort=None):
+        return [
+            "-c",
+            'size=$(stat -c %s "$3"); '
+            'sleep $(awk "BEGIN { print $1 * $size / 1048576 }"); '
+            'truncate -s $((size - size * $2 / 100)) "$3"',
+            "sh",
+            *cls.get_effort_arguments(effort),
+            file_path,
+        ]
+
+
+def optimize_all(directory, effort):
+    paths = []
+    for i, size in enumerate([ICON_SIZE] * ICONS + [PHOTO_SIZE] * PHOTOS):
+        path = os.path.join(directory, f"{i}.png")
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        paths.append(path)
+
+    start = time.perf_counter()
+    for path in paths:
+        Image().optimize(path, "png", effort=effort)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    saved = sum(ICON_SIZE if i < ICONS else PHOTO_SIZE for i in range(len(paths)))
+    saved -= sum(os.path.getsize(path) for path in paths)
+    return elapsed, saved
+
+
+def main():
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        mock.patch(
+            "willow.image.registry.get_optimizers_for_format",
+            return_value=[EffortOptimizer],
+        ),
+    ):
+        for effort in ["max", "balanced", "fast", "auto"]:
+            elapsed, saved = optimize_all(directory, effort)
+            sys.stdout.write(
+                f"{effort + ':':10} {elapsed:7.1f} ms, {saved // 1024:5} KiB saved\n"
+            )
+
+    sys.stdout.write("\nmeasured:\n")
+    for (_, effort), measurement in effort_measurements.items():
+        saved = measurement.input_size - measurement.output_size
+        sys.stdout.write(
+            f"{effort + ':':10} {measurement.count:3} runs, "
+            f"{saved / measurement.seconds / 1024:7.0f} KiB saved per second\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measures what recording optimizer metrics costs per run, with and without a
+MetricsAggregator and a StatsdSink, and how much time skipping an optimizer
+that saves nothing (with min_savings) gives back over 200 images. The
+optimizer is a stand-in that takes 20 ms and leaves the image as it was.
+
+Run from the repository root with: python -m benchmarks.bench_optimizer_metrics
+"""
+
+import io
+import sys
+import time
+import timeit
+from unittest import mock
+
+from willow.image import Image
+from willow.optimizers import metrics
+from willow.optimizers.base import OptimizerBase
+
+IMAGES = 200
+
+
+class NoopOptimizer(OptimizerBase):
+    library_name = "sleep"
+
+    @classmethod
+    def get_command_arguments(cls, file_path):
+        return ["0.02"]
+
+
+def bench(func, number=10000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def record():
+    NoopOptimizer._record(None, 1000, 900, metrics.get_times())
+
+
+def optimize_all():
+    start = time.perf_counter()
+    for _ in range(IMAGES):
+        Image().optimize(io.BytesIO(b"image"), "png")
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    without_sinks = bench(record)
+
+    aggregator = metrics.MetricsAggregator()
+    statsd = metrics.StatsdSink("127.0.0.1", 8125)
+    metrics.add_sink(aggregator)
+    metrics.add_sink(statsd)
+    with_sinks = bench(record)
+    metrics.remove_sink(aggregator)
+    metrics.remove_sink(statsd)
+    statsd.close()
+
+    sys.stdout.write(
+        f"recording a run, no sinks:              {without_sinks:6.1f} us\n"
+    )
+    sys.stdout.write(f"recording a run, aggregator and statsd: {with_sinks:6.1f} us\n")
+
+    with mock.patch(
+        "willow.image.registry.get_optimizers_for_format",
+        return_value=[NoopOptimizer],
+    ):
+        metrics.optimizer_stats.reset()
+        always = optimize_all()
+
+        metrics.optimizer_stats.reset()
+        NoopOptimizer.min_savings = 0.01
+        skipped = optimize_all()
+
+    sys.stdout.write(f"{IMAGES} images, always run:               {always:7.1f} ms\n")
+    sys.stdout.write(f"{IMAGES} images, min_savings=0.01:         {skipped:7.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
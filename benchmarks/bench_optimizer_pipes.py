@@ -0,0 +1,80 @@
+"""
+Compares the overhead of getting an in-memory image to an optimizer and back
+through a temporary file on disk, a temporary file in /dev/shm and a pipe. The
+optimizer is a stand-in (``dd``) that copies the image without changing it,
+so only the transfer and the subprocess are measured. The last line for each
+size is optimize() with an optimizer that supports both, which only pipes
+images up to MAX_PIPE_SIZE.
+
+Run from the repository root with: python -m benchmarks.bench_optimizer_pipes
+"""
+
+import io
+import os
+import sys
+import timeit
+from unittest import mock
+
+from willow.image import Image
+from willow.optimizers.base import OptimizerBase
+from willow.optimizers.runner import _get_temporary_directory
+
+SIZES = [256 * 1024, 8 * 1024 * 1024]
+
+
+class FileOptimizer(OptimizerBase):
+    library_name = "dd"
+
+    @classmethod
+    def get_command_arguments(cls, file_path):
+        return [f"if={file_path}", f"of={file_path}", "bs=1M", "conv=notrunc"]
+
+
+class PipeOptimizer(FileOptimizer):
+    supports_pipes = True
+
+    @classmethod
+    def get_pipe_command_arguments(cls):
+        return ["bs=1M", "status=none"]
+
+
+def bench(func, repeat=20):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def run(optimizer, data):
+    f = io.BytesIO(data)
+    with mock.patch(
+        "willow.image.registry.get_optimizers_for_format", return_value=[optimizer]
+    ):
+        Image().optimize(f, "png")
+
+
+def main():
+    for size in SIZES:
+        data = os.urandom(size)
+        label = f"{size // 1024} KiB image"
+
+        _get_temporary_directory.cache_clear()
+        with mock.patch.dict(os.environ, {"TMPDIR": "/tmp"}):
+            on_disk = bench(lambda: run(FileOptimizer, data))
+
+        _get_temporary_directory.cache_clear()
+        with mock.patch.dict(os.environ):
+            os.environ.pop("TMPDIR", None)
+            in_shared_memory = bench(lambda: run(FileOptimizer, data))
+
+        piped = bench(lambda: PipeOptimizer.process_bytes(data))
+        chosen = bench(lambda: run(PipeOptimizer, data))
+
+        sys.stdout.write(f"{label}, temporary file in /tmp:     {on_disk:6.1f} ms\n")
+        if _get_temporary_directory() is not None:
+            sys.stdout.write(
+                f"{label}, temporary file in /dev/shm: {in_shared_memory:6.1f} ms\n"
+            )
+        sys.stdout.write(f"{label}, piped:                      {piped:6.1f} ms\n")
+        sys.stdout.write(f"{label}, optimize():                 {chosen:6.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Compares reading the metadata of a 24 megapixel JPEG by decoding it against
+reading it from the file's header.
+
+Run from the repository root with: python -m benchmarks.bench_probe
+"""
+
+import io
+import sys
+import timeit
+
+from PIL import Image as PILImage
+
+from willow.image import Image, JPEGImageFile
+from willow.plugins.pillow import PillowImage
+
+
+def make_jpeg():
+    # 6000x4000 pixels
+    image = PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    f = io.BytesIO()
+    image.save(f, "JPEG", quality=90)
+    return f.getvalue()
+
+
+def bench(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    data = make_jpeg()
+
+    decoded = bench(
+        lambda: PillowImage.open(JPEGImageFile(io.BytesIO(data))).get_size()
+    )
+    probed = bench(lambda: Image.open(io.BytesIO(data)).get_size())
+    metadata = bench(lambda: Image.open(io.BytesIO(data)).get_metadata())
+
+    sys.stdout.write(f"decode + get_size:  {decoded:7.2f} ms\n")
+    sys.stdout.write(f"get_size:           {probed:7.2f} ms\n")
+    sys.stdout.write(f"get_metadata:       {metadata:7.2f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
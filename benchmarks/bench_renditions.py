@@ -0,0 +1,76 @@
+"""
+Compares making a set of srcset renditions of a 24 megapixel JPEG one at a
+time against making them together with Image.make_renditions(), with and
+without a thread pool.
+
+Run from the repository root with: python -m benchmarks.bench_renditions
+"""
+
+import io
+import os
+import sys
+import timeit
+
+from PIL import Image as PILImage
+
+from willow.image import Image
+
+SIZES = [(2400, 1600), (1600, 1066), (800, 533), (400, 266)]
+FORMATS = ["jpeg", "webp"]
+
+
+def make_jpeg():
+    # 6000x4000 pixels
+    image = PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    f = io.BytesIO()
+    image.save(f, "JPEG", quality=90)
+    return f.getvalue()
+
+
+def get_renditions():
+    return [
+        [
+            "auto_orient",
+            ("resize", (size,)),
+            (f"save_as_{image_format}", (io.BytesIO(),)),
+        ]
+        for size in SIZES
+        for image_format in FORMATS
+    ]
+
+
+def separately(data):
+    for operations in get_renditions():
+        Image.open(io.BytesIO(data)).run_operations(operations)
+
+
+def together(data, max_workers=None):
+    Image.open(io.BytesIO(data)).make_renditions(
+        get_renditions(), max_workers=max_workers
+    )
+
+
+def bench(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    data = make_jpeg()
+
+    separate = bench(lambda: separately(data))
+    combined = bench(lambda: together(data))
+    threaded = bench(lambda: together(data, max_workers=os.cpu_count()))
+
+    sys.stdout.write(f"{len(SIZES) * len(FORMATS)} renditions:\n")
+    sys.stdout.write(f"  one at a time:    {separate:7.1f} ms\n")
+    sys.stdout.write(
+        f"  make_renditions:  {combined:7.1f} ms ({separate / combined:.1f}x faster)\n"
+    )
+    label = f"{os.cpu_count()} threads:"
+    sys.stdout.write(
+        f"  {label:17} {threaded:7.1f} ms ({separate / threaded:.1f}x faster)\n"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Compares the speed of resizing a 24 megapixel image to a preview with the
+different resampling filters, with and without a reducing_gap.
+
+Run from the repository root with: python -m benchmarks.bench_resize
+"""
+
+import sys
+import timeit
+
+from PIL import Image as PILImage
+
+from willow.plugins.pillow import PillowImage
+
+SIZE = (800, 533)
+
+
+def bench(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    # 6000x4000 pixels
+    image = PillowImage(
+        PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    )
+
+    baseline = bench(lambda: image.resize(SIZE))
+    sys.stdout.write(f"lanczos (default):          {baseline:7.1f} ms\n")
+
+    for resample, reducing_gap in [
+        ("lanczos", 3.0),
+        ("lanczos", 2.0),
+        ("bicubic", 2.0),
+        ("bilinear", 2.0),
+        ("bilinear", None),
+        ("nearest", None),
+    ]:
+        elapsed = bench(
+            lambda: image.resize(SIZE, resample=resample, reducing_gap=reducing_gap)
+        )
+        label = f"{resample}, reducing_gap={reducing_gap}:"
+        sys.stdout.write(
+            f"{label:27} {elapsed:7.1f} ms ({baseline / elapsed:.1f}x faster)\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares route finding in WillowRegistry against the old exhaustive search.
+
+The synthetic registry is a layered graph: every image class can be converted
+into every image class in the next layer, so the number of distinct paths grows
+exponentially with the number of layers while Dijkstra only visits each class
+once.
+
+Run from the repository root with: python -m benchmarks.bench_routing
+"""
+
+import sys
+import timeit
+
+from willow.image import Image
+from willow.registry import WillowRegistry
+
+LAYER_WIDTH = 3
+
+
+def build_registry(layers):
+    registry = WillowRegistry()
+    grid = [
+        [type(f"Image{layer}x{i}", (Image,), {}) for i in range(LAYER_WIDTH)]
+        for layer in range(layers)
+    ]
+
+    for layer in grid:
+        for image_class in layer:
+            registry.register_image_class(image_class)
+
+    for layer, next_layer in zip(grid, grid[1:]):
+        for i, from_class in enumerate(layer):
+            for j, to_class in enumerate(next_layer):
+                registry.register_converter(
+                    from_class, to_class, f"{from_class.__name__}->{to_class.__name__}"
+                )
+                registry._registered_converter_costs[from_class, to_class] = (
+                    100 + (i * 7 + j * 13) % 50
+                )
+
+    return registry, grid[0][0], grid[-1][-1]
+
+
+def exhaustive_shortest_path(registry, start, end):
+    # The algorithm WillowRegistry.find_shortest_path used before it switched
+    # to Dijkstra: cost up every path and keep the cheapest one
+    best_path, best_cost = None, None
+    for path in registry.find_all_paths(start, end):
+        cost = registry.get_path_cost(start, path)
+        if best_cost is None or cost < best_cost:
+            best_path, best_cost = path, cost
+    return best_path, best_cost
+
+
+def bench(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    sys.stdout.write(f"{'classes':>8} {'dijkstra (us)':>15} {'exhaustive (us)':>17}\n")
+
+    for layers in (4, 6, 8, 10, 20, 40):
+        registry, start, end = build_registry(layers)
+
+        # Call find_closest_image_class so the route cache isn't used
+        dijkstra = bench(lambda: registry.find_closest_image_class(start, [end]), 200)
+
+        if layers <= 10:
+            assert (
+                exhaustive_shortest_path(registry, start, end)[1]
+                == (registry.find_shortest_path(start, end)[1])
+            )
+            exhaustive = bench(
+                lambda: exhaustive_shortest_path(registry, start, end), 1
+            )
+            exhaustive = f"{exhaustive:17.1f}"
+        else:
+            exhaustive = f"{'(skipped)':>17}"
+
+        sys.stdout.write(f"{layers * LAYER_WIDTH:>8} {dijkstra:15.1f} {exhaustive}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compares detecting the format of a 200 MB file that isn't an image by scanning
+it line by line (as Image.maybe_xml used to) against reading only its header.
+
+Run from the repository root with: python -m benchmarks.bench_sniffing
+"""
+
+import re
+import sys
+import timeit
+from tempfile import TemporaryFile
+
+from willow.image import Image, UnrecognisedImageFormatError
+
+SIZE = 200 * 1024 * 1024
+
+
+def make_file():
+    # Binary data without any newlines, starting with something that might be
+    # an XML document
+    f = TemporaryFile()
+    chunk = b"\x00" * (1024 * 1024)
+    f.write(b"<")
+    for _ in range(SIZE // len(chunk)):
+        f.write(chunk)
+    f.seek(0)
+    return f
+
+
+def scan_lines(f):
+    f.seek(0)
+    pattern = re.compile(rb"^\s*<")
+    for line in f:
+        if pattern.match(line):
+            f.seek(0)
+            return True
+    f.seek(0)
+    return False
+
+
+def open_image(f):
+    try:
+        Image.open(f)
+    except UnrecognisedImageFormatError:
+        pass
+
+
+def bench(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    with make_file() as f:
+        scanned = bench(lambda: scan_lines(f))
+        sniffed = bench(lambda: open_image(f))
+
+    sys.stdout.write(f"scan every line:   {scanned:9.2f} ms\n")
+    sys.stdout.write(f"read header only:  {sniffed:9.2f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
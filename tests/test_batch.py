@@ -0,0 +1,251 @@
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+from willow.batch import BatchResult, _load_routes, optimize_batch, process_batch
+from willow.image import (
+    Image,
+    JPEGImageFile,
+    PNGImageFile,
+    RGBAImageBuffer,
+    RGBImageBuffer,
+)
+from willow.optimizers.base import OptimizerBase
+from willow.plugins.pillow import PillowImage
+from willow.registry import registry
+
+
+class CrashingPath(os.PathLike):
+    # Kills the worker process when it's unpickled there
+    def __fspath__(self):
+        return "tests/images/people.jpg"
+
+    def __reduce__(self):
+        return (os._exit, (1,))
+
+
+def list_shared_memory():
+    return set(os.listdir("/dev/shm"))
+
+
+class TestProcessBatch(unittest.TestCase):
+    def test_process_files(self):
+        with open("tests/images/flower.jpg", "rb") as f:
+            data = f.read()
+
+        results = list(
+            process_batch(
+                [
+                    (
+                        "tests/images/people.jpg",
+                        [("resize", ((60, 40),)), ("save_as_jpeg", (io.BytesIO(),))],
+                    ),
+                    (data, [("resize", ((48, 36),)), ("save_as_png", (io.BytesIO(),))]),
+                    (data, ["get_size"]),
+                ],
+                max_workers=2,
+            )
+        )
+
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[0].value, JPEGImageFile)
+        self.assertEqual(Image.open(results[0].value.f).get_size(), (60, 40))
+        self.assertIsInstance(results[1].value, PNGImageFile)
+        self.assertEqual(Image.open(results[1].value.f).get_size(), (48, 36))
+        self.assertEqual(results[2], BatchResult((480, 360), None))
+
+    def test_images_are_sent_as_buffers(self):
+        with open("tests/images/transparent.png", "rb") as f:
+            image = PillowImage.open(PNGImageFile(f))
+
+        results = list(
+            process_batch(
+                [
+                    (image, [("resize", ((100, 75),))]),
+                    (RGBImageBuffer((4, 2), bytes(range(24))), []),
+                ],
+                max_workers=1,
+            )
+        )
+
+        self.assertIsInstance(results[0].value, RGBAImageBuffer)
+        self.assertEqual(results[0].value.size, (100, 75))
+        self.assertEqual(len(results[0].value.data), 100 * 75 * 4)
+        self.assertIsInstance(results[1].value, RGBImageBuffer)
+        self.assertEqual(results[1].value.data, bytes(range(24)))
+
+    def test_errors_are_isolated(self):
+        results = list(
+            process_batch(
+                [
+                    ("tests/images/people.jpg", ["get_size"]),
+                    ("tests/images/missing.jpg", ["get_size"]),
+                    ("tests/images/people.jpg", ["unknown_operation"]),
+                    (object(), ["get_size"]),
+                    (RGBImageBuffer((2, 2), bytes(12)), ["unknown_operation"]),
+                    ("tests/images/flower.jpg", ["get_size"]),
+                ],
+                max_workers=2,
+            )
+        )
+
+        self.assertEqual(results[0], BatchResult((600, 400), None))
+        self.assertIsInstance(results[1].error, FileNotFoundError)
+        self.assertIsInstance(results[2].error, LookupError)
+        self.assertIsInstance(results[3].error, TypeError)
+        self.assertIsInstance(results[4].error, LookupError)
+        self.assertEqual(results[5], BatchResult((480, 360), None))
+
+    def test_worker_process_dying(self):
+        results = list(
+            process_batch(
+                [
+                    (CrashingPath(), ["get_size"]),
+                    ("tests/images/people.jpg", ["get_size"]),
+                ],
+                max_workers=1,
+                max_pending=1,
+            )
+        )
+
+        self.assertIsInstance(results[0].error, BrokenProcessPool)
+        self.assertEqual(results[1], BatchResult((600, 400), None))
+
+    def test_tasks_are_read_as_results_are_consumed(self):
+        tasks_read = 0
+
+        def tasks():
+            nonlocal tasks_read
+            for _ in range(10):
+                tasks_read += 1
+                yield ("tests/images/people.jpg", ["get_size"])
+
+        results = process_batch(tasks(), max_workers=1, max_pending=3)
+        next(results)
+
+        self.assertEqual(tasks_read, 4)
+
+        self.assertEqual(len(list(results)), 9)
+        self.assertEqual(tasks_read, 10)
+
+    def test_workers_load_the_routes(self):
+        # Workers that aren't forked from this process (with the spawn or
+        # forkserver start methods) are given the routes when they start
+        with mock.patch(
+            "willow.batch.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+        ) as mock_pool:
+            results = list(
+                process_batch(
+                    [("tests/images/people.jpg", ["get_size"])], max_workers=1
+                )
+            )
+
+        self.assertEqual(results, [BatchResult((600, 400), None)])
+        self.assertEqual(mock_pool.call_args.kwargs["initializer"], _load_routes)
+        self.assertEqual(
+            mock_pool.call_args.kwargs["initargs"], (registry.dump_routes(),)
+        )
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "Requires /dev/shm")
+    def test_shared_memory_is_freed(self):
+        before = list_shared_memory()
+
+        with open("tests/images/people.jpg", "rb") as f:
+            data = f.read()
+
+        image_buffer = RGBImageBuffer((30, 20), bytes(30 * 20 * 3))
+        tasks = [(data, [("resize", ((60, 40),))]) for _ in range(3)]
+        tasks += [(image_buffer, ["unknown_operation"]), (image_buffer, [])] * 2
+        list(process_batch(tasks, max_workers=2))
+
+        # Including when not all of the results are consumed
+        results = process_batch(tasks, max_workers=2)
+        next(results)
+        results.close()
+
+        self.assertEqual(list_shared_memory(), before)
+
+
+class TestOptimizeBatch(unittest.TestCase):
+    class DummyOptimizer(OptimizerBase):
+        # Appends to the file, in a real subprocess
+        library_name = sys.executable
+        image_format = "png"
+        supports_pipes = True
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+        @classmethod
+        def get_pipe_command_arguments(cls) -> list[str]:
+            return [
+                "-c",
+                "import sys; sys.stdout.buffer.write(sys.stdin.buffer.read() + b'+optimized')",
+            ]
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            registry.register_optimizer(self.DummyOptimizer)
+
+    def tearDown(self):
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+
+    def test_optimize_files(self):
+        files = [io.BytesIO(b"image %d" % i) for i in range(5)]
+        results = list(
+            optimize_batch(
+                [(f, "png") for f in files] + [(b"jpeg image", "jpeg")], max_workers=2
+            )
+        )
+
+        self.assertEqual(
+            [result.value.getvalue() for result in results[:5]],
+            [b"image %d+optimized" % i for i in range(5)],
+        )
+        self.assertEqual(results[5], BatchResult(b"jpeg image", None))
+
+    def test_errors_are_isolated(self):
+        f = io.BytesIO(b"image")
+        results = list(optimize_batch([(None, "png"), (f, "png")], max_workers=1))
+
+        self.assertIsInstance(results[0].error, TypeError)
+        self.assertEqual(results[1], BatchResult(f, None))
+        self.assertEqual(f.getvalue(), b"image+optimized")
+
+    def test_timeout(self):
+        with mock.patch("willow.batch.optimize_image_file") as mock_optimize:
+            list(optimize_batch([(b"image", "png")], timeout=5))
+
+        mock_optimize.assert_called_once_with(b"image", "png", timeout=5)
+
+    def test_max_workers(self):
+        lock = threading.Lock()
+        running = 0
+        most_running = 0
+
+        def optimize(image_file, image_format, timeout):
+            nonlocal running, most_running
+            with lock:
+                running += 1
+                most_running = max(most_running, running)
+
+            time.sleep(0.05)
+
+            with lock:
+                running -= 1
+
+        with mock.patch("willow.batch.optimize_image_file", side_effect=optimize):
+            results = list(
+                optimize_batch([(b"image", "png")] * 10, max_workers=3, max_pending=6)
+            )
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(most_running, 3)
@@ -1,12 +1,27 @@
+import asyncio
+import errno
 import io
 import os
+import sys
+import threading
+import time
 import unittest
-from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import (
+    NamedTemporaryFile,
+    SpooledTemporaryFile,
+    TemporaryDirectory,
+    gettempdir,
+)
 from unittest import mock
 from xml.etree.ElementTree import ParseError as XMLParseError
 
+from PIL import Image as PILImage
+
 from willow.image import (
+    HEADER_SIZE,
     AvifImageFile,
+    BadImageOperationError,
     BMPImageFile,
     GIFImageFile,
     HeicImageFile,
@@ -14,13 +29,23 @@ from willow.image import (
     Image,
     ImageFile,
     JPEGImageFile,
+    LazyImage,
     PNGImageFile,
+    RGBImageBuffer,
     SvgImageFile,
     TIFFImageFile,
     UnrecognisedImageFormatError,
     WebPImageFile,
 )
-from willow.optimizers.base import OptimizerBase
+from willow.optimizers import metrics
+from willow.optimizers.base import OptimizerBase, effort_measurements
+from willow.optimizers.cache import OptimizerCache
+from willow.optimizers.runner import (
+    MAX_PIPE_SIZE,
+    SHARED_MEMORY_DIRECTORY,
+    _get_temporary_directory,
+    _make_temporary_file,
+)
 from willow.registry import registry
 
 
@@ -107,6 +132,52 @@ class TestDetectImageFormatFromStream(unittest.TestCase):
         with self.assertRaises(XMLParseError):
             Image.open(f)
 
+    def test_opens_svg_with_prolog(self):
+        f = io.BytesIO(
+            b"\xef\xbb\xbf<?xml version='1.0' encoding='utf-8'?>\n"
+            b"<!-- <html> -->\n"
+            b'<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" '
+            b'"http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+            b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        )
+        image = Image.open(f)
+        self.assertIsInstance(image, SvgImageFile)
+
+    def test_opens_svg_with_namespace_prefix(self):
+        f = io.BytesIO(b'<svg:svg xmlns:svg="http://www.w3.org/2000/svg"></svg:svg>')
+        image = Image.open(f)
+        self.assertIsInstance(image, SvgImageFile)
+
+    def test_raises_error_on_xml_that_isnt_svg(self):
+        f = io.BytesIO(b"<?xml version='1.0'?><html><svg></svg></html>")
+        with self.assertRaises(UnrecognisedImageFormatError):
+            Image.open(f)
+
+    def test_only_reads_header(self):
+        class ReadCountingBytesIO(io.BytesIO):
+            bytes_read = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                self.bytes_read += len(data)
+                return data
+
+            def __iter__(self):
+                raise AssertionError("Image.open shouldn't read lines")
+
+        f = ReadCountingBytesIO(b"<" + b"\x00" * (HEADER_SIZE * 4))
+
+        with self.assertRaises(UnrecognisedImageFormatError):
+            Image.open(f)
+
+        self.assertLessEqual(f.bytes_read, HEADER_SIZE)
+        self.assertTrue(Image.maybe_xml(f))
+        self.assertLessEqual(f.bytes_read, HEADER_SIZE * 2)
+
+    def test_maybe_xml(self):
+        self.assertTrue(Image.maybe_xml(io.BytesIO(b"  \n<root/>")))
+        self.assertFalse(Image.maybe_xml(io.BytesIO(b"text\n<root/>")))
+
 
 class TestImageFormats(unittest.TestCase):
     """
@@ -258,6 +329,483 @@ class TestSaveImage(unittest.TestCase):
         self.assertFalse(image.save_as_jpeg.mock_calls)
 
 
+class TestOperationDispatch(unittest.TestCase):
+    def setUp(self):
+        with open("tests/images/transparent.png", "rb") as f:
+            self.image = Image.open(io.BytesIO(f.read()))
+
+    def test_operation_is_a_bound_method(self):
+        get_size = self.image.get_size
+
+        self.assertIs(get_size.__self__, self.image)
+        self.assertEqual(get_size(), (200, 150))
+
+    def test_operation_is_installed_on_image_class(self):
+        self.image.has_alpha()
+
+        self.assertIn("has_alpha", vars(PNGImageFile))
+        self.assertTrue(self.image.has_alpha())
+
+    def test_unknown_operation(self):
+        with self.assertRaises(AttributeError):
+            self.image.unknown_operation
+
+        self.assertFalse(hasattr(self.image, "unknown_operation"))
+
+
+class TestRunOperations(unittest.TestCase):
+    def setUp(self):
+        with open("tests/images/transparent.png", "rb") as f:
+            self.image = Image.open(io.BytesIO(f.read()))
+
+    def test_run_operations(self):
+        output = io.BytesIO()
+
+        results = self.image.run_operations(
+            [
+                "auto_orient",
+                ("resize", ((100, 75),)),
+                "get_size",
+                ("set_background_color_rgb", ((255, 0, 0),)),
+                ("save_as_jpeg", (output,), {"quality": 50}),
+            ]
+        )
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[2], (100, 75))
+        self.assertIsInstance(results[4], JPEGImageFile)
+        self.assertEqual(Image.open(output).get_size(), (100, 75))
+
+    def test_run_operations_matches_running_separately(self):
+        expected = self.image.resize((50, 50)).has_alpha()
+
+        results = self.image.run_operations([("resize", ((50, 50),)), "has_alpha"])
+
+        self.assertEqual(results[1], expected)
+
+    def test_run_unknown_operation(self):
+        with self.assertRaises(LookupError):
+            self.image.run_operations(["get_size", "unknown_operation"])
+
+    def test_operations_that_dont_return_an_image_dont_decode_it_again(self):
+        with open("tests/images/flower.jpg", "rb") as f:
+            image = Image.open(io.BytesIO(f.read()))
+
+        with mock.patch.object(PILImage, "open", wraps=PILImage.open) as mock_open:
+            results = image.run_operations(["get_size", ("resize", ((10, 10),))])
+
+        self.assertEqual(results[0], (480, 360))
+        self.assertEqual(results[1].get_size(), (10, 10))
+        mock_open.assert_called_once()
+
+
+class TestMakeRenditions(unittest.TestCase):
+    def setUp(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            self.image = Image.open(io.BytesIO(f.read()))
+
+    def test_make_renditions(self):
+        outputs = [io.BytesIO() for _ in range(3)]
+
+        results = self.image.make_renditions(
+            [
+                [
+                    "auto_orient",
+                    ("resize", ((150, 100),)),
+                    ("save_as_png", (outputs[0],)),
+                ],
+                [
+                    "auto_orient",
+                    ("resize", ((300, 200),)),
+                    ("save_as_webp", (outputs[1],)),
+                ],
+                [
+                    "auto_orient",
+                    ("resize", ((300, 200),)),
+                    ("save_as_jpeg", (outputs[2],), {"quality": 50}),
+                ],
+            ]
+        )
+
+        self.assertIsInstance(results[0], PNGImageFile)
+        self.assertIsInstance(results[1], WebPImageFile)
+        self.assertIsInstance(results[2], JPEGImageFile)
+        self.assertEqual(Image.open(outputs[0]).get_size(), (150, 100))
+        self.assertEqual(Image.open(outputs[1]).get_size(), (300, 200))
+        self.assertEqual(Image.open(outputs[2]).get_size(), (300, 200))
+
+    def test_renditions_without_a_resize(self):
+        results = self.image.make_renditions(
+            [
+                ["auto_orient", "get_size"],
+                ["auto_orient", ("crop", ((0, 0, 100, 100),)), "get_size"],
+                [("resize", ((60, 40),))],
+                [],
+            ]
+        )
+
+        self.assertEqual(results[0], (600, 400))
+        self.assertEqual(results[1], (100, 100))
+        self.assertEqual(results[2].get_size(), (60, 40))
+        self.assertIs(results[3], self.image)
+
+    def test_image_is_decoded_once(self):
+        with mock.patch.object(PILImage, "open", wraps=PILImage.open) as mock_open:
+            self.image.make_renditions(
+                [
+                    ["auto_orient", ("resize", ((300, 200),)), "get_size"],
+                    ["auto_orient", ("resize", ((150, 100),)), "get_size"],
+                    ["auto_orient", "has_alpha"],
+                ]
+            )
+
+        mock_open.assert_called_once()
+
+    def test_resizes_from_the_previous_rendition(self):
+        sizes = []
+        resize = PILImage.Image.resize
+
+        def record_resize(image, size, *args, **kwargs):
+            sizes.append((image.size, tuple(size)))
+            return resize(image, size, *args, **kwargs)
+
+        with mock.patch.object(PILImage.Image, "resize", record_resize):
+            results = self.image.make_renditions(
+                [
+                    [("resize", ((150, 100),)), "get_size"],
+                    [("resize", ((300, 200),)), "get_size"],
+                    [("resize", ((150, 100),)), "has_alpha"],
+                    [("resize", ((300, 150),)), "get_size"],
+                    [("resize", ((150, 100), "nearest")), "get_size"],
+                ]
+            )
+
+        self.assertEqual(
+            results, [(150, 100), (300, 200), False, (300, 150), (150, 100)]
+        )
+
+        # The 600x400 image is decoded at 300x200, as that's all that's needed
+        self.assertEqual(
+            sizes,
+            [
+                ((300, 200), (300, 200)),
+                ((300, 200), (300, 150)),
+                ((300, 150), (150, 100)),
+                # Different resampling options resize from the original
+                ((300, 200), (150, 100)),
+            ],
+        )
+
+    def test_size_hint_is_large_enough_for_every_rendition(self):
+        sizes = []
+        resize = PILImage.Image.resize
+
+        def record_resize(image, size, *args, **kwargs):
+            sizes.append(image.size)
+            return resize(image, size, *args, **kwargs)
+
+        with mock.patch.object(PILImage.Image, "resize", record_resize):
+            results = self.image.make_renditions(
+                [
+                    [("resize", ((100, 60),)), "get_size"],
+                    [("resize", ((70, 80),)), "get_size"],
+                ]
+            )
+
+        self.assertEqual(results, [(100, 60), (70, 80)])
+
+        # Decoded at 1/4 scale, which is the smallest that's at least 100x80
+        self.assertEqual(sizes[0], (150, 100))
+
+
+class TestMakeRenditionsInThreads(unittest.TestCase):
+    def setUp(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            self.image = Image.open(io.BytesIO(f.read()))
+
+    def get_renditions(self):
+        return [
+            [
+                "auto_orient",
+                ("resize", (size,)),
+                (f"save_as_{image_format}", (io.BytesIO(),)),
+            ]
+            for size in [(300, 200), (150, 100), (60, 40)]
+            for image_format in ["jpeg", "png"]
+        ]
+
+    def test_matches_making_renditions_one_at_a_time(self):
+        expected = self.image.make_renditions(self.get_renditions())
+
+        results = self.image.make_renditions(self.get_renditions(), max_workers=4)
+
+        self.assertEqual(
+            [result.f.getvalue() for result in results],
+            [result.f.getvalue() for result in expected],
+        )
+
+    def test_operations_on_the_same_image_dont_overlap(self):
+        lock = threading.Lock()
+        saving = set()
+        overlapped = []
+        save = PILImage.Image.save
+
+        def record_save(image, *args, **kwargs):
+            with lock:
+                if id(image) in saving:
+                    overlapped.append(image)
+
+                saving.add(id(image))
+
+            try:
+                time.sleep(0.01)
+                return save(image, *args, **kwargs)
+            finally:
+                with lock:
+                    saving.discard(id(image))
+
+        with mock.patch.object(PILImage.Image, "save", record_save):
+            self.image.make_renditions(self.get_renditions(), max_workers=6)
+
+        self.assertEqual(overlapped, [])
+
+    def test_image_is_converted_in_the_workers(self):
+        threads = []
+        open_image = PILImage.open
+
+        def record_open(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return open_image(*args, **kwargs)
+
+        with mock.patch.object(PILImage, "open", record_open):
+            self.image.make_renditions(
+                [
+                    [("resize", ((60, 40),)), "get_size"],
+                    [("resize", ((30, 20),)), "get_size"],
+                ],
+                max_workers=2,
+            )
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(LookupError):
+            self.image.make_renditions(
+                [
+                    [("resize", ((60, 40),)), "get_size"],
+                    [("resize", ((30, 20),)), "unknown_operation"],
+                ],
+                max_workers=2,
+            )
+
+
+class TestLazyImage(unittest.TestCase):
+    def setUp(self):
+        with open("tests/images/transparent.png", "rb") as f:
+            self.image = Image.open(io.BytesIO(f.read()))
+
+    def test_operations_are_recorded(self):
+        lazy = self.image.lazy().auto_orient().crop((10, 10, 110, 110))
+
+        self.assertIsInstance(lazy, LazyImage)
+        self.assertEqual(
+            lazy.operations, (("auto_orient", ()), ("crop", ((10, 10, 110, 110),)))
+        )
+        self.assertIsNone(lazy._result)
+
+    def test_save(self):
+        output = io.BytesIO()
+
+        result = (
+            self.image.lazy()
+            .auto_orient()
+            .crop((10, 10, 110, 110))
+            .resize((50, 50))
+            .set_background_color_rgb((255, 0, 0))
+            .save_as_jpeg(output, quality=50)
+        )
+
+        self.assertIsInstance(result, JPEGImageFile)
+        self.assertEqual(Image.open(output).get_size(), (50, 50))
+
+    def test_matches_running_separately(self):
+        expected = (
+            self.image.crop((10, 20, 190, 140))
+            .set_background_color_rgb((0, 255, 0))
+            .crop((-10, 5, 100, 100))
+            .crop((0, 0, 500, 500))
+            .get_pillow_image()
+        )
+
+        lazy = (
+            self.image.lazy()
+            .crop((10, 20, 190, 140))
+            .set_background_color_rgb((0, 255, 0))
+            .crop((-10, 5, 100, 100))
+            .crop((0, 0, 500, 500))
+        )
+        result = lazy.get_pillow_image()
+
+        self.assertEqual(result.size, expected.size)
+        self.assertEqual(result.mode, expected.mode)
+        self.assertEqual(result.tobytes(), expected.tobytes())
+
+    def test_svg_crops_match_running_separately(self):
+        # SVG crops extend the view box past the edges of the image rather
+        # than clamping to them, so they can't be combined or dropped
+        def open_image():
+            return Image.open(
+                io.BytesIO(
+                    b'<svg xmlns="http://www.w3.org/2000/svg" width="100" '
+                    b'height="80" viewBox="0 0 100 80"></svg>'
+                )
+            )
+
+        for rects in [
+            [(-10, -10, 110, 90)],
+            [(5, 5, 50, 50), (-20, -20, 200, 200)],
+        ]:
+            with self.subTest(rects=rects):
+                expected = open_image()
+                lazy = open_image().lazy()
+                for rect in rects:
+                    expected = expected.crop(rect)
+                    lazy = lazy.crop(rect)
+
+                result = lazy.evaluate()
+
+                self.assertEqual(result.get_size(), expected.get_size())
+                self.assertEqual(result.image.view_box, expected.image.view_box)
+
+    def test_get_size_after_resize(self):
+        lazy = self.image.lazy().resize((20, 30))
+
+        self.assertEqual(lazy.get_size(), (20, 30))
+        self.assertIsNone(lazy._result)
+
+    def test_evaluate_runs_once(self):
+        lazy = self.image.lazy().crop((0, 0, 100, 100))
+
+        self.assertIs(lazy.evaluate(), lazy.evaluate())
+        self.assertEqual(lazy.has_alpha(), True)
+
+    def test_jpeg_size_hint(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            image_file = Image.open(io.BytesIO(f.read()))
+
+        lazy = image_file.lazy().auto_orient().resize((100, 60))
+        image, operations = lazy._prepare()
+
+        self.assertEqual(image.size_hint, (100, 100))
+        self.assertIsNone(image_file.size_hint)
+        self.assertEqual(lazy.evaluate().get_size(), (100, 60))
+
+    def test_no_size_hint_before_crop(self):
+        self.assertIsNone(
+            LazyImage._get_size_hint(
+                [("crop", ((0, 0, 100, 100),)), ("resize", ((10, 10),))]
+            )
+        )
+
+    def test_invalid_crop_still_raises(self):
+        lazy = self.image.lazy().crop((300, 300, 400, 400))
+
+        with self.assertRaises(BadImageOperationError):
+            lazy.save_as_png(io.BytesIO())
+
+    def test_optimize_drops_repeats(self):
+        self.assertEqual(
+            LazyImage._optimize_operations(
+                [
+                    ("auto_orient", ()),
+                    ("auto_orient", ()),
+                    ("set_background_color_rgb", ((255, 0, 0),)),
+                    ("set_background_color_rgb", ((0, 0, 255),)),
+                ]
+            ),
+            [
+                ("auto_orient", ()),
+                ("set_background_color_rgb", ((255, 0, 0),)),
+            ],
+        )
+
+    def test_optimize_crops(self):
+        self.assertEqual(
+            LazyImage._optimize_operations(
+                [
+                    ("crop", ((-10, 0, 100, 80),)),
+                    ("set_background_color_rgb", ((255, 0, 0),)),
+                    ("crop", ((10, 10, 50, 50),)),
+                    ("crop", ((0, 0, 40, 40),)),
+                ],
+                size=(200, 150),
+            ),
+            [
+                ("crop", ((10, 10, 50, 50),)),
+                ("set_background_color_rgb", ((255, 0, 0),)),
+            ],
+        )
+
+    def test_optimize_crops_without_size(self):
+        operations = [
+            ("crop", ((10, 10, 50, 50),)),
+            ("crop", ((0, 0, 20, 20),)),
+        ]
+
+        self.assertEqual(LazyImage._optimize_operations(operations), operations)
+
+    def test_optimize_crop_and_resize(self):
+        self.assertEqual(
+            LazyImage._optimize_operations(
+                [
+                    ("crop", ((10, 10, 110, 110),)),
+                    ("resize", ((50, 50),)),
+                    ("resize", ((20, 20),)),
+                ]
+            ),
+            [("crop_and_resize", ((10, 10, 110, 110), (20, 20)))],
+        )
+
+    def test_optimize_keeps_resize_options(self):
+        self.assertEqual(
+            LazyImage._optimize_operations(
+                [
+                    ("crop", ((10, 10, 110, 110),)),
+                    ("resize", ((50, 50),)),
+                    ("resize", ((20, 20), "bilinear", 2.0)),
+                ]
+            ),
+            [("crop_and_resize", ((10, 10, 110, 110), (20, 20), "bilinear", 2.0))],
+        )
+
+    def test_resize_options(self):
+        lazy = self.image.lazy().crop_and_resize(
+            (0, 0, 100, 100), (20, 20), resample="nearest"
+        )
+
+        self.assertEqual(
+            lazy.operations,
+            (("crop", ((0, 0, 100, 100),)), ("resize", ((20, 20), "nearest", None))),
+        )
+        self.assertEqual(lazy.evaluate().get_size(), (20, 20))
+
+    def test_optimize_resizes(self):
+        self.assertEqual(
+            LazyImage._optimize_operations(
+                [
+                    ("resize", ((100, 100),)),
+                    ("resize", ((50, 50),)),
+                    ("resize", ((80, 80),)),
+                ]
+            ),
+            [
+                ("resize", ((50, 50),)),
+                ("resize", ((80, 80),)),
+            ],
+        )
+
+
 @mock.patch("willow.optimizers.base.OptimizerBase.process")
 class TestOptimizeImage(unittest.TestCase):
     class DummyOptimizer(OptimizerBase):
@@ -289,8 +837,8 @@ class TestOptimizeImage(unittest.TestCase):
             self.image.optimize(io.StringIO(), "jpeg")
         mock_process.assert_not_called()
 
-    @mock.patch("willow.image.NamedTemporaryFile")
-    @mock.patch("willow.image.os.unlink")
+    @mock.patch("willow.optimizers.runner.NamedTemporaryFile")
+    @mock.patch("willow.optimizers.runner.os.unlink")
     def test_optimize_with_bytes(
         self, mock_unlink, mock_named_temporary_file, mock_process
     ):
@@ -299,8 +847,8 @@ class TestOptimizeImage(unittest.TestCase):
         mock_process.assert_called_with("tempfile")
         mock_unlink.assert_called_with("tempfile")
 
-    @mock.patch("willow.image.NamedTemporaryFile")
-    @mock.patch("willow.image.os.unlink")
+    @mock.patch("willow.optimizers.runner.NamedTemporaryFile")
+    @mock.patch("willow.optimizers.runner.os.unlink")
     @mock.patch("builtins.open", mock.mock_open(read_data=b"test"))
     def test_optimize_with_spooled_temporary_file(
         self, mock_unlink, mock_named_temporary_file, mock_process
@@ -317,8 +865,8 @@ class TestOptimizeImage(unittest.TestCase):
             self.image.optimize(named_temporary_file, "jpeg")
             mock_process.assert_called_with(named_temporary_file.name)
 
-    @mock.patch("willow.image.NamedTemporaryFile")
-    @mock.patch("willow.image.os.unlink")
+    @mock.patch("willow.optimizers.runner.NamedTemporaryFile")
+    @mock.patch("willow.optimizers.runner.os.unlink")
     def test_optimize_with_an_actual_file(
         self, mock_unlink, mock_named_temporary_file, mock_process
     ):
@@ -333,3 +881,757 @@ class TestOptimizeImage(unittest.TestCase):
             self.image.optimize(f, "jpeg")
         mock_process.assert_called_with("tests/images/people.jpg")
         mock_unlink.assert_not_called()
+
+
+class TestOptimizeImageWithPipes(unittest.IsolatedAsyncioTestCase):
+    class PipeOptimizer(OptimizerBase):
+        library_name = "pipe"
+        image_format = "png"
+        supports_pipes = True
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+        @classmethod
+        def process(cls, file_path):
+            with open(file_path, "ab") as f:
+                f.write(b"+pipe")
+
+        @classmethod
+        def process_bytes(cls, data):
+            return data + b"+pipe"
+
+        @classmethod
+        async def aprocess_bytes(cls, data):
+            return data + b"+pipe"
+
+    class FileOptimizer(OptimizerBase):
+        library_name = "file"
+        image_format = "png"
+
+        file_paths = []
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+        @classmethod
+        def process(cls, file_path):
+            cls.file_paths.append(file_path)
+            with open(file_path, "ab") as f:
+                f.write(b"+file")
+
+        @classmethod
+        async def aprocess(cls, file_path):
+            cls.process(file_path)
+
+    def setUp(self):
+        self.FileOptimizer.file_paths = []
+        self.image = Image()
+
+    def tearDown(self):
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+
+    def register_optimizers(self, *optimizers):
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            for optimizer in optimizers:
+                registry.register_optimizer(optimizer)
+
+    @mock.patch("willow.optimizers.runner.NamedTemporaryFile")
+    def test_optimize_pipes_bytes_io(self, mock_named_temporary_file):
+        self.register_optimizers(self.PipeOptimizer)
+
+        f = io.BytesIO(b"image data that's longer")
+        f.seek(5)
+        self.image.optimize(f, "png")
+
+        mock_named_temporary_file.assert_not_called()
+        self.assertEqual(f.getvalue(), b"image data that's longer+pipe")
+
+    def test_optimize_large_image_uses_a_temporary_file(self):
+        self.register_optimizers(self.PipeOptimizer)
+
+        f = io.BytesIO(b"x" * (MAX_PIPE_SIZE + 1))
+        with mock.patch.object(self.PipeOptimizer, "process_bytes") as process_bytes:
+            self.image.optimize(f, "png")
+
+        process_bytes.assert_not_called()
+        self.assertEqual(f.getvalue(), b"x" * (MAX_PIPE_SIZE + 1) + b"+pipe")
+
+    def test_optimize_pipes_spooled_temporary_file(self):
+        self.register_optimizers(self.PipeOptimizer)
+
+        with SpooledTemporaryFile() as f:
+            f.write(b"image data")
+            self.image.optimize(f, "png")
+
+            f.seek(0)
+            self.assertEqual(f.read(), b"image data+pipe")
+
+    def test_optimize_with_file_optimizers_in_between(self):
+        self.register_optimizers(
+            self.PipeOptimizer,
+            self.FileOptimizer,
+            type("OtherFileOptimizer", (self.FileOptimizer,), {}),
+            type("OtherPipeOptimizer", (self.PipeOptimizer,), {}),
+        )
+
+        f = io.BytesIO(b"image data")
+        self.image.optimize(f, "png")
+
+        self.assertEqual(f.getvalue(), b"image data+pipe+file+file+pipe")
+
+        # The file optimizers next to each other share a temporary file, which
+        # is removed afterwards
+        self.assertEqual(len(set(self.FileOptimizer.file_paths)), 1)
+        self.assertFalse(os.path.exists(self.FileOptimizer.file_paths[0]))
+
+    def test_optimize_file_path_uses_the_file(self):
+        self.register_optimizers(self.PipeOptimizer, self.FileOptimizer)
+
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(b"image data")
+
+        try:
+            self.image.optimize(f.name, "png")
+
+            with open(f.name, "rb") as optimized:
+                self.assertEqual(optimized.read(), b"image data+pipe+file")
+        finally:
+            os.unlink(f.name)
+
+    async def test_aoptimize_pipes_bytes_io(self):
+        self.register_optimizers(self.PipeOptimizer, self.FileOptimizer)
+
+        f = io.BytesIO(b"image data")
+        await self.image.aoptimize(f, "png")
+
+        self.assertEqual(f.getvalue(), b"image data+pipe+file")
+
+
+class TestOptimizeImageTimeouts(unittest.TestCase):
+    class ScriptOptimizer(OptimizerBase):
+        # Runs a Python script on the file, in a real subprocess
+        library_name = sys.executable
+        image_format = "png"
+        script = ""
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+        @classmethod
+        def get_command_arguments(cls, file_path: str) -> list[str]:
+            return ["-c", "import sys, time; " + cls.script, file_path]
+
+        @classmethod
+        def get_pipe_command_arguments(cls) -> list[str]:
+            return ["-c", "import sys, time; " + cls.script]
+
+    def setUp(self):
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(b"image data")
+
+        self.file_path = f.name
+
+    def tearDown(self):
+        os.unlink(self.file_path)
+
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+
+    def register_optimizer(self, script, **attrs):
+        optimizer = type(
+            "Optimizer", (self.ScriptOptimizer,), {"script": script, **attrs}
+        )
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            registry.register_optimizer(optimizer)
+
+    def read_file(self):
+        with open(self.file_path, "rb") as f:
+            return f.read()
+
+    def test_optimizer_timeout(self):
+        # Writes part of the file, then takes too long
+        self.register_optimizer(
+            "f = open(sys.argv[1], 'wb'); f.write(b'partial'); f.flush(); "
+            "time.sleep(30)",
+            timeout=1,
+        )
+
+        start = time.monotonic()
+        with self.assertLogs("willow", level="WARNING") as log_output:
+            Image().optimize(self.file_path, "png")
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(self.read_file(), b"image data")
+        self.assertIn(
+            f"after the '{sys.executable}' library ran for 1 seconds",
+            log_output.output[0],
+        )
+
+    def test_timeout(self):
+        self.register_optimizer("open(sys.argv[1], 'ab').write(b'+optimized')")
+        self.register_optimizer("time.sleep(30)")
+
+        start = time.monotonic()
+        with self.assertLogs("willow", level="WARNING"):
+            Image().optimize(self.file_path, "png", timeout=1)
+
+        # The image is left unoptimized, rather than with only the optimizers
+        # that finished in time applied
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(self.read_file(), b"image data")
+
+    def test_timeout_not_reached(self):
+        self.register_optimizer("open(sys.argv[1], 'ab').write(b'+optimized')")
+        self.register_optimizer("open(sys.argv[1], 'ab').write(b'+again')", timeout=30)
+
+        Image().optimize(self.file_path, "png", timeout=30)
+
+        self.assertEqual(self.read_file(), b"image data+optimized+again")
+
+    def test_piped_timeout(self):
+        self.register_optimizer(
+            "sys.stdout.buffer.write(sys.stdin.buffer.read() + b'+optimized')",
+            supports_pipes=True,
+        )
+        self.register_optimizer("time.sleep(30)", supports_pipes=True)
+
+        f = io.BytesIO(b"image data")
+        with self.assertLogs("willow", level="WARNING"):
+            Image().optimize(f, "png", timeout=1)
+
+        self.assertEqual(f.getvalue(), b"image data")
+
+
+class TestOptimizeImageWithCache(unittest.IsolatedAsyncioTestCase):
+    class CountingOptimizer(OptimizerBase):
+        library_name = "counting"
+        image_format = "png"
+
+        calls = 0
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+        @classmethod
+        def process(cls, file_path):
+            cls.calls += 1
+            with open(file_path, "ab") as f:
+                f.write(b"+optimized")
+
+        @classmethod
+        async def aprocess(cls, file_path):
+            cls.process(file_path)
+
+    class CountingPipeOptimizer(CountingOptimizer):
+        supports_pipes = True
+
+        @classmethod
+        def process_bytes(cls, data):
+            cls.calls += 1
+            return data + b"+piped"
+
+        @classmethod
+        async def aprocess_bytes(cls, data):
+            return cls.process_bytes(data)
+
+    def setUp(self):
+        self.CountingOptimizer.calls = 0
+        self.CountingPipeOptimizer.calls = 0
+
+        self.directory = TemporaryDirectory()
+        self.cache = OptimizerCache(self.directory.name)
+        registry.set_optimizer_cache(self.cache)
+
+        self.image = Image()
+
+    def tearDown(self):
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+        registry._optimizer_cache_is_set = False
+
+        self.directory.cleanup()
+
+    def register_optimizers(self, *optimizers):
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            for optimizer in optimizers:
+                registry.register_optimizer(optimizer)
+
+    def test_optimize_bytes_io(self):
+        self.register_optimizers(self.CountingPipeOptimizer, self.CountingOptimizer)
+
+        for _ in range(3):
+            f = io.BytesIO(b"image data")
+            self.image.optimize(f, "png")
+            self.assertEqual(f.getvalue(), b"image data+piped+optimized")
+
+        # The optimizers only ran the first time
+        self.assertEqual(self.CountingPipeOptimizer.calls, 1)
+        self.assertEqual(self.CountingOptimizer.calls, 1)
+
+        # A different image isn't in the cache
+        self.image.optimize(io.BytesIO(b"other image data"), "png")
+        self.assertEqual(self.CountingOptimizer.calls, 2)
+
+    def test_optimize_file_path(self):
+        self.register_optimizers(self.CountingOptimizer)
+
+        with TemporaryDirectory() as directory:
+            for i in range(2):
+                file_path = os.path.join(directory, f"{i}.png")
+                with open(file_path, "wb") as f:
+                    f.write(b"image data")
+
+                self.image.optimize(file_path, "png")
+
+                with open(file_path, "rb") as f:
+                    self.assertEqual(f.read(), b"image data+optimized")
+
+        self.assertEqual(self.CountingOptimizer.calls, 1)
+
+    def test_unchanged_images_are_not_cached(self):
+        self.register_optimizers(self.CountingOptimizer)
+
+        with mock.patch.object(self.CountingOptimizer, "process") as mock_process:
+            self.image.optimize(io.BytesIO(b"image data"), "png")
+
+        mock_process.assert_called_once()
+        self.assertEqual(list(self.cache._scan()), [])
+
+    async def test_aoptimize(self):
+        self.register_optimizers(self.CountingPipeOptimizer, self.CountingOptimizer)
+
+        for _ in range(2):
+            f = io.BytesIO(b"image data")
+            await self.image.aoptimize(f, "png")
+            self.assertEqual(f.getvalue(), b"image data+piped+optimized")
+
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(b"image data")
+
+        try:
+            await self.image.aoptimize(f.name, "png")
+
+            with open(f.name, "rb") as optimized:
+                self.assertEqual(optimized.read(), b"image data+piped+optimized")
+        finally:
+            os.unlink(f.name)
+
+        self.assertEqual(self.CountingOptimizer.calls, 1)
+
+    async def test_aoptimize_doesnt_block_the_event_loop(self):
+        self.register_optimizers(self.CountingOptimizer)
+        loop_thread = threading.get_ident()
+        threads = set()
+
+        def record_thread(func):
+            def wrapper(*args, **kwargs):
+                threads.add(threading.get_ident())
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        with (
+            mock.patch.object(self.cache, "get", record_thread(self.cache.get)),
+            mock.patch.object(self.cache, "set", record_thread(self.cache.set)),
+            mock.patch(
+                "willow.optimizers.runner._make_temporary_file",
+                record_thread(_make_temporary_file),
+            ),
+        ):
+            await self.image.aoptimize(io.BytesIO(b"image data"), "png")
+
+        self.assertEqual(self.CountingOptimizer.calls, 1)
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+    async def test_cancel_aoptimize_while_copying(self):
+        self.register_optimizers(self.CountingOptimizer)
+        copying = threading.Event()
+        finish_copying = threading.Event()
+        paths = []
+
+        def make_temporary_file(write):
+            copying.set()
+            finish_copying.wait(timeout=5)
+            paths.append(_make_temporary_file(write))
+            return paths[-1]
+
+        with mock.patch(
+            "willow.optimizers.runner._make_temporary_file", make_temporary_file
+        ):
+            task = asyncio.create_task(
+                self.image.aoptimize(io.BytesIO(b"image data"), "png")
+            )
+            await asyncio.to_thread(copying.wait)
+            task.cancel()
+            finish_copying.set()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        # The optimizer didn't run, and the copy was removed once it was made
+        self.assertEqual(self.CountingOptimizer.calls, 0)
+        self.assertEqual(len(paths), 1)
+        self.assertFalse(os.path.exists(paths[0]))
+
+
+class TestOptimizeImageEffort(unittest.IsolatedAsyncioTestCase):
+    class EffortOptimizer(OptimizerBase):
+        library_name = "effort"
+        image_format = "png"
+        effort_arguments = {"fast": ["-1"], "balanced": ["-2"], "max": ["-3"]}
+        default_effort = "balanced"
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+    class PlainOptimizer(OptimizerBase):
+        library_name = "plain"
+        image_format = "png"
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+    def setUp(self):
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(b"image data")
+
+        self.file_path = f.name
+
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            registry.register_optimizer(self.EffortOptimizer)
+
+        effort_measurements.reset()
+
+    def tearDown(self):
+        os.unlink(self.file_path)
+        effort_measurements.reset()
+
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+
+    def get_effort(self, image=None, **kwargs):
+        # Returns the effort the optimizer was run at, or None if it wasn't
+        # given one
+        with mock.patch.object(self.EffortOptimizer, "process") as mock_process:
+            (image or Image()).optimize(self.file_path, "png", **kwargs)
+
+        mock_process.assert_called_once()
+        return mock_process.call_args.kwargs.get("effort")
+
+    def test_default_effort(self):
+        self.assertIsNone(self.get_effort())
+
+    def test_effort(self):
+        self.assertEqual(self.get_effort(effort="fast"), "fast")
+
+    def test_optimizer_effort(self):
+        with mock.patch.object(self.EffortOptimizer, "effort", "max"):
+            self.assertEqual(self.get_effort(), "max")
+            self.assertEqual(self.get_effort(effort="fast"), "fast")
+
+    def test_auto_effort_from_size(self):
+        self.assertEqual(self.get_effort(effort="auto"), "max")
+
+        # Loaded images know how many pixels they have
+        image = RGBImageBuffer((6000, 4000), b"")
+        self.assertEqual(self.get_effort(image, effort="auto"), "fast")
+
+        with mock.patch.object(self.EffortOptimizer, "effort", "auto"):
+            self.assertEqual(self.get_effort(image), "fast")
+
+    def test_auto_effort_from_time_left(self):
+        # A second per byte at max effort, so 10 seconds for the image
+        for _ in range(5):
+            effort_measurements.record(self.EffortOptimizer, "max", 10, 5, 10.0)
+
+        self.assertEqual(self.get_effort(effort="auto"), "max")
+        self.assertEqual(self.get_effort(effort="auto", timeout=60), "max")
+        self.assertEqual(self.get_effort(effort="auto", timeout=5), "balanced")
+
+        with mock.patch.object(self.EffortOptimizer, "timeout", 5):
+            self.assertEqual(self.get_effort(effort="auto"), "balanced")
+
+    def test_optimizers_without_effort_levels(self):
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            registry.register_optimizer(self.PlainOptimizer)
+
+        with mock.patch.object(self.PlainOptimizer, "process") as mock_process:
+            self.assertEqual(self.get_effort(effort="fast"), "fast")
+
+        mock_process.assert_called_once_with(self.file_path)
+
+    def test_pipes(self):
+        with (
+            mock.patch.object(self.EffortOptimizer, "supports_pipes", True),
+            mock.patch.object(
+                self.EffortOptimizer, "process_bytes", return_value=b"optimized"
+            ) as mock_process_bytes,
+        ):
+            Image().optimize(b"image data", "png", effort="auto")
+
+        mock_process_bytes.assert_called_once_with(b"image data", effort="max")
+
+    async def test_aoptimize(self):
+        with mock.patch.object(self.EffortOptimizer, "aprocess") as mock_aprocess:
+            await Image().aoptimize(self.file_path, "png", effort="fast")
+
+        mock_aprocess.assert_called_once_with(mock.ANY, effort="fast")
+
+        with (
+            mock.patch.object(self.EffortOptimizer, "supports_pipes", True),
+            mock.patch.object(
+                self.EffortOptimizer, "aprocess_bytes", return_value=b"optimized"
+            ) as mock_aprocess_bytes,
+        ):
+            await Image().aoptimize(io.BytesIO(b"image data"), "png")
+
+        mock_aprocess_bytes.assert_called_once_with(b"image data")
+
+
+class TestOptimizeImageMetrics(unittest.IsolatedAsyncioTestCase):
+    class NoopOptimizer(OptimizerBase):
+        # Never makes the image smaller
+        library_name = "true"
+        image_format = "png"
+        min_savings = 0.01
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            registry.register_optimizer(self.NoopOptimizer)
+
+        metrics.optimizer_stats.reset()
+
+    def tearDown(self):
+        metrics.optimizer_stats.reset()
+
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+
+    async def test_optimizers_that_save_too_little_are_skipped(self):
+        runs = []
+        metrics.add_sink(runs.append)
+
+        try:
+            with self.assertLogs("willow", level="INFO") as log_output:
+                for _ in range(15):
+                    Image().optimize(io.BytesIO(b"image"), "png")
+
+                await Image().aoptimize(io.BytesIO(b"image"), "png")
+        finally:
+            metrics.remove_sink(runs.append)
+
+        self.assertEqual(len(runs), 10)
+        self.assertEqual(metrics.optimizer_stats.get(self.NoopOptimizer).skipped, 6)
+        self.assertIn("Skipping the 'true' library", log_output.output[0])
+
+
+class TestGetTemporaryDirectory(unittest.TestCase):
+    def setUp(self):
+        _get_temporary_directory.cache_clear()
+
+    def tearDown(self):
+        _get_temporary_directory.cache_clear()
+
+    @mock.patch("willow.optimizers.runner.os.access", return_value=True)
+    def test_shared_memory(self, mock_access):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("TMPDIR", None)
+            self.assertEqual(_get_temporary_directory(), SHARED_MEMORY_DIRECTORY)
+
+    @mock.patch("willow.optimizers.runner.os.access", return_value=False)
+    def test_shared_memory_not_available(self, mock_access):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("TMPDIR", None)
+            self.assertIsNone(_get_temporary_directory())
+
+    @mock.patch("willow.optimizers.runner.os.access", return_value=True)
+    def test_tmpdir_is_set(self, mock_access):
+        with mock.patch.dict(os.environ, {"TMPDIR": "/tmp"}):
+            self.assertIsNone(_get_temporary_directory())
+
+    def test_falls_back_when_shared_memory_is_full(self):
+        with TemporaryDirectory() as full_directory:
+
+            def write(f):
+                if os.path.dirname(f.name) == full_directory:
+                    raise OSError(errno.ENOSPC, "No space left on device")
+
+                f.write(b"image data")
+
+            with mock.patch(
+                "willow.optimizers.runner._get_temporary_directory",
+                return_value=full_directory,
+            ):
+                path = _make_temporary_file(write)
+
+            try:
+                self.assertEqual(os.path.dirname(path), gettempdir())
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), b"image data")
+            finally:
+                os.unlink(path)
+
+            # The partly written file is removed
+            self.assertEqual(os.listdir(full_directory), [])
+
+
+class TestAsyncImage(unittest.IsolatedAsyncioTestCase):
+    class DummyOptimizer(OptimizerBase):
+        # Runs a Python script on the file, in a real subprocess
+        library_name = sys.executable
+        image_format = "png"
+        script = "open(sys.argv[1], 'wb').write(b'optimized')"
+
+        @classmethod
+        def check_library(cls) -> bool:
+            return True
+
+        @classmethod
+        def get_command_arguments(cls, file_path: str) -> list[str]:
+            return ["-c", "import os, sys, time; " + cls.script, file_path]
+
+    def setUp(self):
+        self.DummyOptimizer.script = "open(sys.argv[1], 'wb').write(b'optimized')"
+        with mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"}):
+            registry.register_optimizer(self.DummyOptimizer)
+
+        with open("tests/images/transparent.png", "rb") as f:
+            self.data = f.read()
+
+        self.image = Image.open(io.BytesIO(self.data))
+
+    def tearDown(self):
+        # reset the registry as we get the global state
+        registry._registered_optimizers = []
+
+    async def test_aopen(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            image = await Image.aopen(f)
+
+        self.assertIsInstance(image, JPEGImageFile)
+
+    async def test_aopen_with_executor(self):
+        with ThreadPoolExecutor(thread_name_prefix="willow-test") as executor:
+            with mock.patch.object(
+                Image,
+                "open",
+                side_effect=lambda *args, **kwargs: threading.current_thread().name,
+            ) as mock_open:
+                thread_name = await Image.aopen(
+                    "file", size_hint=(10, 10), executor=executor
+                )
+
+        mock_open.assert_called_once_with("file", size_hint=(10, 10))
+        self.assertTrue(thread_name.startswith("willow-test"))
+
+    async def test_asave(self):
+        output = io.BytesIO()
+        image_file = await self.image.asave("png", output)
+
+        self.assertIsInstance(image_file, PNGImageFile)
+        self.assertEqual(output.getvalue(), b"optimized")
+
+    async def test_asave_without_optimizers(self):
+        output = io.BytesIO()
+        await self.image.asave("png", output, apply_optimizers=False)
+
+        self.assertEqual(Image.open(output).get_size(), (200, 150))
+
+    async def test_aoptimize_with_bytes_io(self):
+        f = io.BytesIO(self.data)
+        await self.image.aoptimize(f, "png")
+
+        self.assertEqual(f.getvalue(), b"optimized")
+
+    async def test_aoptimize_with_file_path(self):
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(self.data)
+
+        try:
+            await self.image.aoptimize(f.name, "png")
+
+            with open(f.name, "rb") as optimized:
+                self.assertEqual(optimized.read(), b"optimized")
+        finally:
+            os.unlink(f.name)
+
+    async def test_aoptimize_without_optimizers(self):
+        f = io.BytesIO(self.data)
+        await self.image.aoptimize(f, "jpeg")
+
+        self.assertEqual(f.getvalue(), self.data)
+
+    async def test_aoptimize_with_unrecognised_type(self):
+        with self.assertRaises(TypeError):
+            await self.image.aoptimize(None, "png")
+
+    async def test_aoptimize_logs_any_issue(self):
+        self.DummyOptimizer.script = "sys.exit('broken')"
+        f = io.BytesIO(self.data)
+
+        with self.assertLogs("willow", level="ERROR") as log_output:
+            await self.image.aoptimize(f, "png")
+
+        self.assertIn(f"with the '{sys.executable}' library", log_output.output[0])
+        self.assertIn("broken", log_output.output[0])
+
+    async def test_aoptimize_timeout(self):
+        with NamedTemporaryFile(delete=False) as pid_file:
+            pass
+
+        try:
+            # Records the process ID, then takes too long
+            self.DummyOptimizer.script = (
+                f"open({pid_file.name!r}, 'w').write(str(os.getpid())); "
+                "time.sleep(30); "
+                "open(sys.argv[1], 'wb').write(b'optimized')"
+            )
+            f = io.BytesIO(self.data)
+
+            start = time.monotonic()
+            with self.assertRaises(asyncio.TimeoutError):
+                await self.image.aoptimize(f, "png", timeout=1)
+
+            self.assertLess(time.monotonic() - start, 10)
+            self.assertEqual(f.getvalue(), self.data)
+
+            # The subprocess was killed
+            with open(pid_file.name) as pid:
+                with self.assertRaises(ProcessLookupError):
+                    os.kill(int(pid.read()), 0)
+        finally:
+            os.unlink(pid_file.name)
+
+    async def test_aoptimize_cancelled(self):
+        self.DummyOptimizer.script = (
+            "time.sleep(30); open(sys.argv[1], 'wb').write(b'optimized')"
+        )
+
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(self.data)
+
+        try:
+            task = asyncio.ensure_future(self.image.aoptimize(f.name, "png"))
+            await asyncio.sleep(0.5)
+            task.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            with open(f.name, "rb") as unchanged:
+                self.assertEqual(unchanged.read(), self.data)
+        finally:
+            os.unlink(f.name)
@@ -1,12 +1,30 @@
+import asyncio
 import io
 import os
+import socket
+import sys
+import time
 import unittest
-from subprocess import STDOUT, CalledProcessError
-from tempfile import NamedTemporaryFile
-from unittest import TestCase, mock
-
-from willow.optimizers import Cwebp, Gifsicle, Jpegoptim, Pngquant
-from willow.optimizers.base import OptimizerBase
+from subprocess import STDOUT, CalledProcessError, CompletedProcess, TimeoutExpired
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from willow.optimizers import Cwebp, Gifsicle, Jpegoptim, Optipng, Pngquant, metrics
+from willow.optimizers.base import (
+    EFFORT_LEVELS,
+    EffortMeasurement,
+    OptimizerBase,
+    effort_measurements,
+)
+from willow.optimizers.cache import OptimizerCache
+from willow.optimizers.metrics import (
+    MetricsAggregator,
+    OptimizerRun,
+    OptimizerStats,
+    StatsdSink,
+    optimizer_stats,
+)
+from willow.optimizers.steps import Step, arun_steps, blocking, run_steps
 from willow.registry import WillowRegistry
 
 
@@ -48,7 +66,9 @@ class OptimizerTest(TestCase):
     @mock.patch("willow.optimizers.base.subprocess.check_output")
     def test_process(self, mock_check_output):
         self.DummyOptimizer.process("file.png")
-        mock_check_output.assert_called_once_with(["dummy"], stderr=STDOUT)
+        mock_check_output.assert_called_once_with(
+            ["dummy"], stderr=STDOUT, timeout=None
+        )
 
     @mock.patch("willow.optimizers.base.subprocess.check_output")
     def test_process_logs_any_issue(self, mock_check_output):
@@ -61,6 +81,727 @@ class OptimizerTest(TestCase):
             "Error optimizing file.png with the 'dummy' library", log_output.output[0]
         )
 
+    def test_get_pipe_command_arguments(self):
+        self.assertFalse(self.DummyOptimizer.supports_pipes)
+        self.assertEqual(self.DummyOptimizer.get_pipe_command_arguments(), [])
+
+    @mock.patch("willow.optimizers.base.subprocess.run")
+    def test_process_bytes(self, mock_run):
+        def run(args, stdin, stdout, **kwargs):
+            self.assertEqual(stdin.read(), b"image")
+            stdout.write(b"optimized")
+
+        mock_run.side_effect = run
+
+        self.assertEqual(self.DummyOptimizer.process_bytes(b"image"), b"optimized")
+        self.assertEqual(mock_run.call_args.args, (["dummy"],))
+
+    @mock.patch("willow.optimizers.base.HAS_MEMFD", False)
+    @mock.patch("willow.optimizers.base.subprocess.run")
+    def test_process_bytes_without_memfd(self, mock_run):
+        mock_run.return_value = CompletedProcess(["dummy"], 0, b"optimized", b"")
+
+        self.assertEqual(self.DummyOptimizer.process_bytes(b"image"), b"optimized")
+        mock_run.assert_called_once_with(
+            ["dummy"], input=b"image", capture_output=True, check=True, timeout=None
+        )
+
+    @mock.patch("willow.optimizers.base.subprocess.run")
+    def test_process_bytes_logs_any_issue(self, mock_run):
+        mock_run.side_effect = CalledProcessError(1, "dummy", stderr=b"broken")
+        with self.assertLogs("willow", level="ERROR") as log_output:
+            self.assertEqual(self.DummyOptimizer.process_bytes(b"image"), b"image")
+
+        self.assertIn(
+            "Error optimizing image data with the 'dummy' library", log_output.output[0]
+        )
+        self.assertIn("broken", log_output.output[0])
+
+    def test_get_timeout(self):
+        self.assertIsNone(self.DummyOptimizer.get_timeout())
+        self.assertEqual(self.DummyOptimizer.get_timeout(5), 5)
+
+        with mock.patch.object(self.DummyOptimizer, "timeout", 10):
+            self.assertEqual(self.DummyOptimizer.get_timeout(), 10)
+            self.assertEqual(self.DummyOptimizer.get_timeout(5), 5)
+            self.assertEqual(self.DummyOptimizer.get_timeout(20), 10)
+
+    @mock.patch("willow.optimizers.base.subprocess.check_output")
+    def test_process_with_timeout(self, mock_check_output):
+        with mock.patch.object(self.DummyOptimizer, "timeout", 10):
+            self.DummyOptimizer.process("file.png")
+            mock_check_output.assert_called_with(["dummy"], stderr=STDOUT, timeout=10)
+
+            self.DummyOptimizer.process("file.png", timeout=5)
+            mock_check_output.assert_called_with(["dummy"], stderr=STDOUT, timeout=5)
+
+
+class OptimizerTimeoutTest(IsolatedAsyncioTestCase):
+    class SlowOptimizer(OptimizerBase):
+        library_name = sys.executable
+        image_format = "FOO"
+        supports_pipes = True
+        timeout = 1
+
+        @classmethod
+        def get_command_arguments(cls, file_path: str) -> list[str]:
+            return ["-c", "import time; time.sleep(30)"]
+
+        @classmethod
+        def get_pipe_command_arguments(cls) -> list[str]:
+            return cls.get_command_arguments("-")
+
+    def test_process(self):
+        start = time.monotonic()
+        with self.assertRaises(TimeoutExpired):
+            self.SlowOptimizer.process("file.png")
+
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_process_bytes(self):
+        with self.assertRaises(TimeoutExpired):
+            self.SlowOptimizer.process_bytes(b"image", timeout=0.5)
+
+    async def test_aprocess(self):
+        start = time.monotonic()
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.SlowOptimizer.aprocess("file.png")
+
+        self.assertLess(time.monotonic() - start, 10)
+
+    async def test_aprocess_bytes(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.SlowOptimizer.aprocess_bytes(b"image", timeout=0.5)
+
+
+class PipeOptimizerTest(IsolatedAsyncioTestCase):
+    class ReverseOptimizer(OptimizerBase):
+        # Reverses the bytes piped through it, in a real subprocess
+        library_name = sys.executable
+        image_format = "FOO"
+        supports_pipes = True
+        script = "sys.stdout.buffer.write(sys.stdin.buffer.read()[::-1])"
+
+        @classmethod
+        def get_pipe_command_arguments(cls) -> list[str]:
+            return ["-c", "import sys; " + cls.script]
+
+    def setUp(self):
+        self.ReverseOptimizer.script = (
+            "sys.stdout.buffer.write(sys.stdin.buffer.read()[::-1])"
+        )
+
+    def test_process_bytes(self):
+        self.assertEqual(self.ReverseOptimizer.process_bytes(b"image"), b"egami")
+
+    def test_process_bytes_without_output(self):
+        self.ReverseOptimizer.script = "sys.stdin.buffer.read()"
+        self.assertEqual(self.ReverseOptimizer.process_bytes(b"image"), b"image")
+
+    @mock.patch("willow.optimizers.base.HAS_MEMFD", False)
+    def test_process_bytes_without_memfd(self):
+        self.assertEqual(self.ReverseOptimizer.process_bytes(b"image"), b"egami")
+
+    async def test_aprocess_bytes(self):
+        self.assertEqual(await self.ReverseOptimizer.aprocess_bytes(b"image"), b"egami")
+
+    @mock.patch("willow.optimizers.base.HAS_MEMFD", False)
+    async def test_aprocess_bytes_without_memfd(self):
+        self.assertEqual(await self.ReverseOptimizer.aprocess_bytes(b"image"), b"egami")
+
+    async def test_aprocess_bytes_logs_any_issue(self):
+        self.ReverseOptimizer.script = "sys.exit('broken')"
+        with self.assertLogs("willow", level="ERROR") as log_output:
+            self.assertEqual(
+                await self.ReverseOptimizer.aprocess_bytes(b"image"), b"image"
+            )
+
+        self.assertIn("broken", log_output.output[0])
+
+
+class OptimizerEffortTest(IsolatedAsyncioTestCase):
+    class EffortOptimizer(OptimizerBase):
+        # Keeps the first n bytes of the image, in a real subprocess, with
+        # fewer bytes kept at higher efforts
+        library_name = sys.executable
+        image_format = "FOO"
+        supports_pipes = True
+        effort_arguments = {"fast": ["4"], "balanced": ["3"], "max": ["2"]}
+        default_effort = "balanced"
+
+        @classmethod
+        def get_command_arguments(cls, file_path, effort=None):
+            return [
+                "-c",
+                "import sys; path = sys.argv[2]; data = open(path, 'rb').read(); open(path, 'wb').write(data[: int(sys.argv[1])])",
+                *cls.get_effort_arguments(effort),
+                file_path,
+            ]
+
+        @classmethod
+        def get_pipe_command_arguments(cls, effort=None):
+            return [
+                "-c",
+                "import sys; sys.stdout.buffer.write(sys.stdin.buffer.read()[: int(sys.argv[1])])",
+                *cls.get_effort_arguments(effort),
+            ]
+
+    def setUp(self):
+        effort_measurements.reset()
+
+    def tearDown(self):
+        effort_measurements.reset()
+
+    def record(self, effort, count, seconds, input_size=1000):
+        for _ in range(count):
+            effort_measurements.record(
+                self.EffortOptimizer, effort, input_size, input_size // 2, seconds
+            )
+
+    def test_get_effort_arguments(self):
+        self.assertEqual(self.EffortOptimizer.get_effort_arguments(), ["3"])
+        self.assertEqual(self.EffortOptimizer.get_effort_arguments("max"), ["2"])
+
+        with self.assertRaises(ValueError):
+            self.EffortOptimizer.get_effort_arguments("slow")
+
+    def test_get_effort_arguments_without_effort_levels(self):
+        self.assertEqual(OptimizerBase.get_effort_arguments(), [])
+        self.assertEqual(OptimizerBase.get_effort_arguments("max"), [])
+
+    def test_choose_effort_from_size(self):
+        choose_effort = self.EffortOptimizer.choose_effort
+
+        self.assertEqual(choose_effort(4 * 1024), "max")
+        self.assertEqual(choose_effort(4 * 1024, pixel_count=4_000_000), "balanced")
+        self.assertEqual(choose_effort(1024 * 1024), "balanced")
+        self.assertEqual(choose_effort(40 * 1024 * 1024), "fast")
+        self.assertEqual(choose_effort(4 * 1024, pixel_count=24_000_000), "fast")
+
+    def test_choose_effort_from_measurements(self):
+        choose_effort = self.EffortOptimizer.choose_effort
+
+        # 10 seconds per 1000 bytes at max effort, 1 second at balanced
+        self.record("max", 5, 10.0)
+        self.record("balanced", 5, 1.0)
+
+        self.assertEqual(choose_effort(1000), "max")
+        self.assertEqual(choose_effort(1000, time_limit=20), "max")
+        self.assertEqual(choose_effort(1000, time_limit=5), "balanced")
+        self.assertEqual(choose_effort(1000, time_limit=0.5), "fast")
+        self.assertEqual(choose_effort(100, time_limit=5), "max")
+
+    def test_choose_effort_needs_enough_measurements(self):
+        self.record("max", 4, 10.0)
+
+        self.assertEqual(self.EffortOptimizer.choose_effort(1000, time_limit=5), "max")
+
+    def test_choose_effort_without_effort_levels(self):
+        self.assertIsNone(OptimizerBase.choose_effort(1000))
+
+    def test_process(self):
+        with NamedTemporaryFile() as f:
+            f.write(b"image")
+            f.flush()
+
+            self.EffortOptimizer.process(f.name, effort="fast")
+            self.assertEqual(open(f.name, "rb").read(), b"imag")
+
+        self.assertEqual(
+            effort_measurements.get(self.EffortOptimizer, "fast"),
+            EffortMeasurement(1, 5, 4, mock.ANY),
+        )
+
+    def test_process_bytes(self):
+        self.assertEqual(self.EffortOptimizer.process_bytes(b"image"), b"ima")
+        self.assertEqual(
+            self.EffortOptimizer.process_bytes(b"image", effort="max"), b"im"
+        )
+
+        self.assertEqual(
+            effort_measurements.items(),
+            [
+                (
+                    (self.EffortOptimizer, "balanced"),
+                    EffortMeasurement(1, 5, 3, mock.ANY),
+                ),
+                ((self.EffortOptimizer, "max"), EffortMeasurement(1, 5, 2, mock.ANY)),
+            ],
+        )
+        self.assertGreater(
+            effort_measurements.get(self.EffortOptimizer, "max").seconds, 0
+        )
+
+    async def test_aprocess(self):
+        with NamedTemporaryFile() as f:
+            f.write(b"image")
+            f.flush()
+
+            await self.EffortOptimizer.aprocess(f.name, effort="max")
+            self.assertEqual(open(f.name, "rb").read(), b"im")
+
+        self.assertEqual(
+            effort_measurements.get(self.EffortOptimizer, "max"),
+            EffortMeasurement(1, 5, 2, mock.ANY),
+        )
+
+    async def test_aprocess_bytes(self):
+        self.assertEqual(
+            await self.EffortOptimizer.aprocess_bytes(b"image", effort="fast"), b"imag"
+        )
+        self.assertEqual(
+            effort_measurements.get(self.EffortOptimizer, "fast"),
+            EffortMeasurement(1, 5, 4, mock.ANY),
+        )
+
+    def test_failures_are_not_recorded(self):
+        with mock.patch.object(
+            self.EffortOptimizer,
+            "get_pipe_command_arguments",
+            return_value=["-c", "import sys; sys.exit('broken')"],
+        ):
+            with self.assertLogs("willow", level="ERROR"):
+                self.EffortOptimizer.process_bytes(b"image")
+
+        self.assertEqual(effort_measurements.items(), [])
+
+    def test_default_optimizers_effort_levels(self):
+        for optimizer in [Cwebp, Gifsicle, Optipng, Pngquant]:
+            with self.subTest(optimizer=optimizer):
+                self.assertEqual(tuple(optimizer.effort_arguments), EFFORT_LEVELS)
+                self.assertIn(optimizer.default_effort, EFFORT_LEVELS)
+
+        self.assertEqual(Jpegoptim.effort_arguments, {})
+        self.assertEqual(
+            Gifsicle.get_command_arguments("file.gif", effort="fast"),
+            ["-b", "-O1", "file.gif"],
+        )
+        self.assertEqual(
+            Optipng.get_command_arguments("file.png"),
+            ["-quiet", "-o2", "-i0", "file.png"],
+        )
+        self.assertEqual(
+            Cwebp.get_pipe_command_arguments(effort="fast"),
+            ["-m", "2", "-mt", "-q", "75", "-o", "-", "--", "-"],
+        )
+        self.assertEqual(
+            Pngquant.get_pipe_command_arguments(effort="max"),
+            ["--strip", "--speed", "1", "--skip-if-larger", "-"],
+        )
+
+
+class StepsTest(IsolatedAsyncioTestCase):
+    @staticmethod
+    def iter_steps(log):
+        async def aadd(a, b):
+            log.append("async")
+            return a + b
+
+        total = yield blocking(sum, [1, 2])
+        total = yield Step(lambda a, b: a + b, aadd, (total,), {"b": 3})
+        try:
+            yield blocking(int, "not a number")
+        except ValueError:
+            log.append("caught")
+
+        return total
+
+    def test_run_steps(self):
+        log = []
+        self.assertEqual(run_steps(self.iter_steps(log)), 6)
+        self.assertEqual(log, ["caught"])
+
+    async def test_arun_steps(self):
+        log = []
+        self.assertEqual(await arun_steps(self.iter_steps(log)), 6)
+        self.assertEqual(log, ["async", "caught"])
+
+    def test_uncaught_error(self):
+        def iter_steps():
+            yield blocking(int, "not a number")
+
+        with self.assertRaises(ValueError):
+            run_steps(iter_steps())
+
+
+class OptimizerCacheTest(TestCase):
+    class DummyOptimizer(OptimizerBase):
+        library_name = "dummy"
+        image_format = "FOO"
+
+        @classmethod
+        def get_command_arguments(cls, file_path: str) -> list[str]:
+            return ["--level=2", file_path]
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.cache = OptimizerCache(self.directory.name, max_size=120)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def list_keys(self):
+        return sorted(entry.name for entry in self.cache._scan())
+
+    def test_get_key(self):
+        key = self.cache.get_key(b"image", [self.DummyOptimizer])
+
+        self.assertEqual(key, self.cache.get_key(b"image", [self.DummyOptimizer]))
+        self.assertNotEqual(
+            key, self.cache.get_key(b"other image", [self.DummyOptimizer])
+        )
+        self.assertNotEqual(key, self.cache.get_key(b"image", []))
+        self.assertNotEqual(
+            key,
+            self.cache.get_key(b"image", [self.DummyOptimizer, self.DummyOptimizer]),
+        )
+
+    def test_key_changes_with_arguments(self):
+        key = self.cache.get_key(b"image", [self.DummyOptimizer])
+
+        with mock.patch.object(
+            self.DummyOptimizer,
+            "get_command_arguments",
+            return_value=["--level=3", "file"],
+        ):
+            self.assertNotEqual(
+                key, self.cache.get_key(b"image", [self.DummyOptimizer])
+            )
+
+        with (
+            mock.patch.object(self.DummyOptimizer, "supports_pipes", True),
+            mock.patch.object(
+                self.DummyOptimizer, "get_pipe_command_arguments", return_value=["-"]
+            ),
+        ):
+            self.assertNotEqual(
+                key, self.cache.get_key(b"image", [self.DummyOptimizer])
+            )
+
+    def test_key_changes_with_effort(self):
+        key = self.cache.get_key(b"image", [Gifsicle])
+
+        self.assertEqual(
+            key, self.cache.get_key(b"image", [Gifsicle], {Gifsicle: "max"})
+        )
+        self.assertNotEqual(
+            key, self.cache.get_key(b"image", [Gifsicle], {Gifsicle: "fast"})
+        )
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("abcd"))
+
+        self.cache.set("abcd", b"optimized")
+
+        self.assertEqual(self.cache.get("abcd"), b"optimized")
+        self.assertEqual(self.list_keys(), ["abcd"])
+
+    def test_least_recently_used_files_are_removed(self):
+        for i, key in enumerate(["aaaa", "bbbb", "cccc"]):
+            self.cache.set(key, b"x" * 40)
+            # Make sure the modification times are in order
+            os.utime(self.cache._get_path(key), (i, i))
+
+        # Using a file makes it the most recently used
+        self.assertIsNotNone(self.cache.get("aaaa"))
+
+        self.cache.set("dddd", b"x" * 40)
+
+        self.assertEqual(self.list_keys(), ["aaaa", "cccc", "dddd"])
+        self.assertEqual(self.cache._size, 120)
+
+    def test_files_added_by_other_processes_are_counted(self):
+        self.cache.set("aaaa", b"x" * 40)
+        os.utime(self.cache._get_path("aaaa"), (0, 0))
+
+        OptimizerCache(self.directory.name).set("bbbb", b"x" * 40)
+        os.utime(self.cache._get_path("bbbb"), (1, 1))
+
+        # The files are counted again once this process's count goes over
+        self.cache.set("cccc", b"x" * 40)
+        self.cache.set("dddd", b"x" * 40)
+        self.cache.set("eeee", b"x" * 40)
+
+        self.assertEqual(self.list_keys(), ["cccc", "dddd", "eeee"])
+
+    def test_clear(self):
+        self.cache.set("aaaa", b"optimized")
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get("aaaa"))
+        self.assertEqual(self.list_keys(), [])
+
+    def test_missing_directory(self):
+        cache = OptimizerCache(os.path.join(self.directory.name, "missing"))
+
+        self.assertIsNone(cache.get("aaaa"))
+        cache.clear()
+
+        cache.set("aaaa", b"optimized")
+        self.assertEqual(cache.get("aaaa"), b"optimized")
+
+
+class OptimizerMetricsTest(IsolatedAsyncioTestCase):
+    class ScriptOptimizer(OptimizerBase):
+        # Runs a Python script on the image, in a real subprocess. By default
+        # it removes the last 2 bytes
+        library_name = sys.executable
+        image_format = "FOO"
+        supports_pipes = True
+        script = "data = data[:-2]"
+
+        @classmethod
+        def get_command_arguments(cls, file_path):
+            return [
+                "-c",
+                "import sys, time; data = open(sys.argv[1], 'rb').read(); "
+                + cls.script
+                + "; open(sys.argv[1], 'wb').write(data)",
+                file_path,
+            ]
+
+        @classmethod
+        def get_pipe_command_arguments(cls):
+            return [
+                "-c",
+                "import sys, time; data = sys.stdin.buffer.read(); "
+                + cls.script
+                + "; sys.stdout.buffer.write(data)",
+            ]
+
+    def setUp(self):
+        self.runs = []
+        metrics.add_sink(self.runs.append)
+        optimizer_stats.reset()
+
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(b"image data")
+
+        self.file_path = f.name
+
+    def tearDown(self):
+        metrics.remove_sink(self.runs.append)
+        optimizer_stats.reset()
+        os.unlink(self.file_path)
+
+    def get_optimizer(self, script):
+        return type("Optimizer", (self.ScriptOptimizer,), {"script": script})
+
+    def assertRun(self, run, input_size, output_size, error=None):
+        self.assertEqual(
+            run,
+            OptimizerRun(
+                self.ScriptOptimizer,
+                None,
+                input_size,
+                output_size,
+                mock.ANY,
+                mock.ANY,
+                error,
+            ),
+        )
+        self.assertGreater(run.wall_time, 0)
+        self.assertGreaterEqual(run.cpu_time, 0)
+
+    def test_process(self):
+        self.ScriptOptimizer.process(self.file_path)
+
+        self.assertEqual(len(self.runs), 1)
+        self.assertRun(self.runs[0], 10, 8)
+
+    def test_process_bytes(self):
+        self.ScriptOptimizer.process_bytes(b"image data")
+
+        self.assertEqual(len(self.runs), 1)
+        self.assertRun(self.runs[0], 10, 8)
+
+    async def test_aprocess(self):
+        await self.ScriptOptimizer.aprocess(self.file_path)
+        await self.ScriptOptimizer.aprocess_bytes(b"image")
+
+        self.assertEqual(len(self.runs), 2)
+        self.assertRun(self.runs[0], 10, 8)
+        self.assertRun(self.runs[1], 5, 3)
+
+    def test_failures(self):
+        optimizer = self.get_optimizer("sys.exit('broken')")
+
+        with self.assertLogs("willow", level="ERROR"):
+            optimizer.process(self.file_path)
+            optimizer.process_bytes(b"image")
+
+        self.assertEqual(
+            [(run.input_size, run.output_size, run.error) for run in self.runs],
+            [(10, 10, metrics.FAILED), (5, 5, metrics.FAILED)],
+        )
+
+    def test_timeouts(self):
+        optimizer = self.get_optimizer("time.sleep(30)")
+
+        with self.assertRaises(TimeoutExpired):
+            optimizer.process(self.file_path, timeout=0.5)
+
+        with self.assertRaises(TimeoutExpired):
+            optimizer.process_bytes(b"image", timeout=0.5)
+
+        self.assertEqual(
+            [run.error for run in self.runs], [metrics.TIMED_OUT, metrics.TIMED_OUT]
+        )
+
+    async def test_async_timeouts_and_cancellation(self):
+        optimizer = self.get_optimizer("time.sleep(30)")
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await optimizer.aprocess_bytes(b"image", timeout=0.5)
+
+        task = asyncio.ensure_future(optimizer.aprocess(self.file_path))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertEqual(
+            [run.error for run in self.runs], [metrics.TIMED_OUT, metrics.CANCELLED]
+        )
+
+    def test_effort(self):
+        self.ScriptOptimizer.process_bytes(b"image")
+        Gifsicle._record(None, 10, 8, metrics.get_times())
+        Gifsicle._record("fast", 10, 8, metrics.get_times())
+
+        self.assertEqual([run.effort for run in self.runs], [None, "max", "fast"])
+
+    def test_sink_errors_are_logged(self):
+        sink = mock.Mock(side_effect=ValueError("broken sink"))
+        metrics.add_sink(sink)
+
+        try:
+            with self.assertLogs("willow", level="ERROR") as log_output:
+                self.ScriptOptimizer.process_bytes(b"image")
+        finally:
+            metrics.remove_sink(sink)
+
+        self.assertEqual(len(self.runs), 1)
+        self.assertIn("broken sink", log_output.output[0])
+
+    def test_optimizer_stats(self):
+        self.ScriptOptimizer.process_bytes(b"image")
+        with self.assertLogs("willow", level="ERROR"):
+            self.get_optimizer("sys.exit(1)").process_bytes(b"image data")
+
+        self.assertEqual(
+            optimizer_stats.get(self.ScriptOptimizer),
+            OptimizerStats(1, 0, 5, 3, mock.ANY, mock.ANY, 0),
+        )
+        self.assertEqual(len(optimizer_stats.items()), 2)
+
+    def test_should_run(self):
+        optimizer = self.get_optimizer("pass")
+        self.assertTrue(optimizer.should_run())
+
+        with mock.patch.object(optimizer, "min_savings", 0.01):
+            for _ in range(9):
+                optimizer._record(None, 100, 100, metrics.get_times())
+
+            # Not skipped until it's run enough times
+            self.assertTrue(optimizer.should_run())
+
+            optimizer._record(None, 100, 100, metrics.get_times())
+
+            with self.assertLogs("willow", level="INFO") as log_output:
+                should_run = [optimizer.should_run() for _ in range(40)]
+
+            self.assertEqual(should_run.count(True), 2)
+            self.assertTrue(should_run[19])
+            self.assertTrue(should_run[39])
+            self.assertEqual(optimizer_stats.get(optimizer).skipped, 40)
+            self.assertIn("which has saved 0.0% on average", log_output.output[0])
+
+            # It's no longer skipped if it starts saving enough
+            optimizer._record(None, 1000, 900, metrics.get_times())
+            self.assertTrue(optimizer.should_run())
+
+
+class MetricsAggregatorTest(TestCase):
+    def test_aggregate(self):
+        aggregator = MetricsAggregator()
+        aggregator(OptimizerRun(Gifsicle, "max", 100, 80, 0.5, 0.25, None))
+        aggregator(OptimizerRun(Gifsicle, "fast", 50, 50, 0.25, None, metrics.FAILED))
+        aggregator(OptimizerRun(Pngquant, "balanced", 10, 5, 0.125, 0.125, None))
+        aggregator.record_skip(Pngquant)
+
+        self.assertEqual(
+            aggregator.get(Gifsicle), OptimizerStats(2, 1, 150, 130, 0.75, 0.25, 0)
+        )
+        self.assertEqual(
+            aggregator.items(),
+            [
+                (Gifsicle, OptimizerStats(2, 1, 150, 130, 0.75, 0.25, 0)),
+                (Pngquant, OptimizerStats(1, 0, 10, 5, 0.125, 0.125, 1)),
+            ],
+        )
+
+        aggregator.reset()
+        self.assertIsNone(aggregator.get(Gifsicle))
+
+
+class StatsdSinkTest(TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.settimeout(5)
+
+        self.sink = StatsdSink("127.0.0.1", self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.sink.close()
+        self.server.close()
+
+    def test_get_lines(self):
+        run = OptimizerRun(Gifsicle, "max", 100, 80, 0.5, 0.25, None)
+        self.assertEqual(
+            self.sink.get_lines(run),
+            [
+                "willow.optimizer.gifsicle.runs:1|c",
+                "willow.optimizer.gifsicle.input_bytes:100|c",
+                "willow.optimizer.gifsicle.bytes_saved:20|c",
+                "willow.optimizer.gifsicle.wall_time:500.000|ms",
+                "willow.optimizer.gifsicle.cpu_time:250.000|ms",
+            ],
+        )
+
+        run = OptimizerRun(Gifsicle, "max", 100, 100, 0.5, None, metrics.TIMED_OUT)
+        self.assertEqual(
+            self.sink.get_lines(run)[3:],
+            [
+                "willow.optimizer.gifsicle.wall_time:500.000|ms",
+                "willow.optimizer.gifsicle.errors.timed_out:1|c",
+            ],
+        )
+
+    def test_library_paths_are_made_into_names(self):
+        optimizer = type("Optimizer", (OptimizerBase,), {"library_name": "/usr/bin/x"})
+        run = OptimizerRun(optimizer, None, 1, 1, 0.5, None, None)
+
+        self.assertEqual(
+            self.sink.get_lines(run)[0], "willow.optimizer.usr_bin_x.runs:1|c"
+        )
+
+    def test_send(self):
+        self.sink(OptimizerRun(Pngquant, "balanced", 10, 5, 0.125, None, None))
+
+        self.assertEqual(
+            self.server.recv(1024),
+            b"willow.optimizer.pngquant.runs:1|c\n"
+            b"willow.optimizer.pngquant.input_bytes:10|c\n"
+            b"willow.optimizer.pngquant.bytes_saved:5|c\n"
+            b"willow.optimizer.pngquant.wall_time:125.000|ms",
+        )
+
+    def test_send_errors_are_ignored(self):
+        sink = StatsdSink("invalid host name", 8125)
+        sink(OptimizerRun(Pngquant, "balanced", 10, 5, 0.125, None, None))
+
 
 class DefaultOptimizerTestBase:
     @classmethod
@@ -133,6 +874,16 @@ class PngquantOptimizer(DefaultOptimizerTestBase, TestCase):
         for ext in ("gif", "jpeg", "webp", "tiff", "bmp"):
             self.assertFalse(Pngquant.applies_to(ext))
 
+    def test_get_pipe_command_arguments(self):
+        self.assertTrue(Pngquant.supports_pipes)
+        self.assertListEqual(
+            Pngquant.get_pipe_command_arguments(), ["--strip", "--skip-if-larger", "-"]
+        )
+
+    def test_process_bytes_optimizes_image(self):
+        optimized_image = self.optimizer.process_bytes(self.original_image)
+        self.assertAlmostEqual(self.optimized_size, len(optimized_image), delta=60)
+
     def test_get_command_arguments(self):
         self.assertListEqual(
             Pngquant.get_command_arguments("file.png"),
@@ -174,6 +925,17 @@ class CwebpOptimizer(DefaultOptimizerTestBase, TestCase):
             ],
         )
 
+    def test_get_pipe_command_arguments(self):
+        self.assertTrue(Cwebp.supports_pipes)
+        self.assertListEqual(
+            Cwebp.get_pipe_command_arguments(),
+            ["-m", "6", "-mt", "-pass", "10", "-q", "75", "-o", "-", "--", "-"],
+        )
+
+    def test_process_bytes_optimizes_image(self):
+        optimized_image = self.optimizer.process_bytes(self.original_image)
+        self.assertAlmostEqual(self.optimized_size, len(optimized_image), delta=60)
+
     def get_check_library_command_arguments(self):
         self.assertListEqual(
             Cwebp.get_check_library_arguments(),
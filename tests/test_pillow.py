@@ -1,5 +1,7 @@
 import io
 import os
+import subprocess
+import sys
 import unittest
 from unittest import mock
 
@@ -12,12 +14,22 @@ from willow.image import (
     BadImageOperationError,
     GIFImageFile,
     IcoImageFile,
+    Image,
     JPEGImageFile,
     PNGImageFile,
+    RGBAImageBuffer,
+    RGBImageBuffer,
     WebPImageFile,
 )
 from willow.optimizers import Cwebp, Gifsicle, Jpegoptim, Optipng, Pngquant
-from willow.plugins.pillow import PillowImage, UnsupportedRotation, _PIL_Image
+from willow.plugins.pillow import (
+    DECODE_COST,
+    GIF_DECODE_COST,
+    PillowImage,
+    PillowImageProbe,
+    UnsupportedRotation,
+    _PIL_Image,
+)
 from willow.registry import registry
 
 no_webp_support = not PillowImage.is_format_supported("WEBP")
@@ -43,10 +55,58 @@ class TestPillowOperations(unittest.TestCase):
         resized_image = self.image.resize((100, 75))
         self.assertEqual(resized_image.get_size(), (100, 75))
 
+    def test_resize_with_resample_filter(self):
+        for resample in ["nearest", "bilinear", "bicubic", "lanczos"]:
+            with self.subTest(resample=resample):
+                resized_image = self.image.resize((100, 75), resample=resample)
+                self.assertEqual(resized_image.get_size(), (100, 75))
+
+        resized_image = self.image.resize((100, 75), resample="nearest")
+        self.assertEqual(
+            resized_image.image.tobytes(),
+            self.image.image.resize((100, 75), PILImage.Resampling.NEAREST).tobytes(),
+        )
+
+    def test_resize_with_unknown_resample_filter(self):
+        with self.assertRaises(BadImageOperationError):
+            self.image.resize((100, 75), resample="unknown")
+
+    def test_resize_with_reducing_gap(self):
+        resized_image = self.image.resize((20, 15), reducing_gap=2.0)
+
+        self.assertEqual(resized_image.get_size(), (20, 15))
+        self.assertEqual(
+            resized_image.image.tobytes(),
+            self.image.image.resize(
+                (20, 15), PILImage.Resampling.LANCZOS, reducing_gap=2.0
+            ).tobytes(),
+        )
+
     def test_crop(self):
         cropped_image = self.image.crop((10, 10, 100, 100))
         self.assertEqual(cropped_image.get_size(), (90, 90))
 
+    def test_crop_and_resize(self):
+        image = self.image.crop_and_resize((10, 10, 100, 100), (45, 30))
+        self.assertEqual(image.get_size(), (45, 30))
+
+        # The original image is left alone
+        self.assertEqual(self.image.get_size(), (200, 150))
+
+    def test_crop_and_resize_with_options(self):
+        image = self.image.crop_and_resize(
+            (10, 10, 100, 100), (45, 30), resample="bilinear", reducing_gap=1.5
+        )
+        self.assertEqual(image.get_size(), (45, 30))
+
+    def test_crop_and_resize_out_of_bounds(self):
+        # crop rectangle should be clamped to the image boundaries
+        image = self.image.crop_and_resize((150, 100, 250, 200), (25, 25))
+        self.assertEqual(image.get_size(), (25, 25))
+
+        with self.assertRaises(BadImageOperationError):
+            self.image.crop_and_resize((-100, 50, -50, 100), (25, 25))
+
     def test_crop_out_of_bounds(self):
         # crop rectangle should be clamped to the image boundaries
         bottom_right_cropped_image = self.image.crop((150, 100, 250, 200))
@@ -337,6 +397,24 @@ class TestPillowOperations(unittest.TestCase):
         has_alpha = self.image.has_alpha()
         self.assertTrue(has_alpha)
 
+    def test_buffer_round_trip(self):
+        image_buffer = self.image.to_buffer_rgba()
+        self.assertIsInstance(image_buffer, RGBAImageBuffer)
+
+        image = PillowImage.from_buffer(image_buffer)
+
+        self.assertEqual(image.image.mode, "RGBA")
+        self.assertEqual(image.get_size(), (200, 150))
+        self.assertEqual(image.image.tobytes(), self.image.image.tobytes())
+
+    def test_open_rgb_buffer(self):
+        image_buffer = RGBImageBuffer((2, 1), b"\xff\x00\x00\x00\x00\xff")
+
+        image = PillowImage.from_buffer(image_buffer)
+
+        self.assertEqual(image.image.mode, "RGB")
+        self.assertEqual(image.image.getpixel((1, 0)), (0, 0, 255))
+
     def test_has_animation(self):
         has_animation = self.image.has_animation()
         self.assertFalse(has_animation)
@@ -381,7 +459,7 @@ class TestPillowOperations(unittest.TestCase):
         # Check that the alpha of pixel 1,1 is 0
         self.assertEqual(image.image.convert("RGBA").getpixel((1, 1))[3], 0)
 
-    @unittest.expectedFailure  # Pillow doesn't support animation
+    @unittest.expectedFailure  # Pillow reports the GIF's transparency as alpha
     def test_animated_gif(self):
         with open("tests/images/newtons_cradle.gif", "rb") as f:
             image = PillowImage.open(GIFImageFile(f))
@@ -389,6 +467,19 @@ class TestPillowOperations(unittest.TestCase):
         self.assertFalse(image.has_alpha())
         self.assertTrue(image.has_animation())
 
+    def test_animated_gif_frames(self):
+        with open("tests/images/newtons_cradle.gif", "rb") as f:
+            image_file = GIFImageFile(f)
+            probe = PillowImageProbe.open(image_file)
+            image = PillowImage.open(image_file)
+
+            # The same as the probe reports for the image file
+            self.assertTrue(probe.has_animation())
+            self.assertEqual(probe.get_frame_count(), 34)
+
+        self.assertTrue(image.has_animation())
+        self.assertEqual(image.get_frame_count(), 34)
+
     @unittest.expectedFailure  # Pillow doesn't support animation
     def test_resize_animated_gif(self):
         with open("tests/images/newtons_cradle.gif", "rb") as f:
@@ -414,6 +505,25 @@ class TestPillowOperations(unittest.TestCase):
         self.assertIsInstance(return_value, WebPImageFile)
         self.assertEqual(return_value.f, output)
 
+    def test_open_jpeg_with_size_hint(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            image = PillowImage.open(Image.open(f, size_hint=(100, 100)))
+
+        # Decoded at 1/4 scale, the smallest which is at least 100x100
+        self.assertEqual(image.get_size(), (150, 100))
+
+    def test_open_jpeg_with_large_size_hint(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            image = PillowImage.open(Image.open(f, size_hint=(400, 400)))
+
+        self.assertEqual(image.get_size(), (600, 400))
+
+    def test_open_png_with_size_hint(self):
+        with open("tests/images/transparent.png", "rb") as f:
+            image = PillowImage.open(Image.open(f, size_hint=(10, 10)))
+
+        self.assertEqual(image.get_size(), (200, 150))
+
     @unittest.skipIf(no_webp_support, "Pillow does not have WebP support")
     def test_open_webp(self):
         with open("tests/images/tree.webp", "rb") as f:
@@ -801,3 +911,130 @@ class TestPillowImageOrientation(unittest.TestCase):
 
         self.assert_orientation_landscape_image_is_correct(image)
         self.assert_exif_orientation_equals_value(image, 1)
+
+
+class TestPillowConverterCosts(unittest.TestCase):
+    def test_costs_for_default_cost_profile(self):
+        self.assertEqual(registry.get_converter_cost(JPEGImageFile, PillowImage), 100)
+        self.assertEqual(registry.get_converter_cost(GIFImageFile, PillowImage), 200)
+        self.assertEqual(registry.get_converter_cost(PillowImage, RGBImageBuffer), 100)
+
+    def test_costs_depend_on_image_size(self):
+        self.assertEqual(DECODE_COST(100, 100, 1, "jpeg"), 21)
+        self.assertEqual(DECODE_COST(4000, 3000, 1, "jpeg"), 980)
+
+        # Only the first frame is decoded
+        self.assertEqual(GIF_DECODE_COST(1000, 1000, 10, "gif"), 200)
+
+
+class TestPillowImageProbe(unittest.TestCase):
+    def open(self, filename, image_file_class):
+        with open(filename, "rb") as f:
+            return PillowImageProbe.open(image_file_class(io.BytesIO(f.read())))
+
+    def test_get_metadata(self):
+        image = self.open("tests/images/transparent_with_icc_profile.png", PNGImageFile)
+
+        metadata = image.get_metadata()
+
+        self.assertEqual(metadata.size, (200, 150))
+        self.assertEqual(metadata.mode, "RGBA")
+        self.assertTrue(metadata.has_alpha)
+        self.assertEqual(metadata.frame_count, 1)
+        self.assertEqual(metadata.orientation, 1)
+        self.assertTrue(metadata.has_icc_profile)
+
+    def test_get_metadata_cmyk_jpeg(self):
+        image = self.open(
+            "tests/images/dog_and_lake_cmyk_with_icc_profile.jpg", JPEGImageFile
+        )
+
+        metadata = image.get_metadata()
+
+        self.assertEqual(metadata.size, (369, 207))
+        self.assertEqual(metadata.mode, "CMYK")
+        self.assertFalse(metadata.has_alpha)
+        self.assertTrue(metadata.has_icc_profile)
+
+    def test_get_orientation(self):
+        image = self.open("tests/images/orientation/landscape_6.jpg", JPEGImageFile)
+
+        self.assertEqual(image.get_orientation(), 6)
+        self.assertFalse(image.has_icc_profile())
+
+    def test_transparent_gif(self):
+        image = self.open("tests/images/transparent.gif", GIFImageFile)
+
+        self.assertTrue(image.has_alpha())
+        self.assertFalse(image.has_animation())
+        self.assertEqual(image.get_frame_count(), 1)
+
+    def test_animated_gif(self):
+        image = self.open("tests/images/newtons_cradle.gif", GIFImageFile)
+
+        self.assertTrue(image.has_animation())
+        self.assertEqual(image.get_frame_count(), 34)
+
+    def test_size_hint(self):
+        # The size is the one PillowImage decodes the image at
+        with open("tests/images/flower.jpg", "rb") as f:
+            image_file = Image.open(f, size_hint=(60, 45))
+
+            with mock.patch.object(PILImage.Image, "load") as mock_load:
+                self.assertEqual(PillowImageProbe.open(image_file).get_size(), (60, 45))
+
+            mock_load.assert_not_called()
+            self.assertEqual(image_file.get_size(), (60, 45))
+            self.assertEqual(PillowImage.open(image_file).get_size(), (60, 45))
+
+        with open("tests/images/transparent.png", "rb") as f:
+            image_file = Image.open(f, size_hint=(10, 10))
+            self.assertEqual(PillowImageProbe.open(image_file).get_size(), (200, 150))
+
+    def test_does_not_decode_pixels(self):
+        with mock.patch.object(PILImage.Image, "load") as mock_load:
+            image = self.open("tests/images/people.jpg", JPEGImageFile)
+            image.get_metadata()
+
+        mock_load.assert_not_called()
+
+    def test_metadata_operations_on_image_file_use_probe(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            image = Image.open(f)
+
+            with mock.patch.object(PILImage.Image, "load") as mock_load:
+                self.assertEqual(image.get_size(), (600, 400))
+                self.assertFalse(image.has_alpha())
+                self.assertFalse(image.has_animation())
+                self.assertEqual(image.get_frame_count(), 1)
+                self.assertEqual(image.get_orientation(), 1)
+
+            mock_load.assert_not_called()
+
+            # Pixel operations still decode the image
+            self.assertIsInstance(image.resize((60, 40)), PillowImage)
+
+    def test_pixel_operations_do_not_import_wand(self):
+        # The probes are cheaper to convert to than PillowImage, but as they
+        # can't be converted any further, routing through them mustn't check
+        # (and import) Wand. Run in a new process, as other tests import it
+        script = (
+            "import sys; from willow.image import Image; "
+            "Image.open(open('tests/images/flower.jpg', 'rb')).resize((10, 10)); "
+            "print('wand' in sys.modules)"
+        )
+        output = subprocess.check_output([sys.executable, "-c", script])
+
+        self.assertEqual(output.strip(), b"False")
+
+    def test_pillow_image_orientation_and_icc_profile(self):
+        with open("tests/images/orientation/landscape_6.jpg", "rb") as f:
+            image = PillowImage.open(JPEGImageFile(f))
+
+        self.assertEqual(image.get_orientation(), 6)
+        self.assertEqual(image.auto_orient().get_orientation(), 1)
+
+        with open("tests/images/transparent_with_icc_profile.png", "rb") as f:
+            image = PillowImage.open(PNGImageFile(f))
+
+        self.assertTrue(image.has_icc_profile())
@@ -1,10 +1,16 @@
+import json
 import os
+import threading
 import unittest
 from unittest import mock
 
-from willow.image import Image
+from willow.image import Image, pixel_cost
 from willow.optimizers.base import OptimizerBase
+from willow.optimizers.cache import DEFAULT_MAX_SIZE, OptimizerCache
 from willow.registry import (
+    PlannedOperation,
+    RegistryFrozenError,
+    RouteCacheInfo,
     UnavailableOperationError,
     UnrecognisedOperationError,
     UnroutableOperationError,
@@ -206,6 +212,90 @@ class TestRegisterImageClass(RegistryTestCase):
         )
 
 
+class TestDeferredImageClassCheck(RegistryTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.checked = []
+        checked = self.checked
+
+        class SourceImage(Image):
+            @classmethod
+            def check(cls):
+                checked.append(cls)
+
+        class CheapImage(Image):
+            @classmethod
+            def check(cls):
+                checked.append(cls)
+
+            @Image.operation
+            def foo(self):
+                pass
+
+        class ExpensiveImage(Image):
+            @classmethod
+            def check(cls):
+                checked.append(cls)
+                raise ImportError("missing image library")
+
+            @Image.operation
+            def foo(self):
+                pass
+
+            @Image.operation
+            def bar(self):
+                pass
+
+        class DeadEndImage(Image):
+            # The cheapest to convert to, but can't be converted any further
+            # and has none of the operations
+            @classmethod
+            def check(cls):
+                checked.append(cls)
+
+        self.SourceImage = SourceImage
+        self.CheapImage = CheapImage
+        self.ExpensiveImage = ExpensiveImage
+
+        for image_class in [SourceImage, CheapImage, ExpensiveImage, DeadEndImage]:
+            self.registry.register_image_class(image_class)
+
+        self.registry.register_converter(
+            SourceImage, DeadEndImage, "to_dead_end", cost=10
+        )
+        self.registry.register_converter(SourceImage, CheapImage, "to_cheap", cost=50)
+        self.registry.register_converter(
+            SourceImage, ExpensiveImage, "to_expensive", cost=150
+        )
+
+    def test_image_classes_are_not_checked_on_registration(self):
+        self.assertEqual(self.checked, [])
+        self.assertEqual(self.registry._unavailable_image_classes, {})
+
+    def test_only_needed_image_classes_are_checked(self):
+        func, image_class, path, cost = self.registry.find_operation(
+            self.SourceImage, "foo"
+        )
+
+        self.assertEqual(image_class, self.CheapImage)
+        self.assertEqual(self.checked, [self.SourceImage, self.CheapImage])
+
+    def test_image_classes_are_only_checked_once(self):
+        self.registry.find_operation(self.SourceImage, "foo")
+        self.registry.clear_route_cache()
+        self.registry.find_operation(self.SourceImage, "foo")
+
+        self.assertEqual(self.checked, [self.SourceImage, self.CheapImage])
+
+    def test_failed_check(self):
+        with self.assertRaises(UnavailableOperationError) as e:
+            self.registry.find_operation(self.SourceImage, "bar")
+
+        self.assertIn("ExpensiveImage: missing image library", str(e.exception))
+        self.assertIn(self.ExpensiveImage, self.registry._unavailable_image_classes)
+
+
 class TestGetOperation(RegistryTestCase):
     def test_get_operation(self):
         def test_operation(image):
@@ -269,6 +359,51 @@ class TestGetConvertersFrom(RegistryTestCase):
         self.assertNotIn((test_converter_3, self.AnotherTestImage), result)
 
 
+class TestIndexes(RegistryTestCase):
+    def test_get_image_classes_with_operation(self):
+        self.registry.register_operation(self.TestImage, "foo", "test_foo")
+        self.registry.register_operation(self.AnotherTestImage, "foo", "another_foo")
+        self.registry.register_operation(self.AnotherTestImage, "bar", "another_bar")
+
+        self.assertEqual(
+            self.registry.get_image_classes(with_operation="foo"),
+            {self.TestImage, self.AnotherTestImage},
+        )
+        self.assertEqual(
+            self.registry.get_image_classes(with_operation="bar"),
+            {self.AnotherTestImage},
+        )
+
+    def test_get_image_classes_ignores_unregistered_image_classes(self):
+        self.registry.register_operation(self.UnregisteredTestImage, "foo", "foo")
+
+        self.assertTrue(self.registry.operation_exists("foo"))
+        with self.assertRaises(UnrecognisedOperationError):
+            self.registry.get_image_classes(with_operation="foo")
+
+    def test_operation_index_is_updated_on_registration(self):
+        self.assertFalse(self.registry.operation_exists("foo"))
+
+        self.registry.register_operation(self.TestImage, "foo", "test_foo")
+
+        self.assertTrue(self.registry.operation_exists("foo"))
+        self.assertEqual(
+            self.registry.get_image_classes(with_operation="foo"), {self.TestImage}
+        )
+
+    def test_converter_index_is_updated_on_registration(self):
+        self.assertEqual(list(self.registry.get_converters_from(self.TestImage)), [])
+
+        self.registry.register_converter(
+            self.TestImage, self.AnotherTestImage, "test_to_another"
+        )
+
+        self.assertEqual(
+            list(self.registry.get_converters_from(self.TestImage)),
+            [("test_to_another", self.AnotherTestImage)],
+        )
+
+
 class PathfindingTestCase(RegistryTestCase):
     def setUp(self):
         super().setUp()
@@ -395,6 +530,182 @@ class TestFindShortestPath(PathfindingTestCase):
 
         self.assertEqual(cost, 400)
 
+    def test_find_shortest_path_tie_is_deterministic(self):
+        # A -> B -> D -> E and A -> C -> D -> E both cost 300, so the tie is
+        # broken by the class names along the path
+        for _ in range(5):
+            path, cost = self.registry.find_shortest_path(self.ImageA, self.ImageE)
+
+            self.assertEqual(
+                path,
+                [
+                    (self.conv_a_to_b, self.ImageB),
+                    (self.conv_b_to_d, self.ImageD),
+                    (self.conv_d_to_e, self.ImageE),
+                ],
+            )
+            self.assertEqual(cost, 300)
+
+    def test_find_shortest_path_to_self(self):
+        path, cost = self.registry.find_shortest_path(self.ImageA, self.ImageA)
+
+        self.assertEqual(path, [])
+        self.assertEqual(cost, 0)
+
+    def test_find_shortest_path_no_path(self):
+        ImageF = type("ImageF", (Image,), {})
+        self.registry._registered_image_classes.add(ImageF)
+
+        path, cost = self.registry.find_shortest_path(self.ImageA, ImageF)
+
+        self.assertIsNone(path)
+        self.assertIsNone(cost)
+
+    def test_find_shortest_path_avoids_unavailable(self):
+        self.registry._unavailable_image_classes[self.ImageB] = ImportError(
+            "missing image library"
+        )
+
+        path, cost = self.registry.find_shortest_path(self.ImageA, self.ImageE)
+
+        self.assertEqual(
+            path,
+            [
+                (self.conv_a_to_c, self.ImageC),
+                (self.conv_c_to_d, self.ImageD),
+                (self.conv_d_to_e, self.ImageE),
+            ],
+        )
+        self.assertEqual(cost, 300)
+
+    def test_find_shortest_path_matches_find_all_paths(self):
+        self.registry._registered_converter_costs = {
+            (self.ImageA, self.ImageB): 50,
+            (self.ImageD, self.ImageB): 1000,
+            (self.ImageC, self.ImageD): 10,
+        }
+
+        for start in self.registry._registered_image_classes:
+            for end in self.registry._registered_image_classes:
+                with self.subTest(start=start, end=end):
+                    expected_cost = min(
+                        self.registry.get_path_cost(start, path)
+                        for path in self.registry.find_all_paths(start, end)
+                    )
+                    path, cost = self.registry.find_shortest_path(start, end)
+
+                    self.assertEqual(cost, expected_cost)
+                    self.assertEqual(self.registry.get_path_cost(start, path), cost)
+
+
+class TestConverterCosts(PathfindingTestCase):
+    def test_cost_function(self):
+        calls = []
+
+        def cost(width, height, frames, image_format):
+            calls.append((width, height, frames, image_format))
+            return width * height // 10000
+
+        self.registry._registered_converter_costs = {(self.ImageD, self.ImageB): cost}
+
+        self.assertEqual(
+            self.registry.get_converter_cost(self.ImageD, self.ImageB), 100
+        )
+        self.assertEqual(calls, [(1000, 1000, 1, None)])
+
+    def test_cost_function_gets_image_format(self):
+        class ImageFileClass(Image):
+            format_name = "jpeg"
+
+        cost = mock.Mock(return_value=50)
+        self.registry._registered_converter_costs = {
+            (ImageFileClass, self.ImageA): cost
+        }
+
+        self.assertEqual(
+            self.registry.get_converter_cost(ImageFileClass, self.ImageA), 50
+        )
+        cost.assert_called_once_with(1000, 1000, 1, "jpeg")
+
+    def test_pixel_cost(self):
+        cost = pixel_cost(20, 80)
+
+        self.assertEqual(cost(1000, 1000, 1, "jpeg"), 100)
+        self.assertEqual(cost(100, 100, 1, "jpeg"), 21)
+        self.assertEqual(cost(4000, 3000, 2, "gif"), 1940)
+
+    def test_pixel_cost_without_frames(self):
+        cost = pixel_cost(20, 80, frames=False)
+
+        self.assertEqual(cost(4000, 3000, 2, "gif"), 980)
+
+    def test_set_cost_profile(self):
+        # D -> B is cheap for small images but expensive for big ones
+        self.registry._registered_converter_costs = {
+            (self.ImageD, self.ImageB): lambda width, height, frames, image_format: (
+                width * height * frames // 10000
+            ),
+        }
+
+        self.registry.set_cost_profile(100, 100)
+        path, cost = self.registry.find_shortest_path(self.ImageE, self.ImageB)
+        self.assertEqual(path[-1], (self.conv_d_to_b, self.ImageB))
+        self.assertEqual(cost, 101)
+
+        self.registry.set_cost_profile(4000, 3000, frames=2)
+        path, cost = self.registry.find_shortest_path(self.ImageE, self.ImageB)
+        self.assertEqual(path[-1], (self.conv_a_to_b, self.ImageB))
+        self.assertEqual(cost, 400)
+
+    def test_autotune_converter_costs(self):
+        class SourceImage(Image):
+            pass
+
+        class FastImage(Image):
+            pass
+
+        class SlowImage(Image):
+            pass
+
+        class BrokenImage(Image):
+            pass
+
+        def broken(image):
+            raise ValueError("can't convert this image")
+
+        self.registry.register_image_class(SourceImage)
+        self.registry.register_image_class(FastImage)
+        self.registry.register_image_class(SlowImage)
+        self.registry.register_image_class(BrokenImage)
+        self.registry.register_converter(SourceImage, FastImage, lambda i: FastImage())
+        self.registry.register_converter(SourceImage, SlowImage, lambda i: SlowImage())
+        self.registry.register_converter(SourceImage, BrokenImage, broken)
+        self.registry.register_converter(
+            FastImage, SlowImage, lambda i: SlowImage(), cost=500
+        )
+
+        # Converting to FastImage takes 1 second, to SlowImage takes 3 seconds
+        # and FastImage to SlowImage takes 2 seconds
+        with mock.patch(
+            "willow.registry.time.perf_counter",
+            side_effect=[0, 1, 10, 13, 20, 30, 32],
+        ):
+            costs = self.registry.autotune_converter_costs([SourceImage()], repeat=1)
+
+        self.assertEqual(
+            costs,
+            {
+                (SourceImage, FastImage): 50,
+                (SourceImage, SlowImage): 150,
+                (FastImage, SlowImage): 100,
+            },
+        )
+        self.assertEqual(self.registry.get_converter_cost(FastImage, SlowImage), 100)
+        self.assertEqual(
+            self.registry.find_shortest_path(SourceImage, SlowImage),
+            ([(self.registry.get_converter(SourceImage, SlowImage), SlowImage)], 150),
+        )
+
 
 class TestFindOperation(PathfindingTestCase):
     def setUp(self):
@@ -503,6 +814,459 @@ class TestFindOperation(PathfindingTestCase):
         )
 
 
+class RouteCacheTestCase(PathfindingTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.ImageF = type("ImageF", (Image,), {})
+        self.registry._registered_image_classes.add(self.ImageF)
+
+        self.b_foo = "b_foo"
+        self.f_unreachable = "f_unreachable"
+
+        self.registry._registered_operations[self.ImageB]["foo"] = self.b_foo
+        self.registry._registered_operations[self.ImageF]["unreachable"] = (
+            self.f_unreachable
+        )
+
+
+class TestPlanOperations(PathfindingTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.registry._registered_operations[self.ImageB]["foo"] = "b_foo"
+        self.registry._registered_operations[self.ImageC]["foo"] = "c_foo"
+        self.registry._registered_operations[self.ImageC]["bar"] = "c_bar"
+        self.registry._registered_converter_costs = {
+            (self.ImageA, self.ImageC): 150,
+        }
+
+    def test_plan_single_operation(self):
+        plan = self.registry.plan_operations(self.ImageA, ["foo"])
+
+        self.assertEqual(
+            plan,
+            [
+                PlannedOperation(
+                    "foo", "b_foo", self.ImageB, [(self.conv_a_to_b, self.ImageB)], 100
+                )
+            ],
+        )
+
+    def test_plan_minimises_total_cost(self):
+        # Routing each operation separately would run foo on ImageB (100), then
+        # convert to ImageC for bar (200). It's cheaper to go to ImageC for both
+        plan = self.registry.plan_operations(self.ImageA, ["foo", "bar"])
+
+        self.assertEqual(
+            plan,
+            [
+                PlannedOperation(
+                    "foo", "c_foo", self.ImageC, [(self.conv_a_to_c, self.ImageC)], 150
+                ),
+                PlannedOperation("bar", "c_bar", self.ImageC, [], 0),
+            ],
+        )
+
+    def test_plan_no_operations(self):
+        self.assertEqual(self.registry.plan_operations(self.ImageA, []), [])
+
+    def test_plan_unknown_operation(self):
+        with self.assertRaises(UnrecognisedOperationError):
+            self.registry.plan_operations(self.ImageA, ["foo", "unknown"])
+
+    def test_plan_unroutable_operation(self):
+        ImageF = type("ImageF", (Image,), {})
+        self.registry._registered_image_classes.add(ImageF)
+        self.registry._registered_operations[ImageF]["unreachable"] = "f_unreachable"
+
+        with self.assertRaises(UnroutableOperationError):
+            self.registry.plan_operations(self.ImageA, ["foo", "unreachable"])
+
+
+class TestRouteCache(RouteCacheTestCase):
+    def test_find_operation_is_cached(self):
+        first = self.registry.find_operation(self.ImageA, "foo")
+        second = self.registry.find_operation(self.ImageA, "foo")
+
+        self.assertEqual(first, second)
+        self.assertEqual(
+            self.registry.route_cache_info(),
+            RouteCacheInfo(hits=1, misses=1, currsize=1),
+        )
+
+    def test_failed_lookups_are_cached(self):
+        for _ in range(2):
+            with self.assertRaises(UnrecognisedOperationError):
+                self.registry.find_operation(self.ImageA, "unknown")
+
+        self.assertEqual(
+            self.registry.route_cache_info(),
+            RouteCacheInfo(hits=1, misses=1, currsize=1),
+        )
+
+    def test_register_operation_invalidates_cache(self):
+        self.registry.find_operation(self.ImageA, "foo")
+
+        self.registry.register_operation(self.ImageA, "foo", "a_foo")
+
+        func, image_class, path, cost = self.registry.find_operation(self.ImageA, "foo")
+        self.assertEqual(func, "a_foo")
+        self.assertEqual(image_class, self.ImageA)
+        self.assertEqual(path, [])
+        self.assertEqual(self.registry.route_cache_info().misses, 2)
+
+    def test_register_converter_invalidates_cache(self):
+        with self.assertRaises(UnroutableOperationError):
+            self.registry.find_operation(self.ImageA, "unreachable")
+
+        self.registry.register_converter(self.ImageA, self.ImageF, "a_to_f", cost=50)
+
+        func, image_class, path, cost = self.registry.find_operation(
+            self.ImageA, "unreachable"
+        )
+        self.assertEqual(func, self.f_unreachable)
+        self.assertEqual(path, [("a_to_f", self.ImageF)])
+        self.assertEqual(cost, 50)
+
+    def test_register_image_class_invalidates_cache(self):
+        self.registry.find_operation(self.ImageA, "foo")
+
+        class NewTestImage(Image):
+            @Image.operation
+            def bar(self):
+                pass
+
+        self.registry.register_image_class(NewTestImage)
+
+        self.assertEqual(self.registry.route_cache_info().currsize, 0)
+
+    def test_clear_route_cache(self):
+        self.registry.find_operation(self.ImageA, "foo")
+        self.registry.find_operation(self.ImageA, "foo")
+
+        self.registry.clear_route_cache()
+
+        self.assertEqual(
+            self.registry.route_cache_info(),
+            RouteCacheInfo(hits=0, misses=0, currsize=0),
+        )
+
+
+class TestGetDispatcher(RegistryTestCase):
+    def setUp(self):
+        super().setUp()
+
+        # Only the global registry installs dispatchers onto image classes
+        patcher = mock.patch("willow.registry.registry", self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        class SourceImage(Image):
+            def __init__(self, value):
+                self.value = value
+
+        class TargetImage(Image):
+            def __init__(self, value):
+                self.value = value
+
+            @Image.operation
+            def add(self, amount):
+                return self.value + amount
+
+        self.SourceImage = SourceImage
+        self.TargetImage = TargetImage
+
+        self.registry.register_image_class(SourceImage)
+        self.registry.register_image_class(TargetImage)
+        self.registry.register_converter(
+            SourceImage, TargetImage, lambda image: TargetImage(image.value * 10)
+        )
+
+    def test_get_dispatcher(self):
+        dispatcher = self.registry.get_dispatcher(self.SourceImage, "add")
+
+        self.assertEqual(dispatcher(self.SourceImage(2), 1), 21)
+        self.assertEqual(dispatcher.__name__, "add")
+
+    def test_dispatcher_is_installed_on_image_class(self):
+        dispatcher = self.registry.get_dispatcher(self.SourceImage, "add")
+
+        self.assertIs(vars(self.SourceImage)["add"], dispatcher)
+        self.assertEqual(self.SourceImage(3).add(2), 32)
+
+    def test_dispatcher_is_not_installed_on_unregistered_image_class(self):
+        self.registry.register_converter(
+            self.UnregisteredTestImage, self.TargetImage, lambda image: image
+        )
+
+        with self.assertRaises(UnroutableOperationError):
+            self.registry.get_dispatcher(self.UnregisteredTestImage, "add")
+
+        self.assertNotIn("add", vars(self.UnregisteredTestImage))
+
+    def test_dispatchers_are_uninstalled_on_registration(self):
+        self.registry.get_dispatcher(self.SourceImage, "add")
+
+        self.registry.register_operation(
+            self.SourceImage, "add", lambda image, amount: image.value - amount
+        )
+
+        self.assertNotIn("add", vars(self.SourceImage))
+        self.assertEqual(
+            self.registry.get_dispatcher(self.SourceImage, "add")(
+                self.SourceImage(3), 2
+            ),
+            1,
+        )
+
+    def test_dispatcher_reroutes_registered_subclass(self):
+        class SubSourceImage(self.SourceImage):
+            pass
+
+        self.registry.register_image_class(SubSourceImage)
+        self.registry.register_operation(
+            SubSourceImage, "add", lambda image, amount: image.value - amount
+        )
+        self.registry.get_dispatcher(self.SourceImage, "add")
+
+        self.assertEqual(SubSourceImage(3).add(2), 1)
+        self.assertIn("add", vars(SubSourceImage))
+
+    def test_unknown_operation(self):
+        with self.assertRaises(UnrecognisedOperationError):
+            self.registry.get_dispatcher(self.SourceImage, "unknown")
+
+    def test_other_registries_dont_install_dispatchers(self):
+        other_registry = WillowRegistry()
+        other_registry.register_image_class(self.SourceImage)
+        other_registry.register_image_class(self.TargetImage)
+        other_registry.register_converter(
+            self.SourceImage, self.TargetImage, lambda image: image
+        )
+
+        dispatcher = other_registry.get_dispatcher(self.SourceImage, "add")
+
+        self.assertEqual(dispatcher(self.SourceImage(2), 1), 3)
+        self.assertNotIn("add", vars(self.SourceImage))
+
+    def test_dispatcher_calls_are_route_cache_hits(self):
+        self.registry.get_dispatcher(self.SourceImage, "add")
+        self.registry.clear_route_cache()
+        self.registry.get_dispatcher(self.SourceImage, "add")
+
+        self.SourceImage(3).add(2)
+        self.SourceImage(3).add(2)
+
+        self.assertEqual(self.registry.route_cache_info().hits, 2)
+        self.assertEqual(self.registry.route_cache_info().misses, 1)
+
+
+class TestCompileRoutes(RouteCacheTestCase):
+    def test_compile_routes(self):
+        self.registry.compile_routes()
+
+        self.assertEqual(
+            self.registry._get_snapshot().shortest_paths[self.ImageE, self.ImageB],
+            (
+                [
+                    (self.conv_e_to_d, self.ImageD),
+                    (self.conv_d_to_b, self.ImageB),
+                ],
+                200,
+            ),
+        )
+        self.assertEqual(
+            self.registry._get_snapshot().operation_routes[self.ImageA, "foo"],
+            (self.b_foo, self.ImageB, [(self.conv_a_to_b, self.ImageB)], 100),
+        )
+        self.assertIsInstance(
+            self.registry._get_snapshot().operation_routes[self.ImageA, "unreachable"],
+            UnroutableOperationError,
+        )
+
+    def test_find_operation_uses_compiled_routes(self):
+        self.registry.compile_routes()
+
+        self.registry.find_operation(self.ImageE, "foo")
+
+        self.assertEqual(self.registry.route_cache_info().hits, 1)
+        self.assertEqual(self.registry.route_cache_info().misses, 0)
+
+    def test_compiled_routes_are_discarded_on_registration(self):
+        self.registry.compile_routes()
+
+        self.registry.register_converter(self.ImageA, self.ImageF, "a_to_f")
+
+        self.assertEqual(self.registry._get_snapshot().operation_routes, {})
+        self.assertEqual(self.registry._get_snapshot().shortest_paths, {})
+
+    def test_dump_and_load_routes(self):
+        self.registry.compile_routes()
+        routes = json.loads(json.dumps(self.registry.dump_routes()))
+        expected_paths = self.registry._get_snapshot().shortest_paths
+        expected_operations = {
+            key: route
+            for key, route in self.registry._get_snapshot().operation_routes.items()
+            if not isinstance(route, LookupError)
+        }
+
+        self.registry.clear_route_cache()
+        self.assertTrue(self.registry.load_routes(routes))
+
+        self.assertEqual(
+            self.registry._get_snapshot().shortest_paths,
+            {
+                key: route
+                for key, route in expected_paths.items()
+                if route[0] is not None
+            },
+        )
+        self.assertEqual(
+            self.registry._get_snapshot().operation_routes, expected_operations
+        )
+
+    def test_load_routes_from_different_registry(self):
+        self.registry.compile_routes()
+        routes = self.registry.dump_routes()
+
+        self.registry._unavailable_image_classes[self.ImageB] = ImportError(
+            "missing image library"
+        )
+        self.registry.clear_route_cache()
+
+        self.assertFalse(self.registry.load_routes(routes))
+        self.assertEqual(self.registry._get_snapshot().operation_routes, {})
+
+
+class TestSnapshots(RouteCacheTestCase):
+    def test_registration_does_not_change_current_snapshot(self):
+        snapshot = self.registry._get_snapshot()
+        operations = snapshot.operations
+        converters = snapshot.converters
+
+        self.registry.register_operation(self.ImageA, "foo", "a_foo")
+        self.registry.register_converter(self.ImageA, self.ImageF, "a_to_f")
+
+        self.assertNotIn("foo", operations[self.ImageA])
+        self.assertNotIn((self.ImageA, self.ImageF), converters)
+        self.assertEqual(
+            snapshot.get_operation(self.ImageB, "foo"),
+            self.b_foo,
+        )
+        self.assertIsNot(self.registry._get_snapshot(), snapshot)
+
+    def test_snapshot_is_reused_until_registration(self):
+        snapshot = self.registry._get_snapshot()
+
+        self.registry.find_operation(self.ImageA, "foo")
+        self.assertIs(self.registry._get_snapshot(), snapshot)
+
+        self.registry.register_converter(self.ImageA, self.ImageF, "a_to_f")
+        self.assertIsNot(self.registry._get_snapshot(), snapshot)
+
+    def test_stale_dispatcher_reroutes(self):
+        class SourceImage(Image):
+            def __init__(self, value):
+                self.value = value
+
+        class TargetImage(Image):
+            @Image.operation
+            def get_value(self):
+                return "target"
+
+        self.registry.register_image_class(SourceImage)
+        self.registry.register_image_class(TargetImage)
+        self.registry.register_converter(
+            SourceImage, TargetImage, lambda image: TargetImage()
+        )
+        dispatcher = self.registry.get_dispatcher(SourceImage, "get_value")
+
+        self.registry.register_operation(
+            SourceImage, "get_value", lambda image: image.value
+        )
+
+        self.assertEqual(dispatcher(SourceImage("source")), "source")
+
+    def test_find_operation_while_registering(self):
+        errors = []
+        new_classes = [type(f"NewImage{i}", (Image,), {}) for i in range(50)]
+
+        def find_operations():
+            try:
+                for _ in range(200):
+                    self.registry.find_operation(self.ImageA, "foo")
+                    self.registry.get_converter(self.ImageA, self.ImageB)
+            except Exception as e:  # noqa: BLE001
+                errors.append(e)
+
+        threads = [threading.Thread(target=find_operations) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+
+        for new_class in new_classes:
+            self.registry.register_image_class(new_class)
+            self.registry.register_converter(self.ImageA, new_class, "a_to_new")
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(list(self.registry.get_converters_from(self.ImageA))), 52)
+
+
+class TestFreeze(RouteCacheTestCase):
+    def test_freeze_compiles_routes(self):
+        self.registry.freeze()
+
+        self.registry.find_operation(self.ImageE, "foo")
+
+        self.assertEqual(self.registry.route_cache_info().hits, 1)
+        self.assertEqual(self.registry.route_cache_info().misses, 0)
+
+    def test_registering_after_freeze(self):
+        self.registry.freeze()
+
+        with self.assertRaises(RegistryFrozenError):
+            self.registry.register_operation(self.ImageA, "foo", "a_foo")
+
+        with self.assertRaises(RegistryFrozenError):
+            self.registry.register_converter(self.ImageA, self.ImageF, "a_to_f")
+
+        with self.assertRaises(RegistryFrozenError):
+            self.registry.register_image_class(type("ImageG", (Image,), {}))
+
+        with self.assertRaises(RegistryFrozenError):
+            self.registry.register_optimizer(OptimizerBase)
+
+        with self.assertRaises(RegistryFrozenError):
+            self.registry.set_cost_profile(100, 100)
+
+        with self.assertRaises(RegistryFrozenError):
+            self.registry.clear_route_cache()
+
+        # Nothing was changed, and the routes are still compiled
+        func, image_class, path, cost = self.registry.find_operation(self.ImageA, "foo")
+        self.assertEqual(image_class, self.ImageB)
+        self.assertEqual(self.registry.route_cache_info().misses, 0)
+        self.assertNotIn(
+            (self.ImageA, self.ImageF), self.registry._registered_converters
+        )
+
+    @mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"})
+    def test_freeze_checks_optimizers(self):
+        class JpegOptimizer(OptimizerBase):
+            image_format = "jpeg"
+
+        with mock.patch.object(
+            JpegOptimizer, "check_library", return_value=True
+        ) as check_library:
+            self.registry.register_optimizer(JpegOptimizer)
+            self.registry.freeze()
+
+            check_library.assert_called_once_with()
+
+
 class TestRegisterOptimizer(RegistryTestCase):
     class DummyOptimizer(OptimizerBase):
         library_name = "dummy"
@@ -542,13 +1306,43 @@ class TestRegisterOptimizer(RegistryTestCase):
     @mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"})
     def test_register_optimizer_without_library(self):
         class OptimizerWithBadLibrary(OptimizerBase):
+            image_format = "jpeg"
+
             @classmethod
             def check_library(cls) -> bool:
                 return False
 
         self.registry.register_optimizer(OptimizerWithBadLibrary)
 
-        self.assertNotIn(OptimizerWithBadLibrary, self.registry._registered_optimizers)
+        self.assertEqual(self.registry.get_optimizers_for_format("jpeg"), [])
+
+    @mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "true"})
+    def test_optimizer_library_is_checked_on_first_use(self):
+        class JpegOptimizer(OptimizerBase):
+            image_format = "jpeg"
+
+        class PngOptimizer(OptimizerBase):
+            image_format = "png"
+
+        with (
+            mock.patch.object(
+                JpegOptimizer, "check_library", return_value=True
+            ) as jpeg_check_library,
+            mock.patch.object(
+                PngOptimizer, "check_library", return_value=True
+            ) as png_check_library,
+        ):
+            self.registry.register_optimizer(JpegOptimizer)
+            self.registry.register_optimizer(PngOptimizer)
+            jpeg_check_library.assert_not_called()
+
+            for _ in range(2):
+                self.assertEqual(
+                    self.registry.get_optimizers_for_format("jpeg"), [JpegOptimizer]
+                )
+
+            jpeg_check_library.assert_called_once_with()
+            png_check_library.assert_not_called()
 
     @mock.patch.dict(os.environ, {"WILLOW_OPTIMIZERS": "dummy"})
     def test_register_optimizer_with_specific_willow_optimizers_set(self):
@@ -557,3 +1351,40 @@ class TestRegisterOptimizer(RegistryTestCase):
 
         self.assertIn(self.DummyOptimizer, self.registry._registered_optimizers)
         self.assertNotIn(self.UnusedOptimizer, self.registry._registered_optimizers)
+
+
+class TestOptimizerCache(RegistryTestCase):
+    def test_no_cache_by_default(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("WILLOW_OPTIMIZER_CACHE", None)
+            self.assertIsNone(self.registry.get_optimizer_cache())
+
+    @mock.patch.dict(os.environ, {"WILLOW_OPTIMIZER_CACHE": "/tmp/willow"})
+    def test_cache_from_settings(self):
+        cache = self.registry.get_optimizer_cache()
+
+        self.assertIsInstance(cache, OptimizerCache)
+        self.assertEqual(cache.directory, "/tmp/willow")
+        self.assertEqual(cache.max_size, DEFAULT_MAX_SIZE)
+
+        # The same cache is used each time
+        self.assertIs(self.registry.get_optimizer_cache(), cache)
+
+    @mock.patch.dict(
+        os.environ,
+        {
+            "WILLOW_OPTIMIZER_CACHE": "/tmp/willow",
+            "WILLOW_OPTIMIZER_CACHE_SIZE": "1000",
+        },
+    )
+    def test_cache_size_from_settings(self):
+        self.assertEqual(self.registry.get_optimizer_cache().max_size, 1000)
+
+    @mock.patch.dict(os.environ, {"WILLOW_OPTIMIZER_CACHE": "/tmp/willow"})
+    def test_set_optimizer_cache(self):
+        cache = OptimizerCache("/tmp/other")
+        self.registry.set_optimizer_cache(cache)
+        self.assertIs(self.registry.get_optimizer_cache(), cache)
+
+        self.registry.set_optimizer_cache(None)
+        self.assertIsNone(self.registry.get_optimizer_cache())
@@ -258,6 +258,12 @@ class SvgImageTestCase(SvgWrapperTestCase):
         self.assertEqual(resized.image.root.get("width"), "10")
         self.assertEqual(resized.image.root.get("height"), "10")
 
+    def test_resize_ignores_resampling_options(self):
+        f = BytesIO(b'<svg width="42" height="42" viewBox="0 0 42 42"></svg>')
+        svg_image_file = Image.open(f)
+        resized = svg_image_file.resize((10, 10), resample="nearest", reducing_gap=2)
+        self.assertEqual(resized.get_size(), (10, 10))
+
     def test_resize_throws(self):
         f = BytesIO(b'<svg width="42" height="42" viewBox="0 0 42 42"></svg>')
         svg_image_file = Image.open(f)
@@ -365,6 +371,29 @@ class SvgCropTestCase(SvgWrapperTestCase):
         svg.crop((0, 0, 10, 10))
         self.assertEqual(svg.image.view_box, ViewBox(0, 0, 42, 42))
 
+    def test_crop_and_resize(self):
+        f = BytesIO(b'<svg width="42" height="42" viewBox="0 0 42 42"></svg>')
+        svg = SvgImage.open(Image.open(f))
+
+        expected = svg.crop((0, 0, 21, 21)).resize((10, 10))
+        result = svg.crop_and_resize((0, 0, 21, 21), (10, 10))
+
+        self.assertEqual(result.get_size(), (10, 10))
+        self.assertEqual(result.image.view_box, expected.image.view_box)
+        self.assertEqual(result.image.root.get("width"), "10")
+        self.assertEqual(result.image.root.get("height"), "10")
+        self.assertEqual(svg.image.view_box, ViewBox(0, 0, 42, 42))
+
+    def test_crop_and_resize_throws(self):
+        f = BytesIO(b'<svg width="42" height="42" viewBox="0 0 42 42"></svg>')
+        svg_image_file = Image.open(f)
+
+        with self.assertRaises(BadImageOperationError):
+            svg_image_file.crop_and_resize((10, 0, 0, 10), (10, 10))
+
+        with self.assertRaises(BadImageOperationError):
+            svg_image_file.crop_and_resize((0, 0, 10, 10), (0, 10))
+
     def test_crop_throws(self):
         f = BytesIO(b'<svg width="42" height="42" viewBox="0 0 42 42"></svg>')
         svg_image_file = Image.open(f)
@@ -13,12 +13,18 @@ from willow.image import (
     BadImageOperationError,
     GIFImageFile,
     IcoImageFile,
+    Image,
     JPEGImageFile,
     PNGImageFile,
     WebPImageFile,
 )
 from willow.optimizers import Cwebp, Gifsicle, Jpegoptim, Optipng, Pngquant
-from willow.plugins.wand import UnsupportedRotation, WandImage, _wand_image
+from willow.plugins.wand import (
+    UnsupportedRotation,
+    WandImage,
+    WandImageProbe,
+    _wand_image,
+)
 from willow.registry import registry
 
 no_webp_support = not WandImage.is_format_supported("WEBP")
@@ -43,10 +49,41 @@ class TestWandOperations(unittest.TestCase):
         resized_image = self.image.resize((100, 75))
         self.assertEqual(resized_image.get_size(), (100, 75))
 
+    def test_resize_with_resample_filter(self):
+        for resample in ["nearest", "bilinear", "bicubic", "lanczos"]:
+            with self.subTest(resample=resample):
+                resized_image = self.image.resize((100, 75), resample=resample)
+                self.assertEqual(resized_image.get_size(), (100, 75))
+
+    def test_resize_with_unknown_resample_filter(self):
+        with self.assertRaises(BadImageOperationError):
+            self.image.resize((100, 75), resample="unknown")
+
+    def test_resize_with_reducing_gap(self):
+        resized_image = self.image.resize((20, 15), reducing_gap=2.0)
+
+        self.assertEqual(resized_image.get_size(), (20, 15))
+        self.assertEqual(self.image.get_size(), (200, 150))
+
     def test_crop(self):
         cropped_image = self.image.crop((10, 10, 100, 100))
         self.assertEqual(cropped_image.get_size(), (90, 90))
 
+    def test_crop_and_resize(self):
+        image = self.image.crop_and_resize((10, 10, 100, 100), (45, 30))
+        self.assertEqual(image.get_size(), (45, 30))
+
+        # The original image is left alone
+        self.assertEqual(self.image.get_size(), (200, 150))
+
+    def test_crop_and_resize_out_of_bounds(self):
+        # crop rectangle should be clamped to the image boundaries
+        image = self.image.crop_and_resize((150, 100, 250, 200), (25, 25))
+        self.assertEqual(image.get_size(), (25, 25))
+
+        with self.assertRaises(BadImageOperationError):
+            self.image.crop_and_resize((-100, 50, -50, 100), (25, 25))
+
     def test_crop_out_of_bounds(self):
         # crop rectangle should be clamped to the image boundaries
         bottom_right_cropped_image = self.image.crop((150, 100, 250, 200))
@@ -358,6 +395,15 @@ class TestWandOperations(unittest.TestCase):
         self.assertIsInstance(return_value, WebPImageFile)
         self.assertEqual(return_value.f, output)
 
+    def test_open_jpeg_with_size_hint(self):
+        with open("tests/images/people.jpg", "rb") as f:
+            image = WandImage.open(Image.open(f, size_hint=(100, 100)))
+
+        width, height = image.get_size()
+        self.assertGreaterEqual(width, 100)
+        self.assertGreaterEqual(height, 100)
+        self.assertLess(width, 600)
+
     @unittest.skipIf(no_webp_support, "ImageMagick was built without WebP support")
     def test_open_webp(self):
         with open("tests/images/tree.webp", "rb") as f:
@@ -601,3 +647,53 @@ class TestWandImageOrientation(unittest.TestCase):
         image = image.auto_orient()
 
         self.assert_orientation_landscape_image_is_correct(image)
+
+
+class TestWandImageProbe(unittest.TestCase):
+    def open(self, filename, image_file_class):
+        with open(filename, "rb") as f:
+            return WandImageProbe.open(image_file_class(io.BytesIO(f.read())))
+
+    def test_get_metadata(self):
+        image = self.open("tests/images/transparent_with_icc_profile.png", PNGImageFile)
+
+        metadata = image.get_metadata()
+
+        self.assertEqual(metadata.size, (200, 150))
+        self.assertTrue(metadata.has_alpha)
+        self.assertEqual(metadata.frame_count, 1)
+        self.assertEqual(metadata.orientation, 1)
+        self.assertTrue(metadata.has_icc_profile)
+
+    def test_get_orientation(self):
+        image = self.open("tests/images/orientation/landscape_6.jpg", JPEGImageFile)
+
+        self.assertEqual(image.get_orientation(), 6)
+        self.assertFalse(image.has_icc_profile())
+
+    def test_size_hint(self):
+        # The size is the one WandImage decodes the image at
+        with open("tests/images/flower.jpg", "rb") as f:
+            image_file = Image.open(f, size_hint=(60, 45))
+
+            size = WandImageProbe.open(image_file).get_size()
+            self.assertEqual(size, WandImage.open(image_file).get_size())
+            self.assertLess(size, (480, 360))
+
+    def test_animated_gif(self):
+        image = self.open("tests/images/newtons_cradle.gif", GIFImageFile)
+
+        self.assertTrue(image.has_animation())
+        self.assertEqual(image.get_frame_count(), 34)
+
+    def test_wand_image_orientation_and_icc_profile(self):
+        with open("tests/images/orientation/landscape_6.jpg", "rb") as f:
+            image = WandImage.open(JPEGImageFile(f))
+
+        self.assertEqual(image.get_orientation(), 6)
+        self.assertEqual(image.auto_orient().get_orientation(), 1)
+
+        with open("tests/images/transparent_with_icc_profile.png", "rb") as f:
+            image = WandImage.open(PNGImageFile(f))
+
+        self.assertTrue(image.has_icc_profile())
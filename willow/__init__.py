@@ -1,7 +1,7 @@
 from willow.image import Image  # noqa: F401
 
 
-def setup():
+def setup(compile_routes=False):
     from xml.etree import ElementTree
 
     from willow.image import (
@@ -51,6 +51,9 @@ def setup():
     # namespaces, e.g. "<ns0:svg ..."
     ElementTree.register_namespace("", "http://www.w3.org/2000/svg")
 
+    if compile_routes:
+        registry.compile_routes()
+
 
 setup()
 
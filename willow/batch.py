@@ -0,0 +1,313 @@
+import os
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import shared_memory
+
+from .image import Image, ImageBuffer, ImageFile, RGBAImageBuffer, RGBImageBuffer
+from .optimizers.runner import optimize_image_file
+from .registry import registry
+
+# The result of a task run by process_batch(). Only one of value and error is
+# set, depending on whether the task raised an exception
+BatchResult = namedtuple("BatchResult", ["value", "error"])
+
+# Refers to the contents of an image file (if image_class is None) or the
+# pixels of an image buffer in shared memory, so they can be sent to another
+# process without pickling them
+_SharedData = namedtuple("_SharedData", ["name", "nbytes", "image_class", "size"])
+
+
+def _share(data, image_class=None, size=None):
+    """
+    Copies data into a new block of shared memory. Returns the SharedMemory,
+    which must be unlinked once it's no longer needed, and a _SharedData
+    referring to it.
+    """
+    data = memoryview(data).cast("B")
+
+    # Blocks of shared memory can't be empty
+    memory = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    memory.buf[: data.nbytes] = data
+
+    return memory, _SharedData(memory.name, data.nbytes, image_class, size)
+
+
+def _read_shared(shared_data, unlink=False):
+    memory = shared_memory.SharedMemory(name=shared_data.name)
+
+    try:
+        return bytes(memory.buf[: shared_data.nbytes])
+    finally:
+        memory.close()
+
+        if unlink:
+            memory.unlink()
+
+
+def _to_buffer(image):
+    """
+    Converts an image to an RGBImageBuffer or RGBAImageBuffer.
+    """
+    if isinstance(image, ImageBuffer):
+        return image
+
+    buffer_class = RGBAImageBuffer if image.has_alpha() else RGBImageBuffer
+
+    path, _ = registry.find_shortest_path(type(image), buffer_class)
+    if path is None:
+        raise TypeError(f"Cannot convert {type(image).__name__} to an image buffer")
+
+    for converter, _ in path:
+        image = converter(image)
+
+    return image
+
+
+def _run_task(source, operations):
+    """
+    Runs in a worker process. Opens the source sent by _submit_task, runs the
+    operations on it and returns a BatchResult of the value returned by the
+    last one. Images are returned in shared memory.
+    """
+    try:
+        if not isinstance(source, _SharedData):
+            with open(source, "rb") as f:
+                return _get_task_result(Image.open(f), operations)
+
+        if source.image_class is None:
+            image = Image.open(BytesIO(_read_shared(source)))
+            return _get_task_result(image, operations)
+
+        memory = shared_memory.SharedMemory(name=source.name)
+        image = None
+        try:
+            # The pixels are used straight from shared memory, without copying
+            # them, until the result has been copied out
+            image = source.image_class(source.size, memory.buf[: source.nbytes])
+            return _get_task_result(image, operations)
+        finally:
+            image = None
+
+            try:
+                memory.close()
+            except BufferError:
+                # The pixels are still referenced (for example, by the
+                # traceback of an exception), the memory is closed once
+                # they're freed
+                pass
+    except Exception as e:  # noqa: BLE001
+        return BatchResult(None, e)
+
+
+def _get_task_result(image, operations):
+    if operations:
+        value = image.run_operations(operations)[-1]
+    else:
+        value = image
+
+    if isinstance(value, Image) and not isinstance(value, ImageFile):
+        image_buffer = _to_buffer(value)
+        memory, value = _share(image_buffer.data, type(image_buffer), image_buffer.size)
+
+        # The parent process unlinks the memory after reading it
+        memory.close()
+
+    return BatchResult(value, None)
+
+
+def _submit_task(executor, source, operations):
+    """
+    Sends a task to the pool, returning a (future, memory) tuple where memory
+    is the SharedMemory the source was copied into (if any).
+    """
+    memory = None
+
+    try:
+        if isinstance(source, ImageFile):
+            source.f.seek(0)
+            source = source.f.read()
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            memory, source = _share(source)
+        elif isinstance(source, Image):
+            image_buffer = _to_buffer(source)
+            memory, source = _share(
+                image_buffer.data, type(image_buffer), image_buffer.size
+            )
+        elif not isinstance(source, (str, os.PathLike)):
+            raise TypeError(f"Unsupported image source: {type(source).__name__}")
+
+        return executor.submit(_run_task, source, operations), memory
+    except Exception as e:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+
+        if isinstance(e, BrokenProcessPool):
+            raise
+
+        future = Future()
+        future.set_result(BatchResult(None, e))
+        return future, None
+
+
+def _get_result(task):
+    future, memory = task
+
+    try:
+        result = future.result()
+    except Exception as e:  # noqa: BLE001
+        # For example, BrokenProcessPool if a worker process died
+        return BatchResult(None, e)
+    finally:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+
+    if isinstance(result.value, _SharedData):
+        shared_data = result.value
+        data = _read_shared(shared_data, unlink=True)
+        result = BatchResult(shared_data.image_class(shared_data.size, data), None)
+
+    return result
+
+
+def _load_routes(routes):
+    # Runs when a worker process starts. Processes that aren't forked (with
+    # the spawn or forkserver start methods) start with an empty route cache
+    registry.load_routes(routes)
+
+
+def _make_process_pool(max_workers, routes):
+    return ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_load_routes, initargs=(routes,)
+    )
+
+
+def process_batch(tasks, max_workers=None, max_pending=None):
+    """
+    Runs operations on many images in a pool of processes, yielding a
+    BatchResult(value, error) for each task in the same order as tasks.
+
+    Each task is a (source, operations) tuple. The source is the path of an
+    image file, the contents of one as bytes, or an Image. Operations are in
+    the format accepted by Image.run_operations, and value is the value
+    returned by the last one. For example:
+
+        >>> for result in process_batch(
+        ...     (path, ["auto_orient", ("resize", ((100, 100),)), ("save_as_webp", (BytesIO(),))])
+        ...     for path in paths
+        ... ):
+        ...     if result.error is None:
+        ...         thumbnail = result.value.f.getvalue()
+
+    Image data is sent to and from the worker processes in shared memory
+    rather than being pickled. Images (other than image files) are sent as an
+    RGBImageBuffer or RGBAImageBuffer, so an image returned by the operations
+    is returned as one of those.
+
+    If a task raises an exception, it's returned as the error and the other
+    tasks carry on. If a worker process dies, the tasks that were waiting on
+    the pool at the time are returned with a BrokenProcessPool error, and a new
+    pool is started for the rest.
+
+    Tasks are read from the iterable as the results are consumed, with at most
+    max_pending (twice the number of workers by default) waiting for a result
+    at any time. This limits how much memory is used by a large batch.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_pending is None:
+        max_pending = max_workers * 2
+
+    executor = None
+    pending = deque()
+
+    try:
+        for source, operations in tasks:
+            if len(pending) >= max_pending:
+                yield _get_result(pending.popleft())
+
+            if executor is None:
+                # Check which plugins are available and find every route up
+                # front, so the worker processes don't each need to
+                registry.compile_routes()
+                routes = registry.dump_routes()
+                executor = _make_process_pool(max_workers, routes)
+
+            try:
+                task = _submit_task(executor, source, operations)
+            except BrokenProcessPool:
+                # A worker process died, which stops the whole pool
+                executor.shutdown(wait=False)
+                executor = _make_process_pool(max_workers, routes)
+                task = _submit_task(executor, source, operations)
+
+            pending.append(task)
+
+        while pending:
+            yield _get_result(pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        # Free the shared memory of any tasks whose results weren't consumed
+        while pending:
+            _get_result(pending.popleft())
+
+
+def _optimize(image_file, image_format, timeout):
+    optimize_image_file(image_file, image_format, timeout=timeout)
+    return image_file
+
+
+def _get_optimize_result(future):
+    try:
+        return BatchResult(future.result(), None)
+    except Exception as e:  # noqa: BLE001
+        return BatchResult(None, e)
+
+
+def optimize_batch(tasks, max_workers=None, max_pending=None, timeout=None):
+    """
+    Runs the optimizers on many image files in a pool of threads, yielding a
+    BatchResult(value, error) for each task in the same order as tasks.
+
+    Each task is an (image_file, image_format) tuple, with the arguments taken
+    by Image.optimize, and value is the image file once it's been optimized.
+    The optimizers run in subprocesses, so a pool of threads is enough to run
+    max_workers of them (one for each CPU by default) at once.
+
+    timeout is the number of seconds the optimizers can run for on each image,
+    on top of their own timeouts. If an optimizer runs over, it's killed and
+    the image file is left unoptimized.
+
+    As with process_batch, tasks are read from the iterable as the results
+    are consumed, with at most max_pending (twice the number of workers by
+    default) waiting for a result at any time.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_pending is None:
+        max_pending = max_workers * 2
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+
+    try:
+        for image_file, image_format in tasks:
+            if len(pending) >= max_pending:
+                yield _get_optimize_result(pending.popleft())
+
+            pending.append(
+                executor.submit(_optimize, image_file, image_format, timeout)
+            )
+
+        while pending:
+            yield _get_optimize_result(pending.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
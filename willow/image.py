@@ -1,16 +1,24 @@
-import os
+import asyncio
+import logging
 import re
-from io import BytesIO
-from shutil import copyfileobj
-from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import copy
+from functools import partial
+from math import prod
+from types import MethodType
 from typing import Optional
 
 import filetype
 from defusedxml import ElementTree
 from filetype.types import image as image_types
 
+from .optimizers.runner import aoptimize_image_file, optimize_image_file
 from .registry import registry
 
+logger = logging.getLogger("willow")
+
 
 class UnrecognisedImageFormatError(IOError):
     pass
@@ -25,7 +33,67 @@ class BadImageOperationError(ValueError):
     pass
 
 
+def pixel_cost(fixed, per_megapixel, frames=True):
+    """
+    Returns a converter cost function for converters that spend most of their
+    time on each pixel, such as decoders: a fixed cost, plus a cost for each
+    million pixels (in every frame, unless frames is False).
+
+        >>> @Image.converter_from(JPEGImageFile, cost=pixel_cost(20, 80))
+    """
+
+    def cost(width, height, frame_count, image_format):
+        pixels = width * height * (frame_count if frames else 1)
+        return round(fixed + per_megapixel * pixels / 1_000_000)
+
+    return cost
+
+
+# The metadata that can be read from an image file's header, see get_metadata().
+# mode is backend-specific: a Pillow mode (such as "RGB") or a Wand colorspace
+# (such as "srgb"), depending on which of them read the header
+ImageMetadata = namedtuple(
+    "ImageMetadata",
+    ["size", "mode", "has_alpha", "frame_count", "orientation", "has_icc_profile"],
+)
+
+
+# How much of the start of a file is read to detect its format. The root
+# element of an SVG image must be within this, after any XML declaration,
+# comments or doctype
+HEADER_SIZE = 64 * 1024
+
+XML_START = re.compile(rb"^(?:\xef\xbb\xbf)?\s*<")
+XML_COMMENT = re.compile(rb"<!--.*?-->", re.DOTALL)
+XML_ELEMENT = re.compile(rb"<([^\s?!/>]+)")
+
+
+def _get_pixel_count(image):
+    # Used to choose optimizers' effort levels automatically. Image files don't
+    # know their size without decoding them
+    if isinstance(image, ImageFile):
+        return None
+
+    try:
+        return prod(image.get_size())
+    except AttributeError:
+        return None
+
+
+def _run_now(func, *args):
+    # Runs func straight away, returning its result in the same way as
+    # Executor.submit()
+    future = Future()
+    future.set_result(func(*args))
+    return future
+
+
 class Image:
+    # Whether crop clamps rects that extend past the edges of the image to its
+    # boundaries (rather than, for example, extending an SVG's view box). Only
+    # then can LazyImage combine crops and drop ones that keep the whole image
+    crops_are_clamped = False
+
     @classmethod
     def check(cls):
         pass
@@ -60,31 +128,289 @@ class Image:
 
     def __getattr__(self, attr):
         try:
-            operation, _, conversion_path, _ = registry.find_operation(type(self), attr)
+            # This also installs the dispatcher on the image class, so next time
+            # the operation is found without going through __getattr__
+            dispatcher = registry.get_dispatcher(type(self), attr)
         except LookupError:
             # Operation doesn't exist
             raise AttributeError(
                 f"{self.__class__.__name__!r} object has no attribute {attr!r}"
             )
 
-        def wrapper(*args, **kwargs):
-            image = self
+        return MethodType(dispatcher, self)
 
-            for converter, _ in conversion_path:
-                image = converter(image)
+    def run_operations(self, operations):
+        """
+        Runs several operations one after the other, using the cheapest overall
+        set of conversions for the whole chain rather than routing each
+        operation separately.
 
-            return operation(image, *args, **kwargs)
+        Each item in operations is either an operation name, or a tuple of the
+        operation name, a tuple of positional arguments and optionally a dict
+        of keyword arguments. For example:
 
-        return wrapper
+            >>> image.run_operations([
+            ...     "auto_orient",
+            ...     ("resize", ((100, 100),)),
+            ...     ("save_as_webp", (f,), {"quality": 70}),
+            ... ])
+
+        If an operation returns an image, the next operation is run on that
+        image. Otherwise (for example, detect_faces), the next operation is run
+        on the same image as the previous one.
+
+        Returns a list of the values returned by each operation.
+        """
+        return [
+            result
+            for result, _ in self._iter_operations(
+                self._normalize_operations(operations)
+            )
+        ]
+
+    @staticmethod
+    def _normalize_operations(operations):
+        """
+        Converts operations in the format accepted by run_operations to a list
+        of (operation_name, args, kwargs) tuples.
+        """
+        calls = []
+        for operation in operations:
+            if isinstance(operation, str):
+                calls.append((operation, (), {}))
+            else:
+                operation_name, args, *kwargs = operation
+                calls.append((operation_name, args, kwargs[0] if kwargs else {}))
+
+        return calls
+
+    def _iter_operations(self, calls):
+        """
+        Runs a list of (operation_name, args, kwargs) tuples as described in
+        run_operations, yielding a (result, image) tuple for each one, where
+        result is the value it returned and image is the image the next
+        operation runs on.
+        """
+        plan = registry.plan_operations(type(self), [call[0] for call in calls])
+
+        image = self
+        planned_class = type(self)
+        for step, (operation_name, args, kwargs) in zip(plan, calls):
+            if type(image) is planned_class:
+                operation, path = step.func, step.path
+            else:
+                # The previous operation didn't return an image of the class
+                # the plan expected, route this operation from scratch
+                operation, _, path, _ = registry.find_operation(
+                    type(image), operation_name
+                )
+
+            converted = image
+            for converter, _ in path:
+                converted = converter(converted)
+
+            result = operation(converted, *args, **kwargs)
+
+            # If the operation didn't return an image, the next one runs on
+            # the image it was run on, so it isn't converted again
+            image = result if isinstance(result, Image) else converted
+            planned_class = step.image_class
+
+            yield result, image
+
+    def make_renditions(self, renditions, max_workers=None):
+        """
+        Makes several renditions of this image, only decoding it once.
+
+        Each rendition is a list of operations in the format accepted by
+        run_operations, usually ending with a save_as_* call. For example:
+
+            >>> image.make_renditions([
+            ...     ["auto_orient", ("resize", ((1600, 1200),)), ("save_as_webp", (f1,))],
+            ...     ["auto_orient", ("resize", ((800, 600),)), ("save_as_webp", (f2,))],
+            ...     ["auto_orient", ("resize", ((800, 600),)), ("save_as_jpeg", (f3,))],
+            ... ])
+
+        Operations that every rendition starts with are only run once. If a
+        rendition then resizes the image, it's resized from the smallest
+        rendition that's at least as large (with the same resampling options)
+        rather than from the full size image.
+
+        Renditions are made one at a time, unless max_workers is given. They
+        are then made in a pool of that many threads, which is faster as
+        Pillow and ImageMagick release the GIL while resizing and encoding.
+        Operations on the same image never run at the same time, but those on
+        different renditions (or different sizes) do.
+
+        Returns a list of the value returned by the last operation of each
+        rendition.
+        """
+        if max_workers is None:
+            return self._make_renditions(renditions, _run_now)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return self._make_renditions(renditions, executor.submit)
+
+    def _make_renditions(self, renditions, submit):
+        """
+        Implements make_renditions. Each step is run with submit(func, *args),
+        which returns a Future of its result. Steps wait for the steps they
+        depend on, which are always submitted before them, so submit must
+        start steps in the order they're submitted (as ThreadPoolExecutor
+        does).
+        """
+        renditions = [self._normalize_operations(calls) for calls in renditions]
+
+        # The operations every rendition starts with, leaving at least one
+        # operation in each
+        shared = []
+        for calls in zip(*[calls[:-1] for calls in renditions]):
+            if any(call != calls[0] for call in calls[1:]):
+                break
+
+            shared.append(calls[0])
+
+        image = self
+        if isinstance(image, JPEGImageFile) and image.size_hint is None:
+            size_hints = [
+                LazyImage._get_size_hint([(name, args) for name, args, _ in calls])
+                for calls in renditions
+            ]
+
+            if renditions and None not in size_hints:
+                # Decode the image at a scale that's large enough for them all
+                image = copy(image)
+                image.size_hint = (
+                    max(width for width, _ in size_hints),
+                    max(height for _, height in size_hints),
+                )
+
+        for _, image in image._iter_operations(shared):
+            pass
+
+        # Renditions that start with a resize run first, largest first, so each
+        # one can be resized from the previous ones
+        def get_resize_size(index):
+            calls = renditions[index][len(shared) :]
+            if calls and calls[0][0] == "resize" and calls[0][1]:
+                return tuple(calls[0][1][0])
+
+            return None
+
+        order = sorted(
+            range(len(renditions)),
+            key=lambda index: (
+                get_resize_size(index) is None,
+                -prod(get_resize_size(index) or (0, 0)),
+            ),
+        )
+
+        # Each image the renditions start from is a (future, lock) tuple. The
+        # lock is held while operations run on the image, as neither Pillow
+        # nor Wand images can be used by more than one thread at a time
+        root = (_run_now(lambda: image), threading.Lock())
+
+        # The image converted to each class the renditions are run on, so an
+        # image file is only decoded once
+        converted = {type(image): root}
+
+        # The resized images for each image class and set of resize options,
+        # as a list of (size, image) tuples from largest to smallest
+        resized = {}
+
+        def run(source, calls):
+            future, lock = source
+            result = future.result()
+
+            with lock:
+                for result, _ in result._iter_operations(calls):
+                    pass
+
+            return result
+
+        def convert(source, path):
+            future, lock = source
+            result = future.result()
+
+            with lock:
+                for converter, _ in path:
+                    result = converter(result)
+
+            return result
+
+        futures = [None] * len(renditions)
+        for index in order:
+            calls = renditions[index][len(shared) :]
+            if not calls:
+                futures[index] = submit(run, root, [])
+                continue
+
+            operation_name, args, kwargs = calls[0]
+
+            _, image_class, path, _ = registry.find_operation(
+                type(image), operation_name
+            )
+            if image_class not in converted:
+                converted[image_class] = (submit(convert, root, path), threading.Lock())
+
+            source = converted[image_class]
+            size = get_resize_size(index)
+
+            if size is not None:
+                key = (image_class, tuple(args[1:]), tuple(sorted(kwargs.items())))
+                previous = resized.setdefault(key, [])
+
+                # The smallest of the previous images that's at least as large
+                larger = [
+                    (previous_size, previous_source)
+                    for previous_size, previous_source in previous
+                    if previous_size[0] >= size[0] and previous_size[1] >= size[1]
+                ]
+
+                if larger and larger[-1][0] == size:
+                    source = larger[-1][1]
+                else:
+                    if larger:
+                        source = larger[-1][1]
+
+                    source = (submit(run, source, calls[:1]), threading.Lock())
+                    previous.append((size, source))
+
+                calls = calls[1:]
+
+            futures[index] = submit(run, source, calls)
+
+        return [future.result() for future in futures]
+
+    def lazy(self):
+        """
+        Returns a LazyImage which records auto_orient, crop, resize and
+        set_background_color_rgb instead of running them straight away. They
+        are optimized and run together when a save_as_* method is called or
+        the result is needed for anything else.
+
+            >>> image.lazy().auto_orient().crop(rect).resize(size).save_as_webp(f)
+        """
+        return LazyImage(self)
 
     # A couple of helpful methods
 
     @classmethod
-    def open(cls, f):
-        # Detect image format
-        image_format = filetype.guess_extension(f)
+    def open(cls, f, size_hint=None):
+        """
+        Opens an image file, detecting its format from the file header.
+
+        size_hint is an optional (width, height) of the smallest size the image
+        is needed at (for example, the size it will be resized to). JPEG images
+        may then be decoded at 1/2, 1/4 or 1/8 scale, as long as the decoded
+        image is still at least that size, which is much faster. Operations
+        should then use get_size() rather than the original size of the image.
+        """
+        # Detect image format. Only the header is read, however large the file
+        header = cls._read_header(f)
+        image_format = filetype.guess_extension(header)
 
-        if image_format is None and cls.maybe_xml(f):
+        if image_format is None and cls._is_svg_header(header):
             image_format = "svg"
 
         # Find initial class
@@ -97,20 +423,34 @@ class Image:
             else:
                 raise UnrecognisedImageFormatError("Unknown image format")
 
-        return initial_class(f)
+        image_file = initial_class(f)
 
-    @classmethod
-    def maybe_xml(cls, f):
-        # Check if it looks like an XML doc, it will be validated
-        # properly when we parse it in SvgImageFile
+        if size_hint is not None:
+            image_file.size_hint = tuple(size_hint)
+
+        return image_file
+
+    @staticmethod
+    def _read_header(f):
         f.seek(0)
-        pattern = re.compile(rb"^\s*<")
-        for line in f:
-            if pattern.match(line):
-                f.seek(0)
-                return True
+        header = f.read(HEADER_SIZE)
         f.seek(0)
-        return False
+        return header
+
+    @staticmethod
+    def _is_svg_header(header):
+        # Checks that the first element is an <svg> root, it will be validated
+        # properly when we parse it in SvgImageFile
+        if not XML_START.match(header):
+            return False
+
+        match = XML_ELEMENT.search(XML_COMMENT.sub(b"", header))
+        return match is not None and match.group(1).split(b":")[-1] == b"svg"
+
+    @classmethod
+    def maybe_xml(cls, f):
+        # Check if it looks like an XML doc, without reading past the header
+        return XML_START.match(cls._read_header(f)) is not None
 
     def save(
         self, image_format, output, apply_optimizers=True
@@ -133,7 +473,7 @@ class Image:
         operation_name = "save_as_" + image_format
         return getattr(self, operation_name)(output, apply_optimizers=apply_optimizers)
 
-    def optimize(self, image_file, image_format: str):
+    def optimize(self, image_file, image_format: str, timeout=None, effort=None):
         """
         Runs all available optimizers for the given image format on the given image file.
 
@@ -141,54 +481,404 @@ class Image:
         NamedTemporaryFile to guarantee we can access the file so the optimizers to work on it.
         If we get a string, we assume it's a path to a file, and will attempt to load it from
         the file system.
+
+        If any of the optimizers can read from stdin and write to stdout (see
+        OptimizerBase.supports_pipes), an image in memory is piped through them
+        instead, and only written to a temporary file for those that can't.
+        Temporary files are created in /dev/shm where it's available.
+
+        If there's an optimizer cache (see WillowRegistry.get_optimizer_cache),
+        an image that's been optimized before is replaced with the cached
+        result without running the optimizers.
+
+        If an optimizer runs for longer than its own timeout (see
+        OptimizerBase.timeout), or the optimizers altogether run for longer
+        than timeout seconds, the optimizer is killed and the image file is
+        left unoptimized.
+
+        Optimizers with effort levels (see OptimizerBase.effort_arguments) run
+        at the given effort, or their own effort if it's None. With "auto",
+        each optimizer's effort is chosen from the size of the image and the
+        time left (see OptimizerBase.choose_effort).
+
+        Each run of an optimizer is recorded with the sinks in
+        willow.optimizers.metrics, and optimizers that have been saving less
+        than their min_savings are skipped (see OptimizerBase.should_run).
         """
-        optimizers = registry.get_optimizers_for_format(image_format)
-        if not optimizers:
-            return
+        optimize_image_file(
+            image_file,
+            image_format,
+            timeout=timeout,
+            effort=effort,
+            get_pixel_count=partial(_get_pixel_count, self),
+        )
 
-        named_file_created = False
-        try:
-            if isinstance(image_file, (SpooledTemporaryFile, BytesIO)):
-                with NamedTemporaryFile(delete=False) as named_file:
-                    named_file_created = True
+    @classmethod
+    async def aopen(cls, f, size_hint=None, executor=None):
+        """
+        Like open(), but reads the file in an executor (the event loop's
+        default executor if executor is None), so it doesn't block the event
+        loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, partial(cls.open, f, size_hint=size_hint)
+        )
+
+    async def asave(
+        self, image_format, output, apply_optimizers=True, executor=None, timeout=None
+    ):
+        """
+        Like save(), but encodes the image in an executor (the event loop's
+        default executor if executor is None) and runs any optimizers with
+        aoptimize(), so it doesn't block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        image_file = await loop.run_in_executor(
+            executor, partial(self.save, image_format, output, apply_optimizers=False)
+        )
+
+        if apply_optimizers:
+            await self.aoptimize(
+                output, image_format, timeout=timeout, executor=executor
+            )
+
+        return image_file
 
-                    image_file.seek(0)
-                    copyfileobj(image_file, named_file)
+    async def aoptimize(
+        self, image_file, image_format, timeout=None, executor=None, effort=None
+    ):
+        """
+        Like optimize(), but runs the optimizers as asyncio subprocesses, and
+        copies the image file and reads and writes the optimizer cache in an
+        executor (the event loop's default executor if executor is None), so
+        it doesn't block the event loop.
+
+        If the optimizers take more than timeout seconds altogether, or one
+        runs for longer than its own timeout (see OptimizerBase.timeout), the
+        one that's running is killed and asyncio.TimeoutError is raised. The
+        same happens if the task is cancelled. Either way, the optimizers work
+        on a copy of the image file, so it's left as it was.
+
+        Optimizers run at the given effort level, as with optimize().
+        """
+        await aoptimize_image_file(
+            image_file,
+            image_format,
+            timeout=timeout,
+            effort=effort,
+            get_pixel_count=partial(_get_pixel_count, self),
+            executor=executor,
+        )
 
-                    file_path = named_file.name
 
-            elif hasattr(image_file, "name"):
-                file_path = image_file.name
+class LazyImage:
+    """
+    Records operations to run on an image, so they can be optimized and run
+    together when the result is needed. See Image.lazy().
 
-            elif isinstance(image_file, str):
-                file_path = image_file
+    Like operations on images, recording an operation returns a new LazyImage
+    and leaves this one unchanged.
+    """
+
+    def __init__(self, image, operations=()):
+        self.image = image
+        self.operations = tuple(operations)
+        self._result = None
+
+    def _record(self, operation_name, *args):
+        return LazyImage(self.image, self.operations + ((operation_name, args),))
+
+    def lazy(self):
+        return self
+
+    def auto_orient(self):
+        return self._record("auto_orient")
+
+    def crop(self, rect):
+        return self._record("crop", tuple(rect))
+
+    def resize(self, size, resample=None, reducing_gap=None):
+        if resample is None and reducing_gap is None:
+            return self._record("resize", tuple(size))
+
+        return self._record("resize", tuple(size), resample, reducing_gap)
+
+    def crop_and_resize(self, rect, size, resample=None, reducing_gap=None):
+        # Recorded separately so the crop can be combined with others
+        return self.crop(rect).resize(
+            size, resample=resample, reducing_gap=reducing_gap
+        )
+
+    def set_background_color_rgb(self, color):
+        return self._record("set_background_color_rgb", color)
+
+    def get_size(self):
+        if self._result is None and self.operations:
+            operation_name, args = self.operations[-1]
+            if operation_name == "resize":
+                # Known without running anything
+                return args[0]
 
-            elif isinstance(image_file, bytes):
-                with NamedTemporaryFile(delete=False) as named_file:
-                    named_file.write(image_file)
-                    file_path = named_file.name
-                    named_file_created = True
+        return self.evaluate().get_size()
 
+    def evaluate(self):
+        """
+        Runs the recorded operations (the first time this is called) and
+        returns the resulting image.
+        """
+        if self._result is None:
+            self._run()
+
+        return self._result
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(
+                f"{self.__class__.__name__!r} object has no attribute {attr!r}"
+            )
+
+        if attr.startswith("save_as_"):
+            # The save is run along with the recorded operations, so it's
+            # planned together with them
+            def save(*args, **kwargs):
+                return self._run((attr, args, kwargs))
+
+            return save
+
+        return getattr(self.evaluate(), attr)
+
+    def _run(self, final_call=None):
+        if self._result is None:
+            image, operations = self._prepare()
+        else:
+            image, operations = self._result, []
+
+        calls = [(operation_name, args, {}) for operation_name, args in operations]
+        if final_call is not None:
+            calls.append(final_call)
+
+        final_result = None
+        for i, (result, next_image) in enumerate(image._iter_operations(calls)):
+            if i == len(operations):
+                final_result = result
             else:
-                raise TypeError(
-                    f"Cannot optimise {type(image_file)}. It must be a readable object, or a path to a file"
-                )
+                # Only the latest image is kept, so intermediate images can be
+                # freed as soon as the next operation has finished with them
+                image = next_image
+
+        self._result = image
+        return final_result
+
+    def _prepare(self):
+        """
+        Returns the image to start from and the optimized list of operations
+        to run on it.
+        """
+        image = self.image
+        operations = list(self.operations)
+        size = None
+
+        if isinstance(image, JPEGImageFile) and image.size_hint is None:
+            size_hint = self._get_size_hint(operations)
+
+            if size_hint is not None:
+                image = copy(image)
+                image.size_hint = size_hint
+
+        if any(operation_name == "crop" for operation_name, _ in operations):
+            # Crops can only be optimized when the size of the image is known,
+            # which auto_orient can change. So that runs first, then the image
+            # is converted for the next operation to find out its size without
+            # decoding it twice
+            if operations[0][0] == "auto_orient":
+                image = image.auto_orient()
+
+                while operations and operations[0][0] == "auto_orient":
+                    operations.pop(0)
+
+            if operations:
+                _, _, path, _ = registry.find_operation(type(image), operations[0][0])
+                for converter, _ in path:
+                    image = converter(image)
+
+                try:
+                    _, crop_class, _, _ = registry.find_operation(type(image), "crop")
+                    if crop_class.crops_are_clamped:
+                        size = tuple(image.get_size())
+                except (LookupError, AttributeError):
+                    pass
+
+        return image, self._optimize_operations(operations, size)
 
-            for optimizer in optimizers:
-                optimizer.process(file_path)
+    @staticmethod
+    def _get_size_hint(operations):
+        """
+        Returns the smallest size the image needs to be decoded at for the
+        operations to give the same result (see Image.open), or None if it
+        needs to be decoded at full size.
+        """
+        orientation_may_change = False
 
-            if hasattr(image_file, "seek"):
-                # rewind and replace the image file with the optimized version
-                image_file.seek(0)
-                with open(file_path, "rb") as f:
-                    copyfileobj(f, image_file)
+        for operation_name, args in operations:
+            if operation_name == "auto_orient":
+                orientation_may_change = True
+            elif operation_name == "resize" and args:
+                width, height = args[0]
 
-            if hasattr(image_file, "truncate"):
-                image_file.truncate()  # bring the file size down to the actual image size
+                if orientation_may_change:
+                    # The hint is applied before the image is rotated
+                    width = height = max(width, height)
 
-        finally:
-            if named_file_created:
-                os.unlink(file_path)
+                return (width, height)
+            elif operation_name != "set_background_color_rgb":
+                # Anything else (such as a crop) may depend on the size of the
+                # original image
+                return None
+
+        return None
+
+    @staticmethod
+    def _optimize_operations(operations, size=None):
+        """
+        Takes a list of (operation_name, args) tuples and returns a list that
+        produces the same image with less work, for an image of the given size
+        (or None if it isn't known, or crops aren't clamped to it):
+
+         - Repeats of auto_orient and set_background_color_rgb are dropped, as
+           they don't change the image the second time
+         - Crops that keep the whole image are dropped and consecutive crops
+           are combined into one
+         - Crops are moved in front of set_background_color_rgb, so fewer
+           pixels need to be composited
+         - A resize to a size that's no larger than the previous resize
+           replaces it, so the image is only resampled once
+         - A crop followed by a resize is replaced with crop_and_resize
+        """
+        optimized = []
+
+        # The size of the image after each operation in optimized
+        sizes = []
+
+        for operation_name, args in operations:
+            current_size = sizes[-1] if sizes else size
+            last_operation_name = optimized[-1][0] if optimized else None
+
+            if operation_name in ["auto_orient", "set_background_color_rgb"]:
+                if operation_name == last_operation_name:
+                    continue
+
+                optimized.append((operation_name, args))
+                sizes.append(None if operation_name == "auto_orient" else current_size)
+
+            elif operation_name == "crop":
+                rect = tuple(args[0])
+                new_size = None
+
+                if current_size is not None:
+                    left, top, right, bottom = rect
+                    width, height = current_size
+
+                    # Invalid crops are left alone so they still raise an error
+                    if not (
+                        left >= right
+                        or left >= width
+                        or right <= 0
+                        or top >= bottom
+                        or top >= height
+                        or bottom <= 0
+                    ):
+                        rect = (
+                            max(0, left),
+                            max(0, top),
+                            min(right, width),
+                            min(bottom, height),
+                        )
+
+                        if rect == (0, 0, width, height):
+                            continue
+
+                        new_size = (rect[2] - rect[0], rect[3] - rect[1])
+
+                position = len(optimized)
+                while (
+                    position
+                    and optimized[position - 1][0] == "set_background_color_rgb"
+                ):
+                    position -= 1
+
+                if (
+                    new_size is not None
+                    and position
+                    and optimized[position - 1][0] == "crop"
+                ):
+                    # The size is only known here if the previous crop was
+                    # valid, so its rect has already been clamped
+                    previous_left, previous_top, _, _ = optimized[position - 1][1][0]
+                    rect = (
+                        previous_left + rect[0],
+                        previous_top + rect[1],
+                        previous_left + rect[2],
+                        previous_top + rect[3],
+                    )
+
+                    position -= 1
+                    del optimized[position]
+                    del sizes[position]
+
+                optimized.insert(position, ("crop", (rect,)))
+                sizes.insert(position, new_size)
+
+                # Any operations the crop was moved in front of now run on the
+                # cropped image
+                for i in range(position + 1, len(sizes)):
+                    sizes[i] = new_size
+
+            elif operation_name == "resize":
+                new_size = tuple(args[0])
+
+                # Any resample and reducing_gap arguments
+                options = tuple(args[1:])
+
+                if last_operation_name in ["resize", "crop_and_resize"]:
+                    previous_operation_name, previous_args = optimized[-1]
+                    previous_size = previous_args[
+                        0 if previous_operation_name == "resize" else 1
+                    ]
+
+                    if (
+                        new_size[0] <= previous_size[0]
+                        and new_size[1] <= previous_size[1]
+                    ):
+                        optimized.pop()
+                        sizes.pop()
+
+                        if previous_operation_name == "crop_and_resize":
+                            optimized.append(
+                                (
+                                    "crop_and_resize",
+                                    (previous_args[0], new_size, *options),
+                                )
+                            )
+                            sizes.append(new_size)
+                            continue
+
+                if optimized and optimized[-1][0] == "crop":
+                    # Resize straight from the uncropped image, so the cropped
+                    # image is never created
+                    _, (rect,) = optimized.pop()
+                    sizes.pop()
+                    optimized.append(("crop_and_resize", (rect, new_size, *options)))
+                else:
+                    optimized.append(("resize", (new_size, *options)))
+
+                sizes.append(new_size)
+
+            else:
+                optimized.append((operation_name, args))
+                sizes.append(None)
+
+        return optimized
 
 
 class ImageBuffer(Image):
@@ -242,68 +932,41 @@ class ImageFile(Image):
         """
         raise NotImplementedError
 
+    # The smallest (width, height) the image is needed at, see Image.open()
+    size_hint = None
+
     def __init__(self, f):
         self.f = f
 
 
 class JPEGImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "jpeg"
-
-    @property
-    def mime_type(self):
-        return "image/jpeg"
+    format_name = "jpeg"
+    mime_type = "image/jpeg"
 
 
 class PNGImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "png"
-
-    @property
-    def mime_type(self):
-        return "image/png"
+    format_name = "png"
+    mime_type = "image/png"
 
 
 class GIFImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "gif"
-
-    @property
-    def mime_type(self):
-        return "image/gif"
+    format_name = "gif"
+    mime_type = "image/gif"
 
 
 class BMPImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "bmp"
-
-    @property
-    def mime_type(self):
-        return "image/bmp"
+    format_name = "bmp"
+    mime_type = "image/bmp"
 
 
 class TIFFImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "tiff"
-
-    @property
-    def mime_type(self):
-        return "image/tiff"
+    format_name = "tiff"
+    mime_type = "image/tiff"
 
 
 class WebPImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "webp"
-
-    @property
-    def mime_type(self):
-        return "image/webp"
+    format_name = "webp"
+    mime_type = "image/webp"
 
 
 class SvgImageFile(ImageFile):
@@ -322,23 +985,13 @@ class SvgImageFile(ImageFile):
 
 
 class HeicImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "heic"
-
-    @property
-    def mime_type(self):
-        return "image/heic"
+    format_name = "heic"
+    mime_type = "image/heic"
 
 
 class AvifImageFile(ImageFile):
-    @property
-    def format_name(self):
-        return "avif"
-
-    @property
-    def mime_type(self):
-        return "image/avif"
+    format_name = "avif"
+    mime_type = "image/avif"
 
 
 class IcoImageFile(ImageFile):
@@ -1,14 +1,261 @@
+import asyncio
 import logging
+import os
 import subprocess
+import threading
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
 from typing import ClassVar
 
+from . import metrics
+from .steps import Step, arun_steps, run_steps
+
 logger = logging.getLogger("willow")
 
+# Effort levels, from the quickest to the one that produces the smallest
+# images, see OptimizerBase.effort_arguments
+EFFORT_LEVELS = ("fast", "balanced", "max")
+
+# Chooses an effort level for each image, see OptimizerBase.choose_effort
+AUTO_EFFORT = "auto"
+
+# The number of times an optimizer has to have run at an effort level before
+# its measurements are used to estimate how long it'll take
+MIN_MEASUREMENTS = 5
+
+# The number of times an optimizer has to have run before it can be skipped
+# for not saving enough, see OptimizerBase.min_savings
+MIN_RUNS = 10
+
+# An optimizer that's being skipped still runs on every RECHECK_INTERVAL-th
+# image, so its savings are kept up to date
+RECHECK_INTERVAL = 20
+
+# On Linux, images are passed to and from optimizers that support pipes in
+# memfd files (which live in memory) rather than through pipes, so they're
+# written and read in one go instead of a pipe buffer at a time
+HAS_MEMFD = hasattr(os, "memfd_create")
+
+
+def _get_file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+@contextmanager
+def _get_memory_files(data: bytes):
+    """
+    Yields a memfd file containing data, to use as a subprocess's stdin, and
+    an empty one for its stdout.
+    """
+    with (
+        open(os.memfd_create("willow-stdin"), "w+b") as stdin,
+        open(os.memfd_create("willow-stdout"), "w+b") as stdout,
+    ):
+        stdin.write(data)
+        stdin.seek(0)
+
+        yield stdin, stdout
+
+
+# The totals for all the runs of an optimizer at an effort level. Sizes are in
+# bytes, so the bytes saved are input_size - output_size
+EffortMeasurement = namedtuple(
+    "EffortMeasurement", ["count", "input_size", "output_size", "seconds"]
+)
+
+
+class EffortMeasurements:
+    """
+    Records how many bytes each optimizer saves and how long it takes at each
+    effort level, so that OptimizerBase.choose_effort can estimate how long an
+    image will take, and the effort levels can be tuned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._measurements = {}
+
+    def record(self, optimizer, effort, input_size, output_size, seconds):
+        with self._lock:
+            count, total_input_size, total_output_size, total_seconds = (
+                self._measurements.get((optimizer, effort), (0, 0, 0, 0.0))
+            )
+            self._measurements[optimizer, effort] = EffortMeasurement(
+                count + 1,
+                total_input_size + input_size,
+                total_output_size + output_size,
+                total_seconds + seconds,
+            )
+
+    def get(self, optimizer, effort) -> EffortMeasurement | None:
+        return self._measurements.get((optimizer, effort))
+
+    def items(self):
+        """
+        Returns a list of ((optimizer, effort), EffortMeasurement) tuples.
+        """
+        with self._lock:
+            return list(self._measurements.items())
+
+    def estimate_seconds(self, optimizer, effort, input_size) -> float | None:
+        """
+        Returns how long the optimizer is expected to take on an image of
+        input_size bytes at the effort level, or None if it hasn't run at that
+        level at least MIN_MEASUREMENTS times.
+        """
+        measurement = self.get(optimizer, effort)
+        if measurement is None or measurement.count < MIN_MEASUREMENTS:
+            return None
+
+        return measurement.seconds * input_size / max(measurement.input_size, 1)
+
+    def reset(self):
+        with self._lock:
+            self._measurements = {}
+
+
+effort_measurements = EffortMeasurements()
+
+
+# The exceptions that stop a library while it's running: it ran over its
+# timeout, or the asyncio task running it was cancelled
+_STOPPED_ERRORS = (
+    subprocess.TimeoutExpired,
+    asyncio.TimeoutError,
+    asyncio.CancelledError,
+)
+
+
+def _get_stopped_error(exc):
+    # The OptimizerRun.error for one of _STOPPED_ERRORS
+    if isinstance(exc, asyncio.CancelledError):
+        return metrics.CANCELLED
+
+    return metrics.TIMED_OUT
+
+
+# The result of running a library. If the image was passed in a file, output is
+# the library's stdout and stderr together and errors is None. If it was piped,
+# output is the optimized image
+CommandResult = namedtuple("CommandResult", ["returncode", "output", "errors"])
+
+
+def _run_command(args, data, timeout):
+    """
+    Runs a library, piping data through it unless it's None. Raises
+    subprocess.TimeoutExpired if it runs for longer than timeout seconds.
+    """
+    try:
+        if data is None:
+            output = subprocess.check_output(
+                args, stderr=subprocess.STDOUT, timeout=timeout
+            )
+            return CommandResult(0, output, None)
+
+        if HAS_MEMFD:
+            with _get_memory_files(data) as (stdin, stdout):
+                subprocess.run(
+                    args,
+                    stdin=stdin,
+                    stdout=stdout,
+                    stderr=subprocess.PIPE,
+                    check=True,
+                    timeout=timeout,
+                )
+                stdout.seek(0)
+                return CommandResult(0, stdout.read(), None)
+
+        completed = subprocess.run(
+            args, input=data, capture_output=True, check=True, timeout=timeout
+        )
+        return CommandResult(0, completed.stdout, completed.stderr)
+    except subprocess.CalledProcessError as exc:
+        return CommandResult(exc.returncode, exc.output, exc.stderr)
+
+
+async def _arun_command(args, data, timeout):
+    """
+    Like _run_command, but runs the library as an asyncio subprocess. If the
+    task is cancelled, or the library runs for longer than timeout seconds, it's
+    killed and the exception is raised.
+    """
+    with ExitStack() as stack:
+        if data is None:
+            stdin = None
+            stdout = asyncio.subprocess.PIPE
+            stderr = asyncio.subprocess.STDOUT
+            data_to_send = None
+        elif HAS_MEMFD:
+            stdin, stdout = stack.enter_context(_get_memory_files(data))
+            stderr = asyncio.subprocess.PIPE
+            data_to_send = None
+        else:
+            stdin = stdout = stderr = asyncio.subprocess.PIPE
+            data_to_send = data
+
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=stdin, stdout=stdout, stderr=stderr
+        )
+
+        try:
+            output, errors = await asyncio.wait_for(
+                process.communicate(data_to_send), timeout
+            )
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            process.kill()
+            await process.wait()
+            raise
+
+        if data is not None and HAS_MEMFD:
+            stdout.seek(0)
+            output = stdout.read()
+
+    return CommandResult(process.returncode, output, errors)
+
+
+def _command_step(args, data, timeout):
+    return Step(_run_command, _arun_command, (args, data, timeout), {})
+
 
 class OptimizerBase:
     library_name: ClassVar[str] = ""
     image_format: ClassVar[str] = ""
 
+    # Set if the library can read the image from stdin and write the optimized
+    # image to stdout, see get_pipe_command_arguments
+    supports_pipes: ClassVar[bool] = False
+
+    # The number of seconds the library can run for on an image before it's
+    # killed, or None for no limit
+    timeout: ClassVar[float | None] = None
+
+    # The arguments for each effort level (see EFFORT_LEVELS) that
+    # get_command_arguments and get_pipe_command_arguments take an effort
+    # argument for, or empty if the library's effort can't be changed
+    effort_arguments: ClassVar[dict[str, list[str]]] = {}
+
+    # The effort level used if none is chosen
+    default_effort: ClassVar[str | None] = None
+
+    # The effort level to run the library at, or AUTO_EFFORT to choose one for
+    # each image with choose_effort. The default_effort is used if it's None
+    effort: ClassVar[str | None] = None
+
+    # The largest image, as a (bytes, pixels) tuple, that choose_effort picks
+    # each effort level for
+    effort_limits: ClassVar[dict[str, tuple[int, int]]] = {
+        "max": (512 * 1024, 1_000_000),
+        "balanced": (4 * 1024 * 1024, 12_000_000),
+    }
+
+    # The fraction of the input's size (for example, 0.01 for 1%) the library
+    # has to save on average, once it's run MIN_RUNS times, for it to keep
+    # running on every image (see should_run), or None to always run it
+    min_savings: ClassVar[float | None] = None
+
     class Meta:
         abstract = True
 
@@ -40,14 +287,239 @@ class OptimizerBase:
         return []
 
     @classmethod
-    def process(cls, file_path: str):
-        args = [cls.library_name] + cls.get_command_arguments(file_path)
+    def get_pipe_command_arguments(cls) -> list[str]:
+        """
+        Return a list of arguments for the library to read the image from
+        stdin and write the optimized image to stdout.
+        """
+        return []
+
+    @classmethod
+    def get_effort_arguments(cls, effort: str | None = None) -> list[str]:
+        """
+        Returns the arguments for the effort level, or for the default_effort
+        if effort is None.
+        """
+        if not cls.effort_arguments:
+            return []
+
+        if effort is None:
+            effort = cls.default_effort
+
+        if effort not in cls.effort_arguments:
+            raise ValueError(
+                f"The '{cls.library_name}' optimizer has no effort level {effort!r}"
+            )
+
+        return cls.effort_arguments[effort]
+
+    @classmethod
+    def choose_effort(
+        cls,
+        input_size: int,
+        pixel_count: int | None = None,
+        time_limit: float | None = None,
+    ) -> str | None:
+        """
+        Returns the effort level to optimize an image of input_size bytes and
+        pixel_count pixels with: the highest one within its effort_limits that
+        isn't expected to take longer than time_limit seconds, going by how
+        long the library has taken before (see EffortMeasurements). Returns
+        None if the library has no effort levels.
+        """
+        efforts = [effort for effort in EFFORT_LEVELS if effort in cls.effort_arguments]
+        if not efforts:
+            return None
+
+        for effort in reversed(efforts[1:]):
+            if effort in cls.effort_limits:
+                max_input_size, max_pixel_count = cls.effort_limits[effort]
+                if input_size > max_input_size or (
+                    pixel_count is not None and pixel_count > max_pixel_count
+                ):
+                    continue
+
+            if time_limit is not None:
+                seconds = effort_measurements.estimate_seconds(cls, effort, input_size)
+                if seconds is not None and seconds > time_limit:
+                    continue
+
+            return effort
+
+        return efforts[0]
+
+    @classmethod
+    def _get_command_arguments(cls, file_path: str, effort: str | None = None):
+        # Optimizers without effort levels may not take an effort argument
+        if effort is None:
+            return cls.get_command_arguments(file_path)
+
+        return cls.get_command_arguments(file_path, effort=effort)
+
+    @classmethod
+    def _get_pipe_command_arguments(cls, effort: str | None = None):
+        if effort is None:
+            return cls.get_pipe_command_arguments()
+
+        return cls.get_pipe_command_arguments(effort=effort)
+
+    @classmethod
+    def _record(cls, effort, input_size, output_size, start, error=None):
+        """
+        Records a run that started at start (see metrics.get_times) with the
+        metrics sinks and, if it succeeded, in effort_measurements.
+        """
+        wall_time, cpu_time = metrics.get_elapsed_times(start)
+        effort = effort or cls.default_effort
+
+        if error is not None:
+            output_size = input_size
+        elif cls.effort_arguments:
+            effort_measurements.record(cls, effort, input_size, output_size, wall_time)
+
+        metrics.record(
+            metrics.OptimizerRun(
+                cls, effort, input_size, output_size, wall_time, cpu_time, error
+            )
+        )
+
+    @classmethod
+    def should_run(cls) -> bool:
+        """
+        Returns False if the library should be skipped for the next image,
+        because it's saved less than min_savings on average (see
+        metrics.optimizer_stats). It still runs on every RECHECK_INTERVAL-th
+        image.
+        """
+        if cls.min_savings is None:
+            return True
+
+        stats = metrics.optimizer_stats.get(cls)
+        if stats is None or stats.runs < MIN_RUNS or not stats.input_size:
+            return True
+
+        savings = 1 - stats.output_size / stats.input_size
+        if savings >= cls.min_savings:
+            return True
+
+        skipped = metrics.optimizer_stats.record_skip(cls)
+        if skipped == 1:
+            logger.info(
+                "Skipping the '%s' library, which has saved %.1f%% on average",
+                cls.library_name,
+                savings * 100,
+            )
+
+        return skipped % RECHECK_INTERVAL == 0
+
+    @classmethod
+    def get_timeout(cls, timeout: float | None = None) -> float | None:
+        """
+        Returns the timeout to run the library with: the given timeout, or the
+        optimizer's own timeout if that's shorter.
+        """
+        if timeout is None or (cls.timeout is not None and cls.timeout < timeout):
+            return cls.timeout
+
+        return timeout
+
+    @classmethod
+    def _iter_process(cls, file_path, timeout=None, effort=None):
+        """
+        Yields the step that runs the library on the image file (see
+        process()), recording the run.
+        """
+        args = [cls.library_name] + cls._get_command_arguments(file_path, effort)
+        input_size = _get_file_size(file_path)
+        start = metrics.get_times()
+
         try:
-            subprocess.check_output(args, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as exc:
-            logger.exception(
+            result = yield _command_step(args, None, cls.get_timeout(timeout))
+        except _STOPPED_ERRORS as exc:
+            cls._record(effort, input_size, None, start, _get_stopped_error(exc))
+            raise
+
+        if result.returncode:
+            logger.error(
                 "Error optimizing %s with the '%s' library with error: %s",
                 file_path,
                 cls.library_name,
-                exc.output,
+                result.output,
+            )
+            cls._record(effort, input_size, None, start, metrics.FAILED)
+        else:
+            cls._record(effort, input_size, _get_file_size(file_path), start)
+
+    @classmethod
+    def _iter_process_bytes(cls, data, timeout=None, effort=None):
+        """
+        Yields the step that pipes data through the library (see
+        process_bytes()), recording the run, and returns the optimized data.
+        """
+        args = [cls.library_name] + cls._get_pipe_command_arguments(effort)
+        start = metrics.get_times()
+
+        try:
+            result = yield _command_step(args, data, cls.get_timeout(timeout))
+        except _STOPPED_ERRORS as exc:
+            cls._record(effort, len(data), None, start, _get_stopped_error(exc))
+            raise
+
+        if result.returncode:
+            logger.error(
+                "Error optimizing image data with the '%s' library with error: %s",
+                cls.library_name,
+                result.errors,
             )
+            cls._record(effort, len(data), None, start, metrics.FAILED)
+            return data
+
+        output = result.output or data
+        cls._record(effort, len(data), len(output), start)
+        return output
+
+    @classmethod
+    def process(
+        cls, file_path: str, timeout: float | None = None, effort: str | None = None
+    ):
+        """
+        Optimizes the image file in place, at the effort level if the library
+        has them (see effort_arguments). If the library runs for longer than
+        the timeout (see get_timeout), it's killed and subprocess.TimeoutExpired
+        is raised, in which case the file may have been partly written.
+        """
+        run_steps(cls._iter_process(file_path, timeout, effort))
+
+    @classmethod
+    async def aprocess(
+        cls, file_path: str, timeout: float | None = None, effort: str | None = None
+    ):
+        """
+        Like process(), but runs the library as an asyncio subprocess. If the
+        task is cancelled, the subprocess is killed, and asyncio.TimeoutError
+        is raised if it runs over the timeout.
+        """
+        await arun_steps(cls._iter_process(file_path, timeout, effort))
+
+    @classmethod
+    def process_bytes(
+        cls, data: bytes, timeout: float | None = None, effort: str | None = None
+    ) -> bytes:
+        """
+        Optimizes the image in data by piping it through the library, for
+        optimizers that set supports_pipes. If the library fails, the data is
+        returned unchanged. If it runs for longer than the timeout (see
+        get_timeout), it's killed and subprocess.TimeoutExpired is raised.
+        """
+        return run_steps(cls._iter_process_bytes(data, timeout, effort))
+
+    @classmethod
+    async def aprocess_bytes(
+        cls, data: bytes, timeout: float | None = None, effort: str | None = None
+    ) -> bytes:
+        """
+        Like process_bytes(), but runs the library as an asyncio subprocess. If
+        the task is cancelled, the subprocess is killed, and
+        asyncio.TimeoutError is raised if it runs over the timeout.
+        """
+        return await arun_steps(cls._iter_process_bytes(data, timeout, effort))
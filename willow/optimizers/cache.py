@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+from tempfile import NamedTemporaryFile
+
+__all__ = ["OptimizerCache"]
+
+# The default maximum size of the cache, in bytes
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Stands in for the path of the image file in the command arguments that are
+# part of the cache key
+KEY_FILE_PATH = "{file}"
+
+
+class OptimizerCache:
+    """
+    Stores the result of running a chain of optimizers on an image in a
+    directory, keyed by a hash of the image and the optimizers' arguments. When
+    the files in the directory add up to more than max_size bytes, the least
+    recently used ones are removed.
+
+    The directory can be shared by several processes.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+
+        # The total size of the files in the cache, worked out the first time
+        # something is added. Other processes may add to the cache too, so
+        # it's worked out again before removing anything
+        self._size = None
+
+    def get_key(self, data: bytes, optimizers, efforts=None) -> str:
+        """
+        Returns the key for the result of running the optimizers on data, at
+        the effort levels in the efforts dict (see OptimizerBase.effort). It
+        changes with the optimizers and the arguments they run the library
+        with, so upgrading an optimizer's settings doesn't use stale results.
+        """
+        key = hashlib.sha256(data)
+        efforts = efforts or {}
+
+        for optimizer in optimizers:
+            effort = efforts.get(optimizer)
+            arguments = [
+                f"{optimizer.__module__}.{optimizer.__qualname__}",
+                optimizer.library_name,
+                *optimizer._get_command_arguments(KEY_FILE_PATH, effort),
+            ]
+            if optimizer.supports_pipes:
+                arguments += optimizer._get_pipe_command_arguments(effort)
+
+            key.update(b"\0" + "\0".join(arguments).encode())
+
+        return key.hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        # Files are spread over subdirectories, so none of them get too large
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Returns the optimized image stored for the key, or None if there isn't
+        one.
+        """
+        path = self._get_path(key)
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+
+            # Marks the file as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def set(self, key: str, data: bytes):
+        """
+        Stores an optimized image, then removes the least recently used files
+        if the cache is over max_size.
+        """
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written to a temporary file first, so other processes never see a
+        # partly written file
+        with NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix=".", delete=False
+        ) as f:
+            f.write(data)
+
+        os.replace(f.name, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry.stat().st_size for entry in self._scan())
+            else:
+                self._size += len(data)
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _scan(self):
+        # Yields a DirEntry for each file in the cache
+        try:
+            subdirectories = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+
+        for subdirectory in subdirectories:
+            if not subdirectory.is_dir():
+                continue
+
+            try:
+                for entry in os.scandir(subdirectory.path):
+                    if not entry.name.startswith("."):
+                        yield entry
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        files = []
+        for entry in self._scan():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        files.sort()
+        self._size = sum(size for _, size, _ in files)
+
+        for _, size, path in files:
+            if self._size <= self.max_size:
+                break
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+            self._size -= size
+
+    def clear(self):
+        """
+        Removes everything from the cache.
+        """
+        with self._lock:
+            for entry in self._scan():
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+            self._size = 0
@@ -10,6 +10,19 @@ class Cwebp(OptimizerBase):
 
     library_name: ClassVar[str] = "cwebp"
     image_format: ClassVar[str] = "webp"
+    supports_pipes: ClassVar[bool] = True
+    effort_arguments: ClassVar[dict[str, list[str]]] = {
+        "fast": ["-m", "2", "-mt"],
+        "balanced": ["-m", "4", "-mt"],
+        "max": [
+            "-m",
+            "6",  # inspect all encoding possibilities for best file size
+            "-mt",  # use multithreading if possible
+            "-pass",
+            "10",  # max number of passes
+        ],
+    }
+    default_effort: ClassVar[str] = "max"
 
     @classmethod
     def get_check_library_arguments(cls) -> list[str]:
@@ -18,17 +31,25 @@ class Cwebp(OptimizerBase):
 
     @classmethod
     def get_command_arguments(
-        cls, file_path: str, progressive: bool = False
+        cls, file_path: str, progressive: bool = False, effort: str | None = None
     ) -> list[str]:
         return [
-            "-m",
-            "6",  # inspect all encoding possibilities for best file size
-            "-mt",  # use multithreading if possible
-            "-pass",
-            "10",  # max number of passes
+            *cls.get_effort_arguments(effort),
             "-q",
             "75",  # compression factor. 100 produces the highest quality.
             file_path,
             "-o",
             file_path,
         ]
+
+    @classmethod
+    def get_pipe_command_arguments(cls, effort: str | None = None) -> list[str]:
+        return [
+            *cls.get_effort_arguments(effort),
+            "-q",
+            "75",  # compression factor. 100 produces the highest quality.
+            "-o",
+            "-",  # write to stdout
+            "--",
+            "-",  # read from stdin
+        ]
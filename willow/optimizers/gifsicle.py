@@ -10,11 +10,19 @@ class Gifsicle(OptimizerBase):
 
     library_name: ClassVar[str] = "gifsicle"
     image_format: ClassVar[str] = "gif"
+    effort_arguments: ClassVar[dict[str, list[str]]] = {
+        "fast": ["-O1"],
+        "balanced": ["-O2"],
+        "max": ["-O3"],  # slowest, but produces best results
+    }
+    default_effort: ClassVar[str] = "max"
 
     @classmethod
-    def get_command_arguments(cls, file_path: str) -> list[str]:
+    def get_command_arguments(
+        cls, file_path: str, effort: str | None = None
+    ) -> list[str]:
         return [
             "-b",  # required parameter for the package
-            "-O3",  # slowest, but produces best results
+            *cls.get_effort_arguments(effort),
             file_path,  # the file
         ]
@@ -0,0 +1,239 @@
+import logging
+import re
+import socket
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where CPU time isn't measured
+    resource = None
+
+__all__ = [
+    "MetricsAggregator",
+    "OptimizerRun",
+    "OptimizerStats",
+    "StatsdSink",
+    "add_sink",
+    "optimizer_stats",
+    "remove_sink",
+]
+
+logger = logging.getLogger("willow")
+
+# Values of OptimizerRun.error
+FAILED = "failed"  # the library exited with an error
+TIMED_OUT = "timed_out"  # the library was killed after running over its timeout
+CANCELLED = "cancelled"  # the asyncio task running the library was cancelled
+
+# A run of an optimizer's library on an image. Sizes are in bytes and times in
+# seconds. cpu_time is None where it can't be measured. If the run failed,
+# error is set and output_size is the same as input_size
+OptimizerRun = namedtuple(
+    "OptimizerRun",
+    [
+        "optimizer",
+        "effort",
+        "input_size",
+        "output_size",
+        "wall_time",
+        "cpu_time",
+        "error",
+    ],
+)
+
+# The totals for all the runs of an optimizer, see MetricsAggregator
+OptimizerStats = namedtuple(
+    "OptimizerStats",
+    [
+        "runs",
+        "failures",
+        "input_size",
+        "output_size",
+        "wall_time",
+        "cpu_time",
+        "skipped",
+    ],
+)
+
+
+def get_times():
+    """
+    Returns the times to measure a run from with get_elapsed_times: the wall
+    time, and the CPU time used by the process's finished child processes.
+    """
+    if resource is None:
+        return time.perf_counter(), None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.perf_counter(), usage.ru_utime + usage.ru_stime
+
+
+def get_elapsed_times(start):
+    """
+    Returns the (wall_time, cpu_time) since start, which was returned by
+    get_times. The CPU time is that of the child processes that finished in
+    between, so if other subprocesses finish at the same time (for example,
+    when optimize_batch runs several optimizers at once) it includes theirs.
+    """
+    wall_time, cpu_time = get_times()
+    start_wall_time, start_cpu_time = start
+
+    if cpu_time is None:
+        return wall_time - start_wall_time, None
+
+    return wall_time - start_wall_time, cpu_time - start_cpu_time
+
+
+class MetricsAggregator:
+    """
+    A sink that adds up the runs of each optimizer in memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, run: OptimizerRun):
+        with self._lock:
+            stats = self._stats.get(run.optimizer, OptimizerStats(0, 0, 0, 0, 0, 0, 0))
+            self._stats[run.optimizer] = stats._replace(
+                runs=stats.runs + 1,
+                failures=stats.failures + (run.error is not None),
+                input_size=stats.input_size + run.input_size,
+                output_size=stats.output_size + run.output_size,
+                wall_time=stats.wall_time + run.wall_time,
+                cpu_time=stats.cpu_time + (run.cpu_time or 0),
+            )
+
+    def record_skip(self, optimizer) -> int:
+        """
+        Counts an image the optimizer was skipped for, returning the number of
+        times it's been skipped.
+        """
+        with self._lock:
+            stats = self._stats.get(optimizer, OptimizerStats(0, 0, 0, 0, 0, 0, 0))
+            self._stats[optimizer] = stats = stats._replace(skipped=stats.skipped + 1)
+
+        return stats.skipped
+
+    def get(self, optimizer) -> OptimizerStats | None:
+        return self._stats.get(optimizer)
+
+    def items(self):
+        """
+        Returns a list of (optimizer, OptimizerStats) tuples.
+        """
+        with self._lock:
+            return list(self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+def _get_metric_name(name):
+    # Library names may be paths, which can't be used in statsd metric names
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_")
+
+
+class StatsdSink:
+    """
+    A sink that sends each run to a statsd server over UDP, in lines like:
+
+        willow.optimizer.pngquant.runs:1|c
+        willow.optimizer.pngquant.wall_time:120.500|ms
+
+    Sending is best-effort, so an unreachable server doesn't stop images from
+    being optimized.
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="willow.optimizer"):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+
+        self._lock = threading.Lock()
+        self._socket = None
+        self._address = None
+
+    def get_lines(self, run: OptimizerRun) -> list[str]:
+        name = f"{self.prefix}.{_get_metric_name(run.optimizer.library_name)}"
+        lines = [
+            f"{name}.runs:1|c",
+            f"{name}.input_bytes:{run.input_size}|c",
+            f"{name}.bytes_saved:{run.input_size - run.output_size}|c",
+            f"{name}.wall_time:{run.wall_time * 1000:.3f}|ms",
+        ]
+
+        if run.cpu_time is not None:
+            lines.append(f"{name}.cpu_time:{run.cpu_time * 1000:.3f}|ms")
+
+        if run.error is not None:
+            lines.append(f"{name}.errors.{run.error}:1|c")
+
+        return lines
+
+    def _connect(self):
+        # The host name is only looked up once
+        family, _, _, _, address = socket.getaddrinfo(
+            self.host, self.port, type=socket.SOCK_DGRAM
+        )[0]
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._address = address
+
+    def __call__(self, run: OptimizerRun):
+        data = "\n".join(self.get_lines(run)).encode()
+
+        try:
+            with self._lock:
+                if self._socket is None:
+                    self._connect()
+
+            self._socket.sendto(data, self._address)
+        except OSError as e:
+            logger.debug("Error sending optimizer metrics to statsd: %s", e)
+
+    def close(self):
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+
+# Every run is added up here, which OptimizerBase.should_run uses to skip
+# optimizers that don't save enough
+optimizer_stats = MetricsAggregator()
+
+_sinks = []
+
+
+def add_sink(sink):
+    """
+    Adds a sink that's called with an OptimizerRun each time an optimizer
+    runs, such as a MetricsAggregator, a StatsdSink or any other callable.
+    """
+    global _sinks
+    if sink not in _sinks:
+        _sinks = [*_sinks, sink]
+
+
+def remove_sink(sink):
+    global _sinks
+    _sinks = [s for s in _sinks if s is not sink]
+
+
+def record(run: OptimizerRun):
+    """
+    Sends a run to optimizer_stats and the sinks. Errors raised by sinks are
+    logged, rather than stopping the image from being optimized.
+    """
+    optimizer_stats(run)
+
+    for sink in _sinks:
+        try:
+            sink(run)
+        except Exception:  # noqa: BLE001
+            logger.exception("Error recording optimizer metrics with %r", sink)
@@ -10,12 +10,20 @@ class Optipng(OptimizerBase):
 
     library_name: ClassVar[str] = "optipng"
     image_format: ClassVar[str] = "png"
+    effort_arguments: ClassVar[dict[str, list[str]]] = {
+        "fast": ["-o1"],
+        "balanced": ["-o2"],  # optimization level 2 (out of 7)
+        "max": ["-o5"],
+    }
+    default_effort: ClassVar[str] = "balanced"
 
     @classmethod
-    def get_command_arguments(cls, file_path: str) -> list[str]:
+    def get_command_arguments(
+        cls, file_path: str, effort: str | None = None
+    ) -> list[str]:
         return [
             "-quiet",
-            "-o2",  # optimization level 2 (out of 7)
+            *cls.get_effort_arguments(effort),
             "-i0",  # non-interlaced, progressive scanned image
             file_path,  # the file
         ]
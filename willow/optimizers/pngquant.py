@@ -10,16 +10,33 @@ class Pngquant(OptimizerBase):
 
     library_name: ClassVar[str] = "pngquant"
     image_format: ClassVar[str] = "png"
+    supports_pipes: ClassVar[bool] = True
+    effort_arguments: ClassVar[dict[str, list[str]]] = {
+        "fast": ["--speed", "10"],
+        "balanced": [],  # the default speed, 4 (out of 11)
+        "max": ["--speed", "1"],
+    }
+    default_effort: ClassVar[str] = "balanced"
 
     @classmethod
     def get_command_arguments(
-        cls, file_path: str, progressive: bool = False
+        cls, file_path: str, progressive: bool = False, effort: str | None = None
     ) -> list[str]:
         return [
             "--force",  # allow overwriting existing files
             "--strip",  # remove optional metadata
+            *cls.get_effort_arguments(effort),
             "--skip-if-larger",
             file_path,  # the file as input
             "--output",
             file_path,  # the file as output
         ]
+
+    @classmethod
+    def get_pipe_command_arguments(cls, effort: str | None = None) -> list[str]:
+        return [
+            "--strip",  # remove optional metadata
+            *cls.get_effort_arguments(effort),
+            "--skip-if-larger",
+            "-",  # read from stdin and write to stdout
+        ]
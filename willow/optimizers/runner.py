@@ -0,0 +1,461 @@
+import asyncio
+import logging
+import os
+import subprocess
+import time
+from contextlib import suppress
+from functools import cache, partial
+from io import BytesIO
+from itertools import groupby
+from operator import attrgetter
+from shutil import copyfile, copyfileobj
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile, gettempdir
+
+from ..registry import registry
+from .base import AUTO_EFFORT
+from .steps import Step, arun_steps, blocking, run_steps
+
+__all__ = ["aoptimize_image_file", "optimize_image_file"]
+
+logger = logging.getLogger("willow")
+
+# Image files that optimizers can be run on in memory, piping the image
+# through those that support it instead of writing it to a temporary file
+IN_MEMORY_IMAGE_FILE_TYPES = (SpooledTemporaryFile, BytesIO, bytes)
+
+# Images larger than this (in bytes) are written to a temporary file even for
+# optimizers that support pipes, as copying them into and out of the
+# subprocess in memory takes longer (see benchmarks/bench_optimizer_pipes.py)
+MAX_PIPE_SIZE = 256 * 1024
+
+# A tmpfs, so files created there are never written to disk
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+
+@cache
+def _get_temporary_directory():
+    """
+    Returns the directory for the temporary files that optimizers work on:
+    SHARED_MEMORY_DIRECTORY if it's available, or None (the default temporary
+    directory) if not or if the TMPDIR environment variable is set.
+    """
+    if "TMPDIR" not in os.environ and os.access(
+        SHARED_MEMORY_DIRECTORY, os.W_OK | os.X_OK
+    ):
+        return SHARED_MEMORY_DIRECTORY
+
+
+def _write_temporary_file(directory, write):
+    path = None
+
+    try:
+        with NamedTemporaryFile(delete=False, dir=directory) as f:
+            path = f.name
+            write(f)
+    except BaseException:
+        if path is not None:
+            with suppress(FileNotFoundError):
+                os.unlink(path)
+
+        raise
+
+    return path
+
+
+def _make_temporary_file(write):
+    """
+    Creates a temporary file for optimizers to work on, calls write(f) to fill
+    it and returns its path. It's created in the directory returned by
+    _get_temporary_directory, unless that's full (for example, a container's
+    small /dev/shm), in which case the default temporary directory is used.
+    """
+    directory = _get_temporary_directory()
+
+    try:
+        return _write_temporary_file(directory, write)
+    except OSError as e:
+        if directory is None:
+            raise
+
+        logger.debug(
+            "Couldn't create a temporary file in %s, using %s instead: %s",
+            directory,
+            gettempdir(),
+            e,
+        )
+        return _write_temporary_file(None, write)
+
+
+def _get_optimizers(image_format):
+    # Leaves out optimizers that haven't been saving enough to be worth
+    # running, see OptimizerBase.min_savings
+    return [
+        optimizer
+        for optimizer in registry.get_optimizers_for_format(image_format)
+        if optimizer.should_run()
+    ]
+
+
+def _get_image_data_size(image_file):
+    if isinstance(image_file, bytes):
+        return len(image_file)
+
+    return image_file.seek(0, os.SEEK_END)
+
+
+def _can_pipe(image_file, optimizers):
+    return (
+        isinstance(image_file, IN_MEMORY_IMAGE_FILE_TYPES)
+        and any(optimizer.supports_pipes for optimizer in optimizers)
+        and _get_image_data_size(image_file) <= MAX_PIPE_SIZE
+    )
+
+
+def _read_image_data(image_file):
+    if isinstance(image_file, bytes):
+        return image_file
+
+    image_file.seek(0)
+    return image_file.read()
+
+
+def _replace_image_data(image_file, data):
+    if isinstance(image_file, bytes):
+        return
+
+    image_file.seek(0)
+    image_file.write(data)
+    image_file.truncate()
+
+
+def _get_time_left(deadline):
+    if deadline is None:
+        return None
+
+    return max(deadline - time.monotonic(), 0)
+
+
+def _get_process_kwargs(optimizer, efforts, deadline=None):
+    """
+    Returns the keyword arguments for running an optimizer at its effort level
+    in efforts, with the time left before the deadline as its timeout.
+    Optimizers that override process() may not accept a timeout or effort, so
+    they're only passed if they're set.
+    """
+    kwargs = {}
+
+    if deadline is not None:
+        kwargs["timeout"] = _get_time_left(deadline)
+
+    if efforts.get(optimizer) is not None:
+        kwargs["effort"] = efforts[optimizer]
+
+    return kwargs
+
+
+def _get_efforts(optimizers, effort, get_input_size, pixel_count, deadline=None):
+    """
+    Returns a dict of the effort level to run each optimizer at: effort, or
+    the optimizer's own (see OptimizerBase.effort). For AUTO_EFFORT, it's
+    chosen from the size of the image (get_input_size returns it in bytes)
+    and the time left before the deadline (see OptimizerBase.choose_effort).
+    """
+    efforts = {}
+
+    for optimizer in optimizers:
+        optimizer_effort = effort or optimizer.effort
+        if not optimizer.effort_arguments or optimizer_effort is None:
+            continue
+
+        if optimizer_effort == AUTO_EFFORT:
+            optimizer_effort = optimizer.choose_effort(
+                get_input_size(),
+                pixel_count,
+                optimizer.get_timeout(_get_time_left(deadline)),
+            )
+
+        efforts[optimizer] = optimizer_effort
+
+    return efforts
+
+
+def _get_pixel_count(get_pixel_count, optimizers, effort):
+    # Only needed to choose effort levels automatically
+    if get_pixel_count is None or AUTO_EFFORT not in (
+        effort,
+        *(optimizer.effort for optimizer in optimizers),
+    ):
+        return None
+
+    return get_pixel_count()
+
+
+def _process(optimizer, file_path, kwargs):
+    return Step(optimizer.process, optimizer.aprocess, (file_path,), kwargs)
+
+
+def _process_bytes(optimizer, data, kwargs):
+    return Step(optimizer.process_bytes, optimizer.aprocess_bytes, (data,), kwargs)
+
+
+def _read_file(file_path):
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def _write_file(file_path, data):
+    with open(file_path, "wb") as f:
+        f.write(data)
+
+
+def _open_optimizer_file(image_file, always_copy):
+    """
+    Returns the path of a file for optimizers to work on in place, and the
+    path of the temporary file to remove afterwards (or None if it's
+    image_file itself).
+
+    If always_copy is set, the optimizers work on a temporary copy even if
+    image_file is already on disk, so it's left as it was if they're
+    interrupted.
+    """
+    if isinstance(image_file, (SpooledTemporaryFile, BytesIO)) or (
+        always_copy and hasattr(image_file, "read")
+    ):
+
+        def write(f):
+            image_file.seek(0)
+            copyfileobj(image_file, f)
+
+        file_path = _make_temporary_file(write)
+        return file_path, file_path
+
+    if hasattr(image_file, "name"):
+        return image_file.name, None
+
+    if isinstance(image_file, str):
+        if not always_copy:
+            return image_file, None
+
+        def write(f):
+            with open(image_file, "rb") as source:
+                copyfileobj(source, f)
+
+        file_path = _make_temporary_file(write)
+        return file_path, file_path
+
+    if isinstance(image_file, bytes):
+        file_path = _make_temporary_file(lambda f: f.write(image_file))
+        return file_path, file_path
+
+    raise TypeError(
+        f"Cannot optimise {type(image_file)}. It must be a readable object, or a path to a file"
+    )
+
+
+def _save_optimizer_file(image_file, file_path):
+    # Replaces image_file with the optimized version in file_path
+    if hasattr(image_file, "seek"):
+        # rewind and replace the image file with the optimized version
+        image_file.seek(0)
+        with open(file_path, "rb") as f:
+            copyfileobj(f, image_file)
+
+    elif isinstance(image_file, str) and file_path != image_file:
+        copyfile(file_path, image_file)
+
+    if hasattr(image_file, "truncate"):
+        image_file.truncate()  # bring the file size down to the actual image size
+
+
+def _iter_in_optimizer_file(image_file, always_copy, iter_steps):
+    """
+    Yields the steps from iter_steps(file_path), which run optimizers on a
+    file in place (see _open_optimizer_file). If they finish without an
+    exception, image_file is replaced with the optimized version.
+    """
+    file_path, temporary_path = yield blocking(
+        _open_optimizer_file, image_file, always_copy
+    )
+
+    try:
+        yield from iter_steps(file_path)
+        yield blocking(_save_optimizer_file, image_file, file_path)
+    finally:
+        if temporary_path is not None:
+            os.unlink(temporary_path)
+
+
+def _iter_optimize_data(optimizers, data, deadline, effort, pixel_count, timeouts):
+    """
+    Yields the steps to run the optimizers on an image in memory, and returns
+    the optimized image. It's piped through the optimizers that support it,
+    and each run of the ones that don't share a temporary file.
+
+    If there's an optimizer cache (see WillowRegistry.get_optimizer_cache),
+    the result is looked up in it before running any optimizers.
+    """
+    efforts = _get_efforts(
+        optimizers, effort, partial(len, data), pixel_count, deadline
+    )
+    process_deadline = deadline if timeouts else None
+
+    cache = registry.get_optimizer_cache()
+    if cache is not None:
+        key = yield blocking(cache.get_key, data, optimizers, efforts)
+        optimized_data = yield blocking(cache.get, key)
+        if optimized_data is not None:
+            return optimized_data
+
+    def iter_process(group, file_path):
+        for optimizer in group:
+            yield _process(
+                optimizer,
+                file_path,
+                _get_process_kwargs(optimizer, efforts, process_deadline),
+            )
+
+    optimized_data = data
+    for supports_pipes, group in groupby(optimizers, attrgetter("supports_pipes")):
+        if supports_pipes:
+            for optimizer in group:
+                optimized_data = yield _process_bytes(
+                    optimizer,
+                    optimized_data,
+                    _get_process_kwargs(optimizer, efforts, process_deadline),
+                )
+        else:
+            f = BytesIO(optimized_data)
+            yield from _iter_in_optimizer_file(
+                f, False, partial(iter_process, list(group))
+            )
+            optimized_data = f.getvalue()
+
+    # The optimizers leave the image as it was if they fail (which is logged),
+    # so results that are the same as the input aren't cached, in case the
+    # failure was temporary
+    if cache is not None and optimized_data != data:
+        yield blocking(cache.set, key, optimized_data)
+
+    return optimized_data
+
+
+def _iter_optimize(
+    image_file, optimizers, timeout, effort, get_pixel_count, always_copy, timeouts
+):
+    """
+    Yields the steps to run the optimizers on image_file, for
+    optimize_image_file and aoptimize_image_file to run. If timeouts is set,
+    each optimizer is passed the time left as its timeout, otherwise the
+    caller is expected to stop the steps when the time runs out.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pixel_count = _get_pixel_count(get_pixel_count, optimizers, effort)
+
+    if _can_pipe(image_file, optimizers):
+        data = yield blocking(_read_image_data, image_file)
+        data = yield from _iter_optimize_data(
+            optimizers, data, deadline, effort, pixel_count, timeouts
+        )
+        yield blocking(_replace_image_data, image_file, data)
+        return
+
+    def iter_steps(file_path):
+        if registry.get_optimizer_cache() is not None:
+            # The image is read into memory to look it up in the cache
+            data = yield blocking(_read_file, file_path)
+            data = yield from _iter_optimize_data(
+                optimizers, data, deadline, effort, pixel_count, timeouts
+            )
+            yield blocking(_write_file, file_path, data)
+        else:
+            efforts = _get_efforts(
+                optimizers,
+                effort,
+                partial(os.path.getsize, file_path),
+                pixel_count,
+                deadline,
+            )
+            for optimizer in optimizers:
+                yield _process(
+                    optimizer,
+                    file_path,
+                    _get_process_kwargs(
+                        optimizer, efforts, deadline if timeouts else None
+                    ),
+                )
+
+    yield from _iter_in_optimizer_file(image_file, always_copy, iter_steps)
+
+
+def optimize_image_file(
+    image_file, image_format: str, timeout=None, effort=None, get_pixel_count=None
+):
+    """
+    Runs the optimizers for image_format on image_file, see Image.optimize.
+    get_pixel_count (if given) returns the number of pixels in the image, to
+    choose effort levels automatically.
+    """
+    optimizers = _get_optimizers(image_format)
+    if not optimizers:
+        return
+
+    # An optimizer that's killed may leave the file partly written, so if any
+    # of them can be, they work on a copy
+    always_copy = timeout is not None or any(
+        optimizer.timeout is not None for optimizer in optimizers
+    )
+
+    try:
+        run_steps(
+            _iter_optimize(
+                image_file,
+                optimizers,
+                timeout,
+                effort,
+                get_pixel_count,
+                always_copy,
+                timeouts=True,
+            )
+        )
+    except subprocess.TimeoutExpired as e:
+        logger.warning(
+            "Stopped optimizing a %s image after the '%s' library ran for %s seconds, it was left unoptimized",
+            image_format,
+            e.cmd[0],
+            e.timeout,
+        )
+
+
+async def aoptimize_image_file(
+    image_file,
+    image_format: str,
+    timeout=None,
+    effort=None,
+    get_pixel_count=None,
+    executor=None,
+):
+    """
+    Like optimize_image_file, but runs the optimizers as asyncio subprocesses,
+    and copies files and reads and writes the cache in executor (the event
+    loop's default executor if it's None), see Image.aoptimize.
+    """
+    loop = asyncio.get_running_loop()
+
+    # The first time, this checks the optimizers are installed by running
+    # them
+    optimizers = await loop.run_in_executor(executor, _get_optimizers, image_format)
+    if not optimizers:
+        return
+
+    # The optimizers are timed out (or cancelled) altogether, rather than
+    # passing each of them the time left, and always work on a copy
+    steps = _iter_optimize(
+        image_file,
+        optimizers,
+        timeout,
+        effort,
+        get_pixel_count,
+        always_copy=True,
+        timeouts=False,
+    )
+    await asyncio.wait_for(arun_steps(steps, executor), timeout)
@@ -0,0 +1,82 @@
+import asyncio
+from collections import namedtuple
+from functools import partial
+
+# A step of running optimizers that may block, such as reading a file or
+# running a library. Generators yield steps, and are sent back the value each
+# step returns (or have the exception it raised thrown into them), so the same
+# generator can be run with run_steps or, in asyncio, with arun_steps. The
+# async_func (if set) is awaited instead of calling func
+Step = namedtuple("Step", ["func", "async_func", "args", "kwargs"])
+
+
+def blocking(func, *args, **kwargs):
+    """
+    Returns a Step that calls func, which blocks whether it's run with
+    run_steps or arun_steps.
+    """
+    return Step(func, None, args, kwargs)
+
+
+def run_steps(steps):
+    """
+    Runs each step yielded by the steps generator, and returns the value the
+    generator returns.
+    """
+    try:
+        step = next(steps)
+
+        while True:
+            try:
+                result = step.func(*step.args, **step.kwargs)
+            except BaseException as e:  # noqa: BLE001
+                step = steps.throw(e)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun_steps(steps, executor=None):
+    """
+    Like run_steps, but awaits the async_func of the steps that have one, and
+    runs the others in an executor (the event loop's default executor if
+    executor is None), so they don't block the event loop.
+
+    A step running in an executor can't be interrupted, so if the task is
+    cancelled while it runs, the generator is sent its result once it
+    finishes, and the cancellation is thrown into it at its next step.
+    """
+    loop = asyncio.get_running_loop()
+    cancelled = None
+
+    try:
+        step = next(steps)
+
+        while True:
+            if cancelled is not None:
+                exc, cancelled = cancelled, None
+                step = steps.throw(exc)
+                continue
+
+            try:
+                if step.async_func is not None:
+                    result = await step.async_func(*step.args, **step.kwargs)
+                else:
+                    future = loop.run_in_executor(
+                        executor, partial(step.func, *step.args, **step.kwargs)
+                    )
+                    try:
+                        result = await asyncio.shield(future)
+                    except asyncio.CancelledError as e:
+                        cancelled = e
+                        result = await future
+            except BaseException as e:  # noqa: BLE001
+                step = steps.throw(e)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        if cancelled is not None:
+            raise cancelled from None
+
+        return stop.value
@@ -1,6 +1,10 @@
 import os
 
-from willow.image import Image, RGBImageBuffer
+from willow.image import Image, RGBImageBuffer, pixel_cost
+
+# The cost of copying an image's pixels, which is 100 (the default) for a
+# 1000x1000 image
+BUFFER_COST = pixel_cost(10, 90, frames=False)
 
 
 def _cv2():
@@ -53,7 +57,7 @@ class OpenCVColorImage(BaseOpenCVImage):
         _numpy()
 
     @classmethod
-    @Image.converter_from(RGBImageBuffer)
+    @Image.converter_from(RGBImageBuffer, cost=BUFFER_COST)
     def from_buffer_rgb(cls, image_buffer):
         """
         Converts a Color Image buffer into a numpy array suitable for use with OpenCV
@@ -128,7 +132,7 @@ class OpenCVGrayscaleImage(BaseOpenCVImage):
         return cascade_filename
 
     @classmethod
-    @Image.converter_from(OpenCVColorImage)
+    @Image.converter_from(OpenCVColorImage, cost=BUFFER_COST)
     def from_color(cls, colour_image):
         """
         Convert OpenCVColorImage to an OpenCVGrayscaleImage.
@@ -1,10 +1,6 @@
+import functools
 from io import BytesIO
 
-try:
-    from pillow_heif import HeifImagePlugin  # noqa: F401
-except ImportError:
-    pass
-
 from willow.image import (
     AvifImageFile,
     BadImageOperationError,
@@ -13,22 +9,44 @@ from willow.image import (
     HeicImageFile,
     IcoImageFile,
     Image,
+    ImageMetadata,
     JPEGImageFile,
     PNGImageFile,
     RGBAImageBuffer,
     RGBImageBuffer,
     TIFFImageFile,
     WebPImageFile,
+    pixel_cost,
 )
 
+# Converter costs, which are 100 (the default) for a 1000x1000 image. Only
+# the first frame of an image is decoded. GIFs cost twice as much to decode,
+# so another image class is used for them if one is available
+DECODE_COST = pixel_cost(20, 80, frames=False)
+GIF_DECODE_COST = pixel_cost(40, 160, frames=False)
+BUFFER_COST = pixel_cost(10, 90, frames=False)
+
 
 class UnsupportedRotation(Exception):
     pass
 
 
+@functools.cache
+def _register_heif_plugin():
+    # Importing pillow_heif registers the HEIF format with Pillow. This is done
+    # the first time Pillow is used rather than when Willow is imported, as
+    # it imports Pillow itself.
+    try:
+        from pillow_heif import HeifImagePlugin  # noqa: F401
+    except ImportError:
+        pass
+
+
 def _PIL_Image():
     import PIL.Image
 
+    _register_heif_plugin()
+
     return PIL.Image
 
 
@@ -38,7 +56,13 @@ def _PIL_ImageCms():
     return PIL.ImageCms
 
 
+# The EXIF tag that records how the image should be rotated or flipped
+EXIF_ORIENTATION = 0x0112
+
+
 class PillowImage(Image):
+    crops_are_clamped = True
+
     def __init__(self, image):
         self.image = image
 
@@ -57,8 +81,9 @@ class PillowImage(Image):
 
     @Image.operation
     def get_frame_count(self):
-        # Animation is not supported by PIL
-        return 1
+        # Only the first frame is decoded, but the count is the same as the
+        # one PillowImageProbe reports for the image file
+        return getattr(self.image, "n_frames", 1)
 
     @Image.operation
     def has_alpha(self):
@@ -69,11 +94,17 @@ class PillowImage(Image):
 
     @Image.operation
     def has_animation(self):
-        # Animation is not supported by PIL
-        return False
+        return getattr(self.image, "is_animated", False)
+
+    @Image.operation
+    def get_orientation(self):
+        return self.image.getexif().get(EXIF_ORIENTATION, 1)
 
     @Image.operation
-    def resize(self, size):
+    def has_icc_profile(self):
+        return bool(self.image.info.get("icc_profile"))
+
+    def _resize(self, size, resample=None, reducing_gap=None, box=None):
         # Convert 1 and P images to RGB to improve resize quality
         # (palleted images don't get antialiased or filtered when minified)
         if self.image.mode in ["1", "P"]:
@@ -84,11 +115,43 @@ class PillowImage(Image):
         else:
             image = self.image
 
-        # LANCZOS was previously known as ANTIALIAS
-        return PillowImage(image.resize(size, _PIL_Image().Resampling.LANCZOS))
+        Resampling = _PIL_Image().Resampling
+        filters = {
+            "nearest": Resampling.NEAREST,
+            "bilinear": Resampling.BILINEAR,
+            "bicubic": Resampling.BICUBIC,
+            # LANCZOS was previously known as ANTIALIAS
+            "lanczos": Resampling.LANCZOS,
+        }
+
+        try:
+            resample_filter = filters[resample or "lanczos"]
+        except KeyError:
+            raise BadImageOperationError(f"Unknown resampling filter: {resample!r}")
+
+        return PillowImage(
+            image.resize(size, resample_filter, box=box, reducing_gap=reducing_gap)
+        )
 
     @Image.operation
-    def crop(self, rect):
+    def resize(self, size, resample=None, reducing_gap=None):
+        """
+        Resizes the image to size.
+
+        :param resample: the filter to resample the image with: "nearest",
+            "bilinear", "bicubic" or "lanczos" (the default)
+        :param reducing_gap: if set, the image is first shrunk by a whole
+            number with a fast box filter, leaving it at least reducing_gap
+            times larger than size, and then resampled. Values of 2 or 3 are
+            much faster for large reductions and look almost the same
+        """
+        return self._resize(size, resample=resample, reducing_gap=reducing_gap)
+
+    def _get_crop_box(self, rect):
+        """
+        Checks that rect overlaps the image, and returns it clamped to the
+        image's boundaries.
+        """
         left, top, right, bottom = rect
         width, height = self.image.size
         if (
@@ -101,15 +164,30 @@ class PillowImage(Image):
         ):
             raise BadImageOperationError(f"Invalid crop dimensions: {rect!r}")
 
-        # clamp to image boundaries
-        clamped_rect = (
+        return (
             max(0, left),
             max(0, top),
             min(right, width),
             min(bottom, height),
         )
 
-        return PillowImage(self.image.crop(clamped_rect))
+    @Image.operation
+    def crop(self, rect):
+        return PillowImage(self.image.crop(self._get_crop_box(rect)))
+
+    @Image.operation
+    def crop_and_resize(self, rect, size, resample=None, reducing_gap=None):
+        """
+        Crops the image to rect and resizes the result to size. See resize for
+        resample and reducing_gap.
+
+        This is done in a single step, so the cropped image is never created.
+        """
+        clamped_rect = self._get_crop_box(rect)
+
+        return self._resize(
+            size, resample=resample, reducing_gap=reducing_gap, box=clamped_rect
+        )
 
     @Image.operation
     def rotate(self, angle):
@@ -405,6 +483,10 @@ class PillowImage(Image):
         if lossless:
             kwargs = {"quality": -1, "chroma": 444}
 
+        # Make sure the HEIF plugin is registered, the image may have been
+        # created without Willow's help
+        _register_heif_plugin()
+
         image = self.image
         icc_profile = self.get_icc_profile()
         if icc_profile is not None:
@@ -488,23 +570,45 @@ class PillowImage(Image):
         return self.image
 
     @classmethod
-    @Image.converter_from(JPEGImageFile)
-    @Image.converter_from(PNGImageFile)
-    @Image.converter_from(GIFImageFile, cost=200)
-    @Image.converter_from(BMPImageFile)
-    @Image.converter_from(TIFFImageFile)
-    @Image.converter_from(WebPImageFile)
-    @Image.converter_from(HeicImageFile)
-    @Image.converter_from(AvifImageFile)
-    @Image.converter_from(IcoImageFile)
+    @Image.converter_from(JPEGImageFile, cost=DECODE_COST)
+    @Image.converter_from(PNGImageFile, cost=DECODE_COST)
+    @Image.converter_from(GIFImageFile, cost=GIF_DECODE_COST)
+    @Image.converter_from(BMPImageFile, cost=DECODE_COST)
+    @Image.converter_from(TIFFImageFile, cost=DECODE_COST)
+    @Image.converter_from(WebPImageFile, cost=DECODE_COST)
+    @Image.converter_from(HeicImageFile, cost=DECODE_COST)
+    @Image.converter_from(AvifImageFile, cost=DECODE_COST)
+    @Image.converter_from(IcoImageFile, cost=DECODE_COST)
     def open(cls, image_file):
         image_file.f.seek(0)
         image = _PIL_Image().open(image_file.f)
+
+        if image_file.size_hint is not None and image.format == "JPEG":
+            # Let libjpeg decode the image at a reduced scale, as long as it's
+            # still at least as large as the hint
+            image.draft(image.mode, image_file.size_hint)
+
+        if getattr(image, "is_animated", False):
+            # Count the frames while the file is open, so get_frame_count
+            # still works after it's closed
+            image.n_frames
+
         image.load()
 
         return cls(image)
 
-    @Image.converter_to(RGBImageBuffer)
+    @classmethod
+    @Image.converter_from(RGBImageBuffer, cost=BUFFER_COST)
+    @Image.converter_from(RGBAImageBuffer, cost=BUFFER_COST)
+    def from_buffer(cls, image_buffer):
+        mode = image_buffer.mode
+        return cls(
+            _PIL_Image().frombuffer(
+                mode, image_buffer.size, image_buffer.data, "raw", mode, 0, 1
+            )
+        )
+
+    @Image.converter_to(RGBImageBuffer, cost=BUFFER_COST)
     def to_buffer_rgb(self):
         image = self.image
 
@@ -513,7 +617,7 @@ class PillowImage(Image):
 
         return RGBImageBuffer(image.size, image.tobytes())
 
-    @Image.converter_to(RGBAImageBuffer)
+    @Image.converter_to(RGBAImageBuffer, cost=BUFFER_COST)
     def to_buffer_rgba(self):
         image = self.image
 
@@ -523,4 +627,84 @@ class PillowImage(Image):
         return RGBAImageBuffer(image.size, image.tobytes())
 
 
-willow_image_classes = [PillowImage]
+class PillowImageProbe(Image):
+    """
+    Reads metadata from an image file's header without decoding its pixels.
+
+    Opening an image with Pillow only parses the header, the pixels are
+    decoded when they are first accessed. So this is a much cheaper route to
+    the image's size or format details than PillowImage, which decodes the
+    whole image up front.
+    """
+
+    def __init__(self, image):
+        self.image = image
+
+    @classmethod
+    def check(cls):
+        _PIL_Image()
+
+    @Image.operation
+    def get_size(self):
+        return self.image.size
+
+    @Image.operation
+    def get_frame_count(self):
+        # Counting the frames only reads the header of each frame
+        return getattr(self.image, "n_frames", 1)
+
+    @Image.operation
+    def has_alpha(self):
+        img = self.image
+        return img.mode in ("RGBA", "LA") or (
+            img.mode == "P" and "transparency" in img.info
+        )
+
+    @Image.operation
+    def has_animation(self):
+        return getattr(self.image, "is_animated", False)
+
+    @Image.operation
+    def get_orientation(self):
+        return self.image.getexif().get(EXIF_ORIENTATION, 1)
+
+    @Image.operation
+    def has_icc_profile(self):
+        return bool(self.image.info.get("icc_profile"))
+
+    @Image.operation
+    def get_metadata(self):
+        return ImageMetadata(
+            size=self.get_size(),
+            mode=self.image.mode,
+            has_alpha=self.has_alpha(),
+            frame_count=self.get_frame_count(),
+            orientation=self.get_orientation(),
+            has_icc_profile=self.has_icc_profile(),
+        )
+
+    @classmethod
+    @Image.converter_from(JPEGImageFile, cost=20)
+    @Image.converter_from(PNGImageFile, cost=20)
+    @Image.converter_from(GIFImageFile, cost=20)
+    @Image.converter_from(BMPImageFile, cost=20)
+    @Image.converter_from(TIFFImageFile, cost=20)
+    @Image.converter_from(WebPImageFile, cost=20)
+    @Image.converter_from(HeicImageFile, cost=20)
+    @Image.converter_from(AvifImageFile, cost=20)
+    @Image.converter_from(IcoImageFile, cost=20)
+    def open(cls, image_file):
+        image_file.f.seek(0)
+
+        # Doesn't call load(), so only the header is read
+        image = _PIL_Image().open(image_file.f)
+
+        if image_file.size_hint is not None and image.format == "JPEG":
+            # Reports the reduced size PillowImage.open decodes the image at,
+            # without decoding it
+            image.draft(image.mode, image_file.size_hint)
+
+        return cls(image)
+
+
+willow_image_classes = [PillowImage, PillowImageProbe]
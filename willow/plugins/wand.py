@@ -10,14 +10,21 @@ from willow.image import (
     HeicImageFile,
     IcoImageFile,
     Image,
+    ImageMetadata,
     JPEGImageFile,
     PNGImageFile,
     RGBAImageBuffer,
     RGBImageBuffer,
     TIFFImageFile,
     WebPImageFile,
+    pixel_cost,
 )
 
+# Converter costs, which are 150 and 100 for a 1000x1000 image. Every frame
+# of an image is decoded
+DECODE_COST = pixel_cost(50, 100)
+BUFFER_COST = pixel_cost(10, 90, frames=False)
+
 
 class UnsupportedRotation(Exception):
     pass
@@ -47,7 +54,27 @@ def _wand_version():
     return wand.version
 
 
+# Wand's names for the EXIF orientations, in the order of their values
+ORIENTATIONS = (
+    "undefined",
+    "top_left",
+    "top_right",
+    "bottom_right",
+    "bottom_left",
+    "left_top",
+    "right_top",
+    "right_bottom",
+    "left_bottom",
+)
+
+
+def _get_orientation(image):
+    return max(ORIENTATIONS.index(image.orientation), 1)
+
+
 class WandImage(Image):
+    crops_are_clamped = True
+
     def __init__(self, image):
         self.image = image
 
@@ -101,13 +128,70 @@ class WandImage(Image):
         return self.image.animation
 
     @Image.operation
-    def resize(self, size):
+    def get_orientation(self):
+        return _get_orientation(self.image)
+
+    @Image.operation
+    def has_icc_profile(self):
+        return bool(self.image.profiles.get("icc"))
+
+    def _resize(self, size, resample=None, reducing_gap=None):
+        # Resizes the image in place, so must only be called on a clone
+        width, height = size
+
+        if resample == "nearest":
+            # Picks the nearest pixel without any filtering, which is the
+            # fastest way to resize
+            self.image.sample(width, height)
+            return
+
+        filters = {
+            None: "undefined",
+            "bilinear": "triangle",
+            "bicubic": "catrom",
+            "lanczos": "lanczos",
+        }
+
+        try:
+            resample_filter = filters[resample]
+        except KeyError:
+            raise BadImageOperationError(f"Unknown resampling filter: {resample!r}")
+
+        if reducing_gap is not None:
+            # Shrink by a whole number with a box filter first, like Pillow
+            factor = min(
+                int(self.image.width / (width * reducing_gap)),
+                int(self.image.height / (height * reducing_gap)),
+            )
+
+            if factor > 1:
+                self.image.scale(
+                    -(-self.image.width // factor), -(-self.image.height // factor)
+                )
+
+        self.image.resize(width, height, filter=resample_filter)
+
+    @Image.operation
+    def resize(self, size, resample=None, reducing_gap=None):
+        """
+        Resizes the image to size.
+
+        :param resample: the filter to resample the image with: "nearest",
+            "bilinear", "bicubic" or "lanczos". By default, ImageMagick chooses
+            the filter
+        :param reducing_gap: if set, the image is first shrunk by a whole
+            number with a fast box filter, leaving it at least reducing_gap
+            times larger than size, and then resampled
+        """
         clone = self._clone()
-        clone.image.resize(size[0], size[1])
+        clone._resize(size, resample=resample, reducing_gap=reducing_gap)
         return clone
 
-    @Image.operation
-    def crop(self, rect):
+    def _get_crop_box(self, rect):
+        """
+        Checks that rect overlaps the image, and returns it clamped to the
+        image's boundaries.
+        """
         left, top, right, bottom = rect
         width, height = self.image.size
         if (
@@ -120,14 +204,33 @@ class WandImage(Image):
         ):
             raise BadImageOperationError(f"Invalid crop dimensions: {rect!r}")
 
-        clone = self._clone()
-        clone.image.crop(
-            # clamp to image boundaries
-            left=max(0, left),
-            top=max(0, top),
-            right=min(right, width),
-            bottom=min(bottom, height),
+        return (
+            max(0, left),
+            max(0, top),
+            min(right, width),
+            min(bottom, height),
         )
+
+    @Image.operation
+    def crop(self, rect):
+        left, top, right, bottom = self._get_crop_box(rect)
+
+        clone = self._clone()
+        clone.image.crop(left=left, top=top, right=right, bottom=bottom)
+        return clone
+
+    @Image.operation
+    def crop_and_resize(self, rect, size, resample=None, reducing_gap=None):
+        """
+        Crops the image to rect and resizes the result to size, without making
+        a separate copy of the cropped image. See resize for resample and
+        reducing_gap.
+        """
+        left, top, right, bottom = self._get_crop_box(rect)
+
+        clone = self._clone()
+        clone.image.crop(left=left, top=top, right=right, bottom=bottom)
+        clone._resize(size, resample=resample, reducing_gap=reducing_gap)
         return clone
 
     @Image.operation
@@ -348,29 +451,120 @@ class WandImage(Image):
         return self.image
 
     @classmethod
-    @Image.converter_from(JPEGImageFile, cost=150)
-    @Image.converter_from(PNGImageFile, cost=150)
-    @Image.converter_from(GIFImageFile, cost=150)
-    @Image.converter_from(BMPImageFile, cost=150)
-    @Image.converter_from(TIFFImageFile, cost=150)
-    @Image.converter_from(WebPImageFile, cost=150)
-    @Image.converter_from(HeicImageFile, cost=150)
-    @Image.converter_from(AvifImageFile, cost=150)
-    @Image.converter_from(IcoImageFile, cost=150)
+    @Image.converter_from(JPEGImageFile, cost=DECODE_COST)
+    @Image.converter_from(PNGImageFile, cost=DECODE_COST)
+    @Image.converter_from(GIFImageFile, cost=DECODE_COST)
+    @Image.converter_from(BMPImageFile, cost=DECODE_COST)
+    @Image.converter_from(TIFFImageFile, cost=DECODE_COST)
+    @Image.converter_from(WebPImageFile, cost=DECODE_COST)
+    @Image.converter_from(HeicImageFile, cost=DECODE_COST)
+    @Image.converter_from(AvifImageFile, cost=DECODE_COST)
+    @Image.converter_from(IcoImageFile, cost=DECODE_COST)
     def open(cls, image_file):
         image_file.f.seek(0)
-        image = _wand_image().Image(file=image_file.f)
+
+        if image_file.size_hint is not None and isinstance(image_file, JPEGImageFile):
+            # Let libjpeg decode the image at a reduced scale, as long as it's
+            # still at least as large as the hint
+            image = _wand_image().Image()
+            image.options["jpeg:size"] = "{}x{}".format(*image_file.size_hint)
+            image.read(file=image_file.f)
+        else:
+            image = _wand_image().Image(file=image_file.f)
+
         image.wand = _wand_api().library.MagickCoalesceImages(image.wand)
 
         return cls(image)
 
-    @Image.converter_to(RGBImageBuffer)
+    @Image.converter_to(RGBImageBuffer, cost=BUFFER_COST)
     def to_buffer_rgb(self):
         return RGBImageBuffer(self.image.size, self.image.make_blob("RGB"))
 
-    @Image.converter_to(RGBAImageBuffer)
+    @Image.converter_to(RGBAImageBuffer, cost=BUFFER_COST)
     def to_buffer_rgba(self):
-        return RGBImageBuffer(self.image.size, self.image.make_blob("RGBA"))
+        return RGBAImageBuffer(self.image.size, self.image.make_blob("RGBA"))
+
+
+class WandImageProbe(Image):
+    """
+    Reads metadata from an image file's header without decoding its pixels.
+
+    ImageMagick's "ping" only reads the attributes of each frame, so this is
+    a much cheaper route to the image's size or format details than
+    WandImage, which decodes and coalesces every frame.
+    """
+
+    def __init__(self, image):
+        self.image = image
+
+    @classmethod
+    def check(cls):
+        _wand_image()
+        _wand_api()
+        _wand_version()
+
+    @Image.operation
+    def get_size(self):
+        return self.image.size
+
+    @Image.operation
+    def get_frame_count(self):
+        return len(self.image.sequence)
+
+    @Image.operation
+    def has_alpha(self):
+        return self.image.alpha_channel
+
+    @Image.operation
+    def has_animation(self):
+        return self.image.animation
+
+    @Image.operation
+    def get_orientation(self):
+        return _get_orientation(self.image)
+
+    @Image.operation
+    def has_icc_profile(self):
+        return bool(self.image.profiles.get("icc"))
+
+    @Image.operation
+    def get_metadata(self):
+        return ImageMetadata(
+            size=self.get_size(),
+            mode=self.image.colorspace,
+            has_alpha=self.has_alpha(),
+            frame_count=self.get_frame_count(),
+            orientation=self.get_orientation(),
+            has_icc_profile=self.has_icc_profile(),
+        )
+
+    @classmethod
+    @Image.converter_from(JPEGImageFile, cost=60)
+    @Image.converter_from(PNGImageFile, cost=60)
+    @Image.converter_from(GIFImageFile, cost=60)
+    @Image.converter_from(BMPImageFile, cost=60)
+    @Image.converter_from(TIFFImageFile, cost=60)
+    @Image.converter_from(WebPImageFile, cost=60)
+    @Image.converter_from(HeicImageFile, cost=60)
+    @Image.converter_from(AvifImageFile, cost=60)
+    @Image.converter_from(IcoImageFile, cost=60)
+    def open(cls, image_file):
+        image_file.f.seek(0)
+
+        if image_file.size_hint is not None and isinstance(image_file, JPEGImageFile):
+            # Pings with the same hint as WandImage.open, so the reduced size
+            # the image is decoded at is reported. Image.ping() doesn't take
+            # options, so an empty image is set up and pinged into instead
+            image = _wand_image().Image()
+            image.options["jpeg:size"] = "{}x{}".format(*image_file.size_hint)
+
+            data = image_file.f.read()
+            if not _wand_api().library.MagickPingImageBlob(image.wand, data, len(data)):
+                image.raise_exception()
+
+            return cls(image)
+
+        return cls(_wand_image().Image.ping(file=image_file.f))
 
 
-willow_image_classes = [WandImage]
+willow_image_classes = [WandImage, WandImageProbe]
@@ -1,8 +1,28 @@
-from collections import defaultdict
-from typing import TYPE_CHECKING
+import hashlib
+import heapq
+import itertools
+import statistics
+import threading
+import time
+from collections import defaultdict, namedtuple
+from typing import TYPE_CHECKING, Optional
 
 if TYPE_CHECKING:
     from .optimizers import OptimizerBase
+    from .optimizers.cache import OptimizerCache
+
+
+def _get_setting(name, default=None):
+    try:
+        # try to check Django settings, if used in that context
+        from django.conf import settings
+
+        return getattr(settings, name, default)
+    except ImportError:
+        # fall back to env vars.
+        import os
+
+        return os.environ.get(name, default)
 
 
 class UnrecognisedOperationError(LookupError):
@@ -31,75 +51,209 @@ class UnroutableOperationError(LookupError):
     pass
 
 
+class RegistryFrozenError(RuntimeError):
+    """
+    Raised when something is registered after the registry has been frozen.
+    """
+
+    pass
+
+
+RouteCacheInfo = namedtuple("RouteCacheInfo", ["hits", "misses", "currsize"])
+
+PlannedOperation = namedtuple(
+    "PlannedOperation", ["operation_name", "func", "image_class", "path", "cost"]
+)
+
+
+class _RegistrySnapshot:
+    """
+    Everything that was registered at one point in time, along with the
+    indexes and route caches that are derived from it.
+
+    Registering something never changes the registry's dicts and sets in place,
+    it replaces them with updated copies. So once a snapshot has been made, it
+    never changes (apart from its route caches filling up) and can be read from
+    any thread without a lock.
+    """
+
+    __slots__ = [
+        "image_classes",
+        "operations",
+        "converters",
+        "converter_costs",
+        "measured_converter_costs",
+        "cost_profile",
+        "operation_index",
+        "converter_index",
+        "operation_routes",
+        "shortest_paths",
+    ]
+
+    def __init__(self, registry):
+        self.image_classes = registry._registered_image_classes
+        self.operations = registry._registered_operations
+        self.converters = registry._registered_converters
+        self.converter_costs = registry._registered_converter_costs
+        self.measured_converter_costs = registry._measured_converter_costs
+        self.cost_profile = registry._cost_profile
+
+        # Maps each operation name to the image classes that implement it
+        operation_index = defaultdict(set)
+        for image_class, operations in self.operations.items():
+            for operation_name in operations:
+                operation_index[operation_name].add(image_class)
+
+        self.operation_index = {
+            operation_name: frozenset(image_classes)
+            for operation_name, image_classes in operation_index.items()
+        }
+
+        # Maps each image class to a tuple of (converter, image_class) pairs
+        # for the image classes it can be converted into
+        converter_index = defaultdict(list)
+        for (c_from, c_to), converter in self.converters.items():
+            converter_index[c_from].append((converter, c_to))
+
+        self.converter_index = {
+            image_class: tuple(converters)
+            for image_class, converters in converter_index.items()
+        }
+
+        # Cache of find_operation results, keyed by (from_class, operation_name)
+        # and of find_shortest_path results, keyed by (start, end)
+        self.operation_routes = {}
+        self.shortest_paths = {}
+
+    def get_operation(self, image_class, operation_name):
+        return self.operations.get(image_class, {})[operation_name]
+
+    def get_converter(self, from_image_class, to_image_class):
+        return self.converters[from_image_class, to_image_class]
+
+    def get_converters_from(self, from_image_class):
+        return self.converter_index.get(from_image_class, ())
+
+
 class WillowRegistry:
     def __init__(self):
         self._registered_image_classes = set()
         self._unavailable_image_classes = {}
+        self._unchecked_image_classes = set()
         self._registered_operations = defaultdict(dict)
         self._registered_converters = {}
         self._registered_converter_costs = {}
+        self._measured_converter_costs = {}
+        # The (width, height, frames) of the image that converter cost
+        # functions are evaluated for, see set_cost_profile()
+        self._cost_profile = (1000, 1000, 1)
         self._registered_optimizers: list[OptimizerBase] = []
+        self._optimizer_availability: dict[OptimizerBase, bool] = {}
+        self._optimizer_cache: OptimizerCache | None = None
+        self._optimizer_cache_is_set = False
+
+        # Held while registering things and while building a snapshot. Reading
+        # from the registry doesn't need it, see _get_snapshot()
+        self._lock = threading.RLock()
+        self._frozen = False
+        self._snapshot = None
+
+        self._installed_dispatchers = []
+        self._route_cache_hits = 0
+        self._route_cache_misses = 0
 
     def register_operation(self, image_class, operation_name, func):
-        self._registered_operations[image_class][operation_name] = func
+        with self._lock:
+            self._check_not_frozen()
+
+            operations = defaultdict(dict, self._registered_operations)
+            operations[image_class] = {
+                **operations[image_class],
+                operation_name: func,
+            }
+            self._registered_operations = operations
+            self._invalidate_routes()
 
     def register_converter(self, from_image_class, to_image_class, func, cost=None):
-        self._registered_converters[from_image_class, to_image_class] = func
+        with self._lock:
+            self._check_not_frozen()
 
-        if cost is not None:
-            self._registered_converter_costs[from_image_class, to_image_class] = cost
+            self._registered_converters = {
+                **self._registered_converters,
+                (from_image_class, to_image_class): func,
+            }
 
-    def register_image_class(self, image_class):
-        self._registered_image_classes.add(image_class)
+            if cost is not None:
+                self._registered_converter_costs = {
+                    **self._registered_converter_costs,
+                    (from_image_class, to_image_class): cost,
+                }
 
-        # Check the image class
-        try:
-            image_class.check()
-        except Exception as e:  # noqa: BLE001
-            self._unavailable_image_classes[image_class] = e
-
-        # Find and register operations/converters
-        for attr in dir(image_class):
-            val = getattr(image_class, attr)
-            if hasattr(val, "_willow_operation"):
-                self.register_operation(image_class, val.__name__, val)
-            elif hasattr(val, "_willow_converter_to"):
-                self.register_converter(
-                    image_class,
-                    val._willow_converter_to[0],
-                    val,
-                    cost=val._willow_converter_to[1],
-                )
-            elif hasattr(val, "_willow_converter_from"):
-                for converter_from, cost in val._willow_converter_from:
-                    self.register_converter(converter_from, image_class, val, cost=cost)
+            self._invalidate_routes()
+
+    def register_image_class(self, image_class):
+        with self._lock:
+            self._check_not_frozen()
+
+            # The image class is checked the first time it's needed for routing.
+            # Checking usually imports the underlying image library, which is
+            # slow and often unnecessary (e.g. Wand and OpenCV are only needed
+            # when an operation can't be done with Pillow)
+            self._unchecked_image_classes.add(image_class)
+
+            self._registered_image_classes = self._registered_image_classes | {
+                image_class
+            }
+            self._invalidate_routes()
+
+            # Find and register operations/converters
+            for attr in dir(image_class):
+                val = getattr(image_class, attr)
+                if hasattr(val, "_willow_operation"):
+                    self.register_operation(image_class, val.__name__, val)
+                elif hasattr(val, "_willow_converter_to"):
+                    self.register_converter(
+                        image_class,
+                        val._willow_converter_to[0],
+                        val,
+                        cost=val._willow_converter_to[1],
+                    )
+                elif hasattr(val, "_willow_converter_from"):
+                    for converter_from, cost in val._willow_converter_from:
+                        self.register_converter(
+                            converter_from, image_class, val, cost=cost
+                        )
 
     def register_plugin(self, plugin):
         image_classes = getattr(plugin, "willow_image_classes", [])
         operations = getattr(plugin, "willow_operations", [])
         converters = getattr(plugin, "willow_converters", [])
 
-        for image_class in image_classes:
-            self.register_image_class(image_class)
+        with self._lock:
+            self._check_not_frozen()
 
-        for operation in operations:
-            self.register_operation(operation[0], operation[1], operation[2])
+            for image_class in image_classes:
+                self.register_image_class(image_class)
 
-        for converter in converters:
-            self.register_converter(converter[0], converter[1], converter[2])
+            for operation in operations:
+                self.register_operation(operation[0], operation[1], operation[2])
+
+            for converter in converters:
+                self.register_converter(converter[0], converter[1], converter[2])
+
+            self._invalidate_routes()
 
     def register_optimizer(self, optimizer_class: "OptimizerBase"):
-        """Registers an optimizer class."""
-        try:
-            # try to check Django settings, if used in that context
-            from django.conf import settings
+        """
+        Registers an optimizer class, if it is enabled by the WILLOW_OPTIMIZERS
+        setting.
 
-            enabled_optimizers = getattr(settings, "WILLOW_OPTIMIZERS", False)
-        except ImportError:
-            # fall back to env vars.
-            import os
+        Optimizers whose library isn't installed are skipped when they're first
+        needed by get_optimizers_for_format.
+        """
+        self._check_not_frozen()
 
-            enabled_optimizers = os.environ.get("WILLOW_OPTIMIZERS", False)
+        enabled_optimizers = _get_setting("WILLOW_OPTIMIZERS", False)
 
         if not enabled_optimizers:
             # WILLOW_OPTIMIZERS is either not set, or is set to a false-y value, so skip registration
@@ -118,53 +272,102 @@ class WillowRegistry:
         else:
             add_optimizer = optimizer_class.library_name in enabled_optimizers
 
-        if (
-            add_optimizer
-            and optimizer_class.check_library()
-            and optimizer_class not in self._registered_optimizers
-        ):
-            self._registered_optimizers.append(optimizer_class)
+        # The library is checked the first time the optimizer is needed, see
+        # get_optimizers_for_format. Checking runs the library in a subprocess,
+        # which would otherwise slow down the start of every process.
+        if add_optimizer:
+            with self._lock:
+                self._check_not_frozen()
+
+                if optimizer_class not in self._registered_optimizers:
+                    self._registered_optimizers = [
+                        *self._registered_optimizers,
+                        optimizer_class,
+                    ]
+
+    def _is_available(self, image_class):
+        """
+        Returns False if the image class raised an error when it was checked,
+        checking it first if that hasn't happened yet.
+        """
+        if image_class in self._unchecked_image_classes:
+            try:
+                image_class.check()
+            except Exception as e:  # noqa: BLE001
+                self._unavailable_image_classes[image_class] = e
+
+            # The class is only marked as checked once the result has been
+            # recorded, so other threads can't see it as available before then
+            self._unchecked_image_classes.discard(image_class)
+
+        return image_class not in self._unavailable_image_classes
 
     def get_operation(self, image_class, operation_name):
-        return self._registered_operations[image_class][operation_name]
+        return self._get_snapshot().get_operation(image_class, operation_name)
 
     def operation_exists(self, operation_name):
-        for image_class_operations in self._registered_operations.values():
-            if operation_name in image_class_operations:
-                return True
-
-        return False
+        return operation_name in self._get_snapshot().operation_index
 
     def get_converter(self, from_image_class, to_image_class):
-        return self._registered_converters[from_image_class, to_image_class]
+        return self._get_snapshot().get_converter(from_image_class, to_image_class)
 
     def get_converter_cost(self, from_image_class, to_image_class):
-        return self._registered_converter_costs.get(
-            (from_image_class, to_image_class), 100
+        """
+        Returns the cost of converting from one image class into another.
+
+        Costs measured by autotune_converter_costs() take precedence over
+        registered costs. A registered cost can either be a number or a function
+        which takes (width, height, frames, image_format) and returns a number.
+        These are called with the cost profile set with set_cost_profile() and
+        the format of from_image_class (or None if it isn't an image file).
+        """
+        return self._get_converter_cost(
+            self._get_snapshot(), from_image_class, to_image_class
         )
 
+    def _get_converter_cost(self, snapshot, from_image_class, to_image_class):
+        key = (from_image_class, to_image_class)
+
+        try:
+            return snapshot.measured_converter_costs[key]
+        except KeyError:
+            pass
+
+        cost = snapshot.converter_costs.get(key, 100)
+
+        if callable(cost):
+            width, height, frames = snapshot.cost_profile
+            image_format = getattr(from_image_class, "format_name", None)
+            if not isinstance(image_format, str):
+                image_format = None
+
+            cost = cost(width, height, frames, image_format)
+
+        return cost
+
     def get_image_classes(self, with_operation=None, available=None):
-        image_classes = self._registered_image_classes.copy()
+        return self._get_image_classes(
+            self._get_snapshot(), with_operation=with_operation, available=available
+        )
 
+    def _get_image_classes(self, snapshot, with_operation=None, available=None):
         if with_operation:
-            image_classes = set(
-                filter(
-                    lambda image_class: image_class in self._registered_operations
-                    and with_operation in self._registered_operations[image_class],
-                    image_classes,
-                )
-            )
+            image_classes = {
+                image_class
+                for image_class in snapshot.operation_index.get(with_operation, ())
+                if image_class in snapshot.image_classes
+            }
 
             if not image_classes:
                 raise UnrecognisedOperationError(
                     f"Could not find image class with the '{with_operation}' operation"
                 )
+        else:
+            image_classes = set(snapshot.image_classes)
 
         if available:
             # Remove unavailable image classes
-            available_image_classes = image_classes - set(
-                self._unavailable_image_classes.keys()
-            )
+            available_image_classes = set(filter(self._is_available, image_classes))
 
             # Raise error if all image classes failed the check
             if not available_image_classes:
@@ -194,11 +397,186 @@ class WillowRegistry:
     def get_optimizers_for_format(self, image_format: str) -> list["OptimizerBase"]:
         optimizers = []
         for optimizer in self._registered_optimizers:
-            if optimizer.applies_to(image_format):
+            if optimizer.applies_to(image_format) and self._is_optimizer_available(
+                optimizer
+            ):
                 optimizers.append(optimizer)
 
         return optimizers
 
+    def set_optimizer_cache(self, cache: Optional["OptimizerCache"]):
+        """
+        Sets the OptimizerCache that Image.optimize stores optimized images
+        in, or None to not cache them.
+        """
+        self._optimizer_cache = cache
+        self._optimizer_cache_is_set = True
+
+    def get_optimizer_cache(self) -> Optional["OptimizerCache"]:
+        """
+        Returns the OptimizerCache that Image.optimize stores optimized images
+        in, if any. Unless one has been set with set_optimizer_cache, it's
+        created from the WILLOW_OPTIMIZER_CACHE setting (the directory) and the
+        WILLOW_OPTIMIZER_CACHE_SIZE setting (the maximum size in bytes) the
+        first time it's needed.
+        """
+        if not self._optimizer_cache_is_set:
+            directory = _get_setting("WILLOW_OPTIMIZER_CACHE")
+
+            if directory:
+                from .optimizers.cache import DEFAULT_MAX_SIZE, OptimizerCache
+
+                max_size = int(
+                    _get_setting("WILLOW_OPTIMIZER_CACHE_SIZE", DEFAULT_MAX_SIZE)
+                )
+                self.set_optimizer_cache(OptimizerCache(directory, max_size))
+            else:
+                self.set_optimizer_cache(None)
+
+        return self._optimizer_cache
+
+    def _is_optimizer_available(self, optimizer_class: "OptimizerBase") -> bool:
+        try:
+            return self._optimizer_availability[optimizer_class]
+        except KeyError:
+            available = optimizer_class.check_library()
+            self._optimizer_availability[optimizer_class] = available
+            return available
+
+    # Snapshots
+
+    # Servers often register plugins while other threads are processing
+    # images. Rather than locking every lookup, registering something replaces
+    # the registered dicts and sets with updated copies and throws away the
+    # current snapshot. The next lookup builds a new snapshot (along with its
+    # indexes) from the replacements, while any lookups that are already
+    # running carry on using the snapshot they started with.
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+
+        if snapshot is None:
+            with self._lock:
+                # Another thread may have built it while we waited for the lock
+                snapshot = self._snapshot
+
+                if snapshot is None:
+                    snapshot = self._snapshot = _RegistrySnapshot(self)
+
+        return snapshot
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise RegistryFrozenError(
+                "Nothing else can be registered once the registry has been frozen"
+            )
+
+    def freeze(self):
+        """
+        Works out every route up front (see compile_routes()), checks the
+        library of every registered optimizer and then prevents anything else
+        from being registered.
+
+        This is intended to be called once setup has finished in production, so
+        nothing needs to be imported or worked out while processing images.
+        Registering anything afterwards raises RegistryFrozenError.
+        """
+        with self._lock:
+            self.compile_routes()
+
+            for optimizer in self._registered_optimizers:
+                self._is_optimizer_available(optimizer)
+
+            self._frozen = True
+
+    # Converter costs
+
+    # Registered converter costs are estimates. Cost functions let them depend
+    # on the size of the images being processed, and autotuning replaces them
+    # with how long each converter actually takes on this machine.
+
+    def set_cost_profile(self, width, height, frames=1):
+        """
+        Sets the size (and number of frames) of a typical image, which converter
+        cost functions are evaluated for when routing. They're evaluated for
+        this one profile rather than for each image, so that routes can be
+        cached.
+        """
+        with self._lock:
+            self._check_not_frozen()
+
+            self._cost_profile = (width, height, frames)
+            self._invalidate_routes()
+
+    def autotune_converter_costs(self, image_files, repeat=3):
+        """
+        Measures how long each available converter takes, and uses the measured
+        costs for routing instead of the registered ones.
+
+        image_files is a list of sample images (usually ImageFile instances
+        returned by Image.open). Starting from each of them, every converter
+        that can be reached is timed (taking the best of repeat runs).
+        Converters that raise an error for a sample are skipped.
+
+        The measured times are scaled so the median converter costs 100, which
+        keeps them comparable with the registered costs of any converters that
+        couldn't be measured. Returns a dict of the measured costs, keyed by
+        (from_image_class, to_image_class).
+        """
+        self._check_not_frozen()
+
+        timings = {}
+
+        for image_file in image_files:
+            queue = [image_file]
+            seen = {type(image_file)}
+
+            while queue:
+                image = queue.pop(0)
+                from_image_class = type(image)
+
+                for converter, to_image_class in self.get_converters_from(
+                    from_image_class
+                ):
+                    if not self._is_available(to_image_class):
+                        continue
+
+                    best = None
+                    try:
+                        for _ in range(repeat):
+                            start = time.perf_counter()
+                            converted = converter(image)
+                            elapsed = time.perf_counter() - start
+
+                            if best is None or elapsed < best:
+                                best = elapsed
+                    except Exception:  # noqa: BLE001
+                        continue
+
+                    key = (from_image_class, to_image_class)
+                    timings[key] = min(best, timings.get(key, best))
+
+                    if to_image_class not in seen:
+                        seen.add(to_image_class)
+                        queue.append(converted)
+
+        if timings:
+            median = statistics.median(timings.values()) or 1
+            measured_converter_costs = {
+                key: max(1, round(elapsed / median * 100))
+                for key, elapsed in timings.items()
+            }
+        else:
+            measured_converter_costs = {}
+
+        with self._lock:
+            self._check_not_frozen()
+
+            self._measured_converter_costs = measured_converter_costs
+            self._invalidate_routes()
+
+        return dict(measured_converter_costs)
+
     # Routing
 
     # In some cases, it may not be possible to convert directly between two
@@ -226,9 +604,7 @@ class WillowRegistry:
             ...
         ]
         """
-        for (c_from, c_to), converter in self._registered_converters.items():
-            if c_from is from_image_class:
-                yield converter, c_to
+        return iter(self._get_snapshot().get_converters_from(from_image_class))
 
     def find_all_paths(self, start, end, path=[], seen_classes=set()):
         """
@@ -261,10 +637,7 @@ class WillowRegistry:
         if start in seen_classes:
             return []
 
-        if (
-            start not in self._registered_image_classes
-            or start in self._unavailable_image_classes
-        ):
+        if not self._can_route_through(self._get_snapshot(), start):
             return []
 
         paths = []
@@ -285,56 +658,148 @@ class WillowRegistry:
         """
         Costs up a path and returns the cost as an integer.
         """
+        snapshot = self._get_snapshot()
         last_class = start
         total_cost = 0
 
         for converter, next_class in path:
-            total_cost += self.get_converter_cost(last_class, next_class)
+            total_cost += self._get_converter_cost(snapshot, last_class, next_class)
             last_class = next_class
 
         return total_cost
 
+    def _class_sort_key(self, image_class):
+        # Used to break ties between equally cheap routes so the chosen path
+        # doesn't depend on dict/set iteration order
+        return f"{image_class.__module__}.{image_class.__qualname__}"
+
+    def _can_route_through(self, snapshot, image_class):
+        return image_class in snapshot.image_classes and self._is_available(image_class)
+
+    def _find_paths_from(self, snapshot, start):
+        """
+        Yields (image_class, path, cost) for every image class reachable from
+        start, cheapest first.
+
+        This uses Dijkstra's algorithm, weighted by the converter costs, so only
+        the cheapest path to each class is ever expanded. Ties between equally
+        cheap paths are broken by preferring fewer steps and then by the names
+        of the classes along the path, so the result is deterministic.
+        """
+        counter = itertools.count()
+
+        # Each entry is (cost, steps, tie-break key, counter, image class, path)
+        queue = [(0, 0, (), next(counter), start, [])]
+        visited = set()
+
+        while queue:
+            cost, steps, key, _, image_class, path = heapq.heappop(queue)
+
+            if image_class in visited:
+                continue
+
+            visited.add(image_class)
+            yield image_class, path, cost
+
+            # Checking whether a class is available can import its library, so
+            # classes that can't be converted any further (such as the probes)
+            # aren't checked
+            converters = snapshot.get_converters_from(image_class)
+            if not converters or not self._can_route_through(snapshot, image_class):
+                continue
+
+            for converter, next_class in converters:
+                if next_class in visited:
+                    continue
+
+                heapq.heappush(
+                    queue,
+                    (
+                        cost
+                        + self._get_converter_cost(snapshot, image_class, next_class),
+                        steps + 1,
+                        key + (self._class_sort_key(next_class),),
+                        next(counter),
+                        next_class,
+                        path + [(converter, next_class)],
+                    ),
+                )
+
     def find_shortest_path(self, start, end):
         """
         Finds the shortest path between two image classes.
 
-        This is similar to the find_all_paths function, except it only returns
-        the path with the lowest cost.
+        Returns the path in the same format as find_all_paths along with its
+        total cost. If there is no path, this returns (None, None).
         """
-        current_path = None
-        current_cost = None
+        return self._find_shortest_path(self._get_snapshot(), start, end)
 
-        for path in self.find_all_paths(start, end):
-            cost = self.get_path_cost(start, path)
-
-            if current_cost is None or cost < current_cost:
-                current_cost = cost
-                current_path = path
+    def _find_shortest_path(self, snapshot, start, end):
+        try:
+            return snapshot.shortest_paths[start, end]
+        except KeyError:
+            pass
 
-        return current_path, current_cost
+        _, path, cost = self._find_closest_image_class(snapshot, start, [end])
+        snapshot.shortest_paths[start, end] = path, cost
+        return path, cost
 
     def find_closest_image_class(self, start, image_classes):
         """
         Finds which of the specified image classes is the closest, based on the
         sum of the costs for the conversions needed to convert the image into it.
+
+        Returns a tuple of (image_class, path, cost). If none of the image
+        classes can be reached, this returns (None, None, None).
         """
-        current_class = None
-        current_path = None
-        current_cost = None
+        return self._find_closest_image_class(
+            self._get_snapshot(), start, image_classes
+        )
 
-        for image_class in image_classes:
-            path, cost = self.find_shortest_path(start, image_class)
+    def _find_closest_image_class(self, snapshot, start, image_classes):
+        image_classes = set(image_classes)
 
-            if cost is None:
-                # no path found, e.g. from BMP to SVG
-                continue
+        for image_class, path, cost in self._find_paths_from(snapshot, start):
+            if image_class in image_classes:
+                return image_class, path, cost
+
+        return None, None, None
+
+    # Route cache
 
-            if current_cost is None or cost < current_cost:
-                current_class = image_class
-                current_cost = cost
-                current_path = path
+    # Finding an operation happens every time an operation is called on an
+    # image, but the result only changes when something new is registered. So
+    # the results of find_operation are cached in the current snapshot, and
+    # thrown away along with it.
 
-        return current_class, current_path, current_cost
+    def _invalidate_routes(self):
+        self._snapshot = None
+        self._uninstall_dispatchers()
+
+    def clear_route_cache(self):
+        """
+        Empties the route cache and resets its statistics. A frozen registry
+        keeps the routes it compiled, so this raises RegistryFrozenError.
+        """
+        with self._lock:
+            self._check_not_frozen()
+            self._invalidate_routes()
+            self._route_cache_hits = 0
+            self._route_cache_misses = 0
+
+    def route_cache_info(self):
+        """
+        Returns a named tuple of (hits, misses, currsize) describing how
+        effective the route cache used by find_operation has been. Calls to
+        dispatchers (see get_dispatcher()) are counted as hits.
+        """
+        snapshot = self._snapshot
+
+        return RouteCacheInfo(
+            self._route_cache_hits,
+            self._route_cache_misses,
+            len(snapshot.operation_routes) if snapshot is not None else 0,
+        )
 
     def find_operation(self, from_class, operation_name):
         """
@@ -365,6 +830,9 @@ class WillowRegistry:
         any image class that implements it or all the image classes that implement
         it are unavailable, a LookupError will be raised.
 
+        Results (including failures) are cached until the next time something
+        is registered, see route_cache_info().
+
         Basic example:
 
             >>> func, cls, path, cost = registry.find_operation(JPEGImageFile, 'resize')
@@ -389,25 +857,60 @@ class WillowRegistry:
             ...
             >>> func(image, *args, **kwargs)
         """
+        return self._get_route(self._get_snapshot(), from_class, operation_name)
+
+    def _get_route(self, snapshot, from_class, operation_name):
+        key = (from_class, operation_name)
+
+        try:
+            route = snapshot.operation_routes[key]
+        except KeyError:
+            self._route_cache_misses += 1
+
+            try:
+                route = self._find_operation(snapshot, from_class, operation_name)
+            except LookupError as e:
+                # Remember failed lookups too, as hasattr() checks on images
+                # will repeatedly ask for operations that don't exist
+                snapshot.operation_routes[key] = type(e)(*e.args)
+                raise
+
+            snapshot.operation_routes[key] = route
+        else:
+            self._route_cache_hits += 1
+
+        if isinstance(route, LookupError):
+            raise type(route)(*route.args)
+
+        return route
+
+    def _find_operation(self, snapshot, from_class, operation_name):
         try:
             # Firstly, we check if the operation is implemented on from_class
-            func = self.get_operation(from_class, operation_name)
+            func = snapshot.get_operation(from_class, operation_name)
             cls = from_class
             path = []
             cost = 0
         except LookupError:
             # Not implemented on the current class. Find the closest, available,
             # routable class that has it instead
-            image_classes = self.get_image_classes(
-                with_operation=operation_name, available=True
+            # This raises LookupError if no image classes have the operation
+            image_classes = self._get_image_classes(
+                snapshot, with_operation=operation_name
             )
 
-            # Choose an image class
-            # image_classes will always have a value here as get_image_classes raises
-            # LookupError if there are no image classes available.
-            cls, path, cost = self.find_closest_image_class(from_class, image_classes)
+            # Image classes are only checked for availability as they're
+            # reached, cheapest first, so libraries behind more expensive routes
+            # don't need to be imported
+            for cls, path, cost in self._find_paths_from(snapshot, from_class):
+                if cls in image_classes and self._is_available(cls):
+                    break
+            else:
+                # This raises LookupError if none of the image classes are available
+                image_classes = self._get_image_classes(
+                    snapshot, with_operation=operation_name, available=True
+                )
 
-            if path is None:
                 raise UnroutableOperationError(
                     "The operation '{}' is available in the image class '{}'"
                     " but it can't be converted to from '{}'".format(
@@ -420,9 +923,324 @@ class WillowRegistry:
                 )
 
             # Get the operation function
-            func = self.get_operation(cls, operation_name)
+            func = snapshot.get_operation(cls, operation_name)
 
         return func, cls, path, cost
 
+    # Planning
+
+    # When several operations are run one after the other, routing each one
+    # separately only minimises the cost of that step. For example, an
+    # operation might be routed to a class that's cheap to get to but expensive
+    # to get out of for the next operation. Planning the whole chain at once
+    # finds the cheapest route through all of them.
+
+    def plan_operations(self, from_class, operation_names):
+        """
+        Finds the cheapest way to run a list of operations, one after the other,
+        on an image of from_class.
+
+        This returns a list with a PlannedOperation named tuple for each
+        operation, containing:
+         - The operation name
+         - The operation function
+         - The class which the operation will be run on
+         - A path to convert the image into that class from the class the
+           previous operation was run on (or from_class for the first one)
+         - The cost of the conversions in that path
+
+        The plan assumes that operations return an image of the class they were
+        run on, which is the case for operations that transform the image (such
+        as resize and crop). See Image.run_operations for running a plan.
+
+        If any of the operations can't be routed to, a LookupError is raised.
+        """
+        snapshot = self._get_snapshot()
+
+        # Maps the class the image could be in after each step to the cheapest
+        # total cost and list of steps that gets it there
+        states = {from_class: (0, [])}
+
+        for operation_name in operation_names:
+            # This raises LookupError if no image classes have the operation
+            image_classes = sorted(
+                self._get_image_classes(snapshot, with_operation=operation_name),
+                key=self._class_sort_key,
+            )
+
+            next_states = {}
+            for image_class in image_classes:
+                for state_class, (state_cost, steps) in states.items():
+                    if state_class is image_class:
+                        path, cost = [], 0
+                    elif self._is_available(image_class):
+                        path, cost = self._find_shortest_path(
+                            snapshot, state_class, image_class
+                        )
+                        if path is None:
+                            continue
+                    else:
+                        continue
+
+                    total_cost = state_cost + cost
+                    if (
+                        image_class not in next_states
+                        or total_cost < next_states[image_class][0]
+                    ):
+                        step = PlannedOperation(
+                            operation_name,
+                            snapshot.get_operation(image_class, operation_name),
+                            image_class,
+                            path,
+                            cost,
+                        )
+                        next_states[image_class] = total_cost, steps + [step]
+
+            if not next_states:
+                # Let find_operation raise an error explaining why the operation
+                # can't be routed to
+                cheapest_class = min(states, key=lambda c: states[c][0])
+                self._get_route(snapshot, cheapest_class, operation_name)
+
+                raise UnroutableOperationError(
+                    f"Could not plan a route to the '{operation_name}' operation"
+                )
+
+            states = next_states
+
+        _, steps = min(states.values(), key=lambda state: state[0])
+        return steps
+
+    # Dispatchers
+
+    # Image.__getattr__ uses dispatchers to run operations which aren't
+    # implemented on the image's class. A dispatcher is a plain function that
+    # converts the image along the route found by find_operation and then calls
+    # the operation. They are installed onto the image class the first time
+    # they're used so, from then on, looking up the operation is the same as
+    # looking up any other method and doesn't go through __getattr__. Only
+    # the global registry (which __getattr__ uses) installs them, as the image
+    # classes are shared by every registry.
+
+    def get_dispatcher(self, image_class, operation_name):
+        """
+        Returns a function which takes an image of image_class as its first
+        argument, converts it to the class implementing operation_name and runs
+        the operation on it with the remaining arguments.
+
+        If this is the global registry and image_class is registered, the
+        function is also set as an attribute of image_class so instances get it
+        as a bound method. Installed dispatchers are removed the next time
+        something is registered.
+
+        Raises LookupError if the operation can't be found or routed to.
+        """
+        snapshot = self._get_snapshot()
+        route = self._get_route(snapshot, image_class, operation_name)
+        return self._install_dispatcher(snapshot, image_class, operation_name, route)
+
+    def _install_dispatcher(self, snapshot, image_class, operation_name, route):
+        func, _, path, _ = route
+        converters = tuple(converter for converter, _ in path)
+        owner = self
+
+        def dispatcher(image, *args, **kwargs):
+            if owner._snapshot is not snapshot:
+                # Something has been registered since the route was found. This
+                # only happens if another thread installed this dispatcher just
+                # as the registration was removing the old ones
+                return owner.get_dispatcher(image_class, operation_name)(
+                    image, *args, **kwargs
+                )
+
+            image_type = type(image)
+            if image_type is not image_class and image_type in snapshot.image_classes:
+                # Called on a registered subclass, which may have its own route
+                return owner.get_dispatcher(image_type, operation_name)(
+                    image, *args, **kwargs
+                )
+
+            # Calling an installed dispatcher skips find_operation, so it's
+            # counted as a route cache hit here
+            owner._route_cache_hits += 1
+
+            for converter in converters:
+                image = converter(image)
+
+            return func(image, *args, **kwargs)
+
+        dispatcher.__name__ = operation_name
+        dispatcher.__qualname__ = f"{image_class.__qualname__}.{operation_name}"
+        dispatcher.__doc__ = getattr(func, "__doc__", None)
+        dispatcher._willow_dispatcher = True
+
+        if self is registry and image_class in snapshot.image_classes:
+            existing = getattr(image_class, operation_name, None)
+            if existing is None or getattr(existing, "_willow_dispatcher", False):
+                setattr(image_class, operation_name, dispatcher)
+                self._installed_dispatchers.append(
+                    (image_class, operation_name, dispatcher)
+                )
+
+        return dispatcher
+
+    def _uninstall_dispatchers(self):
+        for image_class, operation_name, dispatcher in self._installed_dispatchers:
+            if vars(image_class).get(operation_name) is dispatcher:
+                delattr(image_class, operation_name)
+
+        self._installed_dispatchers = []
+
+    # Compiled routes
+
+    # Rather than discovering routes lazily, every route can be worked out up
+    # front with compile_routes(). This is useful for pre-forking servers, as
+    # the workers inherit the compiled routes from the parent process. The
+    # routes can also be dumped to a JSON-compatible dict and loaded back in by
+    # another process with the same registrations.
+
+    def _get_routing_signature(self, snapshot):
+        """
+        Returns a string which changes whenever anything that affects routing
+        is registered or becomes unavailable.
+        """
+        classes = sorted(
+            (
+                self._class_sort_key(image_class),
+                self._is_available(image_class),
+                sorted(snapshot.operations.get(image_class, {})),
+            )
+            for image_class in snapshot.image_classes
+        )
+        converters = sorted(
+            (
+                self._class_sort_key(c_from),
+                self._class_sort_key(c_to),
+                self._get_converter_cost(snapshot, c_from, c_to),
+            )
+            for c_from, c_to in snapshot.converters
+        )
+
+        return hashlib.sha1(repr((classes, converters)).encode()).hexdigest()
+
+    def compile_routes(self):
+        """
+        Works out the cheapest path between every pair of registered image
+        classes and the route to every operation from every registered image
+        class, and stores them in the route cache. In the global registry,
+        dispatchers are installed for every operation that can be routed to,
+        see get_dispatcher().
+
+        The compiled routes are discarded the next time something is registered.
+        """
+        snapshot = self._get_snapshot()
+
+        for start in snapshot.image_classes:
+            for end, path, cost in self._find_paths_from(snapshot, start):
+                snapshot.shortest_paths[start, end] = path, cost
+
+            for operation_name in snapshot.operation_index:
+                route = snapshot.operation_routes.get((start, operation_name))
+
+                if route is None:
+                    try:
+                        route = self._find_operation(snapshot, start, operation_name)
+                    except LookupError as e:
+                        route = e
+
+                    snapshot.operation_routes[start, operation_name] = route
+
+                if not isinstance(route, LookupError):
+                    self._install_dispatcher(snapshot, start, operation_name, route)
+
+    def dump_routes(self):
+        """
+        Returns the currently cached routes as a JSON-compatible dict, which can
+        be passed to load_routes() in another process.
+
+        Image classes are referred to by their import path, and converters and
+        operations are looked up again when the routes are loaded. Call
+        compile_routes() first to dump every route.
+        """
+        snapshot = self._get_snapshot()
+
+        def dump_path(path):
+            return [self._class_sort_key(image_class) for _, image_class in path]
+
+        paths = []
+        for (start, _), (path, cost) in list(snapshot.shortest_paths.items()):
+            if path is not None:
+                paths.append([self._class_sort_key(start), dump_path(path), cost])
+
+        operations = []
+        for (from_class, operation_name), route in list(
+            snapshot.operation_routes.items()
+        ):
+            if not isinstance(route, LookupError):
+                _, _, path, cost = route
+                operations.append(
+                    [
+                        self._class_sort_key(from_class),
+                        operation_name,
+                        dump_path(path),
+                        cost,
+                    ]
+                )
+
+        return {
+            "signature": self._get_routing_signature(snapshot),
+            "paths": paths,
+            "operations": operations,
+        }
+
+    def load_routes(self, routes):
+        """
+        Loads routes which were previously returned by dump_routes() into the
+        route cache.
+
+        The routes are only loaded if they were dumped from a registry with the
+        same image classes, operations and converters as this one (including
+        which image classes are available). Returns True if they were loaded.
+        """
+        snapshot = self._get_snapshot()
+
+        if routes.get("signature") != self._get_routing_signature(snapshot):
+            return False
+
+        image_classes = {
+            self._class_sort_key(image_class): image_class
+            for image_class in snapshot.image_classes
+        }
+
+        def resolve_path(start, class_names):
+            path = []
+            last_class = start
+            for class_name in class_names:
+                next_class = image_classes[class_name]
+                path.append(
+                    (snapshot.get_converter(last_class, next_class), next_class)
+                )
+                last_class = next_class
+            return path
+
+        shortest_paths = {}
+        for start_name, class_names, cost in routes["paths"]:
+            start = image_classes[start_name]
+            path = resolve_path(start, class_names)
+            end = path[-1][1] if path else start
+            shortest_paths[start, end] = path, cost
+
+        operation_routes = {}
+        for from_name, operation_name, class_names, cost in routes["operations"]:
+            from_class = image_classes[from_name]
+            path = resolve_path(from_class, class_names)
+            cls = path[-1][1] if path else from_class
+            func = snapshot.get_operation(cls, operation_name)
+            operation_routes[from_class, operation_name] = func, cls, path, cost
+
+        snapshot.shortest_paths.update(shortest_paths)
+        snapshot.operation_routes.update(operation_routes)
+        return True
+
 
 registry = WillowRegistry()
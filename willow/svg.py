@@ -307,7 +307,9 @@ class SvgImage(Image):
         return self.__class__(image=svg_wrapper)
 
     @Image.operation
-    def resize(self, size):
+    def resize(self, size, resample=None, reducing_gap=None):
+        # resample and reducing_gap are accepted for compatibility with other
+        # image classes. SVGs are vectors, so there's nothing to resample
         new_width, new_height = size
         if new_width < 1 or new_height < 1:
             raise BadImageOperationError(f"Invalid resize dimensions: {size}")
@@ -317,6 +319,37 @@ class SvgImage(Image):
         svg_wrapper.set_height(new_height)
         return self.__class__(image=svg_wrapper)
 
+    @Image.operation
+    def crop_and_resize(
+        self,
+        rect,
+        size,
+        resample=None,
+        reducing_gap=None,
+        get_transformer=get_viewport_to_user_space_transform,
+    ):
+        # resample and reducing_gap are ignored, see resize
+        left, top, right, bottom = rect
+        if left >= right or top >= bottom:
+            raise BadImageOperationError(f"Invalid crop dimensions: {rect}")
+
+        new_width, new_height = size
+        if new_width < 1 or new_height < 1:
+            raise BadImageOperationError(f"Invalid resize dimensions: {size}")
+
+        transformed_rect = get_transformer(self)(rect)
+        left, top, right, bottom = transformed_rect
+
+        # The view box selects the cropped area, which is then scaled to fill
+        # the new width and height
+        svg_wrapper = copy(self.image)
+        view_box_width = right - left
+        view_box_height = bottom - top
+        svg_wrapper.set_view_box(ViewBox(left, top, view_box_width, view_box_height))
+        svg_wrapper.set_width(new_width)
+        svg_wrapper.set_height(new_height)
+        return self.__class__(image=svg_wrapper)
+
     @Image.operation
     def get_size(self):
         return (self.image.width, self.image.height)